@@ -18,7 +18,7 @@ we register.
 
 import logging
 import os
-import struct
+import time
 from typing import Set, Tuple, Optional
 
 import bpy
@@ -29,6 +29,7 @@ from mixer.share_data import share_data
 from mixer.broadcaster import common
 from mixer.broadcaster.common import ClientAttributes, MessageType, RoomAttributes
 from mixer.broadcaster.client import Client
+from mixer.broadcaster.presence import PRESENCE_TICK
 from mixer.blender_client import camera as camera_api
 from mixer.blender_client import collection as collection_api
 from mixer.blender_client import data as data_api
@@ -105,6 +106,8 @@ class BlenderClient(Client):
         self._joining_room_name: Optional[str] = None
         self._received_command_count: int = 0
         self._received_byte_size: int = 0
+        # The client attributes are sent at the server presence tick rate, not at each network_consumer() call
+        self._next_client_attributes_time: float = 0.0
 
     # returns the path of an object
     def get_object_path(self, obj):
@@ -147,29 +150,33 @@ class BlenderClient(Client):
         s[2][2] = scale[2]
         return s @ r @ t
 
+    def matrix_from_columns(self, columns):
+        m = Matrix()
+        m.col[0] = columns[0]
+        m.col[1] = columns[1]
+        m.col[2] = columns[2]
+        m.col[3] = columns[3]
+        return m
+
     def decode_matrix(self, data, index):
         matrix_data, index = common.decode_matrix(data, index)
-        m = Matrix()
-        m.col[0] = matrix_data[0]
-        m.col[1] = matrix_data[1]
-        m.col[2] = matrix_data[2]
-        m.col[3] = matrix_data[3]
-        return m, index
+        return self.matrix_from_columns(matrix_data), index
 
     def build_transform(self, data):
-        start = 0
-        object_path, start = common.decode_string(data, start)
-        parent_invert_matrix, start = self.decode_matrix(data, start)
-        basis_matrix, start = self.decode_matrix(data, start)
-        local_matrix, start = self.decode_matrix(data, start)
+        transform, _ = common.decode_message(MessageType.TRANSFORM, data)
 
         try:
-            obj = self.get_or_create_path(object_path)
+            obj = self.get_or_create_path(transform.path)
         except KeyError:
             # Object doesn't exist anymore
             return
         if obj:
-            self.set_transform(obj, parent_invert_matrix, basis_matrix, local_matrix)
+            self.set_transform(
+                obj,
+                self.matrix_from_columns(transform.parent_inverse_matrix),
+                self.matrix_from_columns(transform.basis_matrix),
+                self.matrix_from_columns(transform.local_matrix),
+            )
 
     def build_rename(self, data):
         # Object rename, actually
@@ -248,11 +255,8 @@ class BlenderClient(Client):
 
     def get_transform_buffer(self, obj):
         path = self.get_object_path(obj)
-        return (
-            common.encode_string(path)
-            + common.encode_matrix(obj.matrix_parent_inverse)
-            + common.encode_matrix(obj.matrix_basis)
-            + common.encode_matrix(obj.matrix_local)
+        return common.encode_message(
+            MessageType.TRANSFORM, path, obj.matrix_parent_inverse, obj.matrix_basis, obj.matrix_local
         )
 
     def send_transform(self, obj):
@@ -286,9 +290,12 @@ class BlenderClient(Client):
                 logger.error("... %s", e)
 
     def send_texture_data(self, path, data):
-        name_buffer = common.encode_string(path)
+        writer = common.BufferWriter()
+        writer.write_string(path)
+        writer.write_int(len(data))
+        writer.write(data)
         self.textures.add(path)
-        self.add_command(common.Command(MessageType.TEXTURE, name_buffer + common.encode_int(len(data)) + data, 0))
+        self.add_command(common.Command(MessageType.TEXTURE, writer.getbuffer(), 0))
 
     def get_texture(self, inputs):
         if not inputs:
@@ -391,26 +398,26 @@ class BlenderClient(Client):
         mesh_name = self.get_mesh_name(mesh)
         path = self.get_object_path(obj)
 
-        binary_buffer = common.encode_string(path) + common.encode_string(mesh_name)
+        writer = common.BufferWriter()
+        writer.write_string(path)
+        writer.write_string(mesh_name)
 
-        binary_buffer += mesh_api.encode_mesh(
-            obj, get_mixer_prefs().send_base_meshes, get_mixer_prefs().send_baked_meshes
-        )
+        mesh_api.encode_mesh(writer, obj, get_mixer_prefs().send_base_meshes, get_mixer_prefs().send_baked_meshes)
 
         # For now include material slots in the same message, but maybe it should be a separated message
         # like Transform
         material_link_dict = {"OBJECT": 0, "DATA": 1}
         material_links = [material_link_dict[slot.link] for slot in obj.material_slots]
         assert len(material_links) == len(obj.data.materials)
-        binary_buffer += struct.pack(f"{len(material_links)}I", *material_links)
+        writer.write_array(material_links, "I")
 
         for slot in obj.material_slots:
             if slot.link == "DATA":
-                binary_buffer += common.encode_string("")
+                writer.write_string("")
             else:
-                binary_buffer += common.encode_string(slot.material.name if slot.material is not None else "")
+                writer.write_string(slot.material.name if slot.material is not None else "")
 
-        self.add_command(common.Command(MessageType.MESH, binary_buffer, 0))
+        self.add_command(common.Command(MessageType.MESH, writer.getbuffer(), 0))
 
     @stats_timer(share_data)
     def build_mesh(self, command_data):
@@ -432,10 +439,9 @@ class BlenderClient(Client):
 
         material_slot_count = len(obj.data.materials)
         material_link_dict = ["OBJECT", "DATA"]
-        material_links = struct.unpack(f"{material_slot_count}I", command_data[index : index + 4 * material_slot_count])
+        material_links, index = common.unpack_array(command_data, index, "I", material_slot_count)
         for link, slot in zip(material_links, obj.material_slots):
             slot.link = material_link_dict[link]
-        index += 4 * material_slot_count
 
         for slot in obj.material_slots:
             material_name, index = common.decode_string(command_data, index)
@@ -466,8 +472,8 @@ class BlenderClient(Client):
                         + common.encode_string(channel_name)
                         + common.encode_int(channel_index)
                         + common.int_to_bytes(key_count, 4)
-                        + struct.pack(f"{len(times)}i", *times)
-                        + struct.pack(f"{len(values)}f", *values)
+                        + common.pack_array(times, "i")
+                        + common.pack_array(values, "f")
                     )
                     self.add_command(common.Command(MessageType.CAMERA_ANIMATION, buffer, 0))
                     return
@@ -526,8 +532,7 @@ class BlenderClient(Client):
         self.add_command(common.Command(MessageType.DELETE, self.get_delete_buffer(obj_name), 0))
 
     def build_frame(self, data):
-        start = 0
-        frame, start = common.decode_int(data, start)
+        frame = common.decode_message(MessageType.FRAME, data)[0].frame
         if bpy.context.scene.frame_current != frame:
             previous_value = share_data.client.skip_next_depsgraph_update
             share_data.client.skip_next_depsgraph_update = False
@@ -538,7 +543,7 @@ class BlenderClient(Client):
             share_data.client.skip_next_depsgraph_update = previous_value
 
     def send_frame(self, frame):
-        self.add_command(common.Command(MessageType.FRAME, common.encode_int(frame), 0))
+        self.add_command(common.Command(MessageType.FRAME, common.encode_message(MessageType.FRAME, frame), 0))
 
     def send_frame_start_end(self, start, end):
         self.add_command(
@@ -652,10 +657,12 @@ class BlenderClient(Client):
                     self._received_byte_size += command.byte_size()
                     self._received_command_count += 1
                     if self._joining_room_name in self.rooms_attributes:
-                        get_mixer_props().joining_percentage = (
-                            self._received_byte_size
-                            / self.rooms_attributes[self._joining_room_name][RoomAttributes.BYTE_SIZE]
+                        # With a snapshot, the joining client receives the snapshot and the commands after it
+                        room_attributes = self.rooms_attributes[self._joining_room_name]
+                        join_byte_size = room_attributes.get(
+                            RoomAttributes.JOIN_BYTE_SIZE, room_attributes[RoomAttributes.BYTE_SIZE]
                         )
+                        get_mixer_props().joining_percentage = self._received_byte_size / max(join_byte_size, 1)
                         redraw_panels()
 
                 if command.type == MessageType.GROUP_BEGIN:
@@ -846,7 +853,10 @@ class BlenderClient(Client):
                     parent = ob
             share_data.pending_parenting = remaining_parentings
 
-        self.set_client_attributes(self.compute_client_custom_attributes())
+        now = time.monotonic()
+        if now >= self._next_client_attributes_time:
+            self._next_client_attributes_time = now + PRESENCE_TICK
+            self.set_client_attributes(self.compute_client_custom_attributes())
 
 
 def update_params(obj):
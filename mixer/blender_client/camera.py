@@ -26,16 +26,17 @@ def get_camera_buffer(obj):
     sensor_height = cam.sensor_height
 
     path = get_object_path(obj)
-    return (
-        common.encode_string(path)
-        + common.encode_string(obj.name_full)
-        + common.encode_float(focal)
-        + common.encode_float(front_clip_plane)
-        + common.encode_float(far_clip_plane)
-        + common.encode_float(aperture)
-        + common.encode_int(sensor_fit.value)
-        + common.encode_float(sensor_width)
-        + common.encode_float(sensor_height)
+    return common.encode_message(
+        common.MessageType.CAMERA,
+        path,
+        obj.name_full,
+        focal,
+        front_clip_plane,
+        far_clip_plane,
+        aperture,
+        sensor_fit.value,
+        sensor_width,
+        sensor_height,
     )
 
 
@@ -47,27 +48,25 @@ def send_camera(client: Client, obj):
 
 
 def build_camera(data):
-    camera_path, start = common.decode_string(data, 0)
-    logger.info("build_camera %s", camera_path)
-    camera_name, start = common.decode_string(data, start)
-    camera = get_or_create_camera(camera_name)
+    message, _ = common.decode_message(common.MessageType.CAMERA, data)
+    logger.info("build_camera %s", message.path)
+    camera = get_or_create_camera(message.name)
 
-    camera.lens, start = common.decode_float(data, start)
-    camera.clip_start, start = common.decode_float(data, start)
-    camera.clip_end, start = common.decode_float(data, start)
-    camera.dof.aperture_fstop, start = common.decode_float(data, start)
-    sensor_fit, start = common.decode_int(data, start)
-    camera.sensor_width, start = common.decode_float(data, start)
-    camera.sensor_height, start = common.decode_float(data, start)
+    camera.lens = message.lens
+    camera.clip_start = message.clip_start
+    camera.clip_end = message.clip_end
+    camera.dof.aperture_fstop = message.aperture_fstop
+    camera.sensor_width = message.sensor_width
+    camera.sensor_height = message.sensor_height
 
-    if sensor_fit == 0:
+    if message.sensor_fit == 0:
         camera.sensor_fit = "AUTO"
-    elif sensor_fit == 1:
+    elif message.sensor_fit == 1:
         camera.sensor_fit = "VERTICAL"
     else:
         camera.sensor_fit = "HORIZONTAL"
 
-    get_or_create_object_data(camera_path, camera)
+    get_or_create_object_data(message.path, camera)
 
 
 def get_or_create_camera(camera_name):
@@ -1,5 +1,3 @@
-import struct
-
 from mixer.blender_client.misc import get_or_create_object_data, get_object_path
 from mixer.broadcaster import common
 from mixer.broadcaster.client import Client
@@ -7,9 +5,9 @@ from mixer.share_data import share_data
 import bpy
 
 
-def send_grease_pencil_stroke(stroke):
-    buffer = common.encode_int(stroke.material_index)
-    buffer += common.encode_int(stroke.line_width)
+def send_grease_pencil_stroke(writer: common.BufferWriter, stroke):
+    writer.write_int(stroke.material_index)
+    writer.write_int(stroke.line_width)
 
     points = list()
 
@@ -18,98 +16,83 @@ def send_grease_pencil_stroke(stroke):
         points.append(point.pressure)
         points.append(point.strength)
 
-    binary_points_buffer = common.int_to_bytes(len(stroke.points), 4) + struct.pack(f"{len(points)}f", *points)
-    buffer += binary_points_buffer
-    return buffer
+    writer.write_floats(points, 5)
 
 
-def send_grease_pencil_frame(frame):
-    buffer = common.encode_int(frame.frame_number)
-    buffer += common.encode_int(len(frame.strokes))
+def send_grease_pencil_frame(writer: common.BufferWriter, frame):
+    writer.write_int(frame.frame_number)
+    writer.write_int(len(frame.strokes))
     for stroke in frame.strokes:
-        buffer += send_grease_pencil_stroke(stroke)
-    return buffer
+        send_grease_pencil_stroke(writer, stroke)
 
 
-def send_grease_pencil_layer(layer, name):
-    buffer = common.encode_string(name)
-    buffer += common.encode_bool(layer.hide)
-    buffer += common.encode_int(len(layer.frames))
+def send_grease_pencil_layer(writer: common.BufferWriter, layer, name):
+    writer.write_string(name)
+    writer.write_bool(layer.hide)
+    writer.write_int(len(layer.frames))
     for frame in layer.frames:
-        buffer += send_grease_pencil_frame(frame)
-    return buffer
+        send_grease_pencil_frame(writer, frame)
 
 
 def send_grease_pencil_time_offset(client: Client, obj):
     grease_pencil = obj.data
-    buffer = common.encode_string(grease_pencil.name_full)
 
     for modifier in obj.grease_pencil_modifiers:
         if modifier.type != "GP_TIME":
             continue
-        offset = modifier.offset
-        scale = modifier.frame_scale
-        custom_range = modifier.use_custom_frame_range
-        frame_start = modifier.frame_start
-        frame_end = modifier.frame_end
-        buffer += (
-            common.encode_int(offset)
-            + common.encode_float(scale)
-            + common.encode_bool(custom_range)
-            + common.encode_int(frame_start)
-            + common.encode_int(frame_end)
-        )
-        client.add_command(common.Command(common.MessageType.GREASE_PENCIL_TIME_OFFSET, buffer, 0))
+        writer = common.BufferWriter()
+        writer.write_string(grease_pencil.name_full)
+        writer.write_int(modifier.offset)
+        writer.write_float(modifier.frame_scale)
+        writer.write_bool(modifier.use_custom_frame_range)
+        writer.write_int(modifier.frame_start)
+        writer.write_int(modifier.frame_end)
+        client.add_command(common.Command(common.MessageType.GREASE_PENCIL_TIME_OFFSET, writer.getbuffer(), 0))
         break
 
 
 def send_grease_pencil_mesh(client: Client, obj):
     grease_pencil = obj.data
-    buffer = common.encode_string(grease_pencil.name_full)
+    writer = common.BufferWriter()
+    writer.write_string(grease_pencil.name_full)
 
-    buffer += common.encode_int(len(grease_pencil.materials))
+    writer.write_int(len(grease_pencil.materials))
     for material in grease_pencil.materials:
         if not material:
             material_name = "Default"
         else:
             material_name = material.name_full
-        buffer += common.encode_string(material_name)
+        writer.write_string(material_name)
 
-    buffer += common.encode_int(len(grease_pencil.layers))
+    writer.write_int(len(grease_pencil.layers))
     for name, layer in grease_pencil.layers.items():
-        buffer += send_grease_pencil_layer(layer, name)
+        send_grease_pencil_layer(writer, layer, name)
 
-    client.add_command(common.Command(common.MessageType.GREASE_PENCIL_MESH, buffer, 0))
+    client.add_command(common.Command(common.MessageType.GREASE_PENCIL_MESH, writer.getbuffer(), 0))
 
     send_grease_pencil_time_offset(client, obj)
 
 
 def send_grease_pencil_material(client: Client, material):
     gp_material = material.grease_pencil
-    stroke_enable = gp_material.show_stroke
-    stroke_mode = gp_material.mode
-    stroke_style = gp_material.stroke_style
-    stroke_color = gp_material.color
-    stroke_overlap = gp_material.use_overlap_strokes
-    fill_enable = gp_material.show_fill
-    fill_style = gp_material.fill_style
-    fill_color = gp_material.fill_color
-    gp_material_buffer = common.encode_string(material.name_full)
-    gp_material_buffer += common.encode_bool(stroke_enable)
-    gp_material_buffer += common.encode_string(stroke_mode)
-    gp_material_buffer += common.encode_string(stroke_style)
-    gp_material_buffer += common.encode_color(stroke_color)
-    gp_material_buffer += common.encode_bool(stroke_overlap)
-    gp_material_buffer += common.encode_bool(fill_enable)
-    gp_material_buffer += common.encode_string(fill_style)
-    gp_material_buffer += common.encode_color(fill_color)
-    client.add_command(common.Command(common.MessageType.GREASE_PENCIL_MATERIAL, gp_material_buffer, 0))
+    writer = common.BufferWriter()
+    writer.write_string(material.name_full)
+    writer.write_bool(gp_material.show_stroke)
+    writer.write_string(gp_material.mode)
+    writer.write_string(gp_material.stroke_style)
+    writer.write_color(gp_material.color)
+    writer.write_bool(gp_material.use_overlap_strokes)
+    writer.write_bool(gp_material.show_fill)
+    writer.write_string(gp_material.fill_style)
+    writer.write_color(gp_material.fill_color)
+    client.add_command(common.Command(common.MessageType.GREASE_PENCIL_MATERIAL, writer.getbuffer(), 0))
 
 
 def send_grease_pencil_connection(client: Client, obj):
-    buffer = common.encode_string(get_object_path(obj))
-    buffer += common.encode_string(obj.data.name_full)
-    client.add_command(common.Command(common.MessageType.GREASE_PENCIL_CONNECTION, buffer, 0))
+    writer = common.BufferWriter()
+    writer.write_string(get_object_path(obj))
+    writer.write_string(obj.data.name_full)
+    client.add_command(common.Command(common.MessageType.GREASE_PENCIL_CONNECTION, writer.getbuffer(), 0))
 
 
 def build_grease_pencil_connection(data):
@@ -122,7 +105,8 @@ def build_grease_pencil_connection(data):
 def decode_grease_pencil_stroke(grease_pencil_frame, stroke_index, data, index):
     material_index, index = common.decode_int(data, index)
     line_width, index = common.decode_int(data, index)
-    points, index = common.decode_array(data, index, "5f", 5 * 4)
+    points, index = common.decode_floats(data, index, 5)
+    points = common.group_items(points, 5)
 
     if stroke_index >= len(grease_pencil_frame.strokes):
         stroke = grease_pencil_frame.strokes.new()
@@ -34,11 +34,7 @@ def build_texture(principled, material, channel, is_color, data, index):
 
 
 def build_material(data):
-    material_name_length = common.bytes_to_int(data[:4])
-    start = 4
-    end = start + material_name_length
-    material_name = data[start:end].decode()
-    start = end
+    material_name, start = common.decode_string(data, 0)
 
     material = get_or_create_material(material_name)
     nodes = material.node_tree.nodes
@@ -127,7 +123,8 @@ def build_assign_material(data):
 
 def get_material_buffer(client: Client, material):
     name = material.name_full
-    buffer = common.encode_string(name)
+    writer = common.BufferWriter()
+    writer.write_string(name)
     principled = None
     diffuse = None
     # Get the nodes in the node tree
@@ -148,13 +145,18 @@ def get_material_buffer(client: Client, material):
         roughness = 0.5
         opacity = 1.0
         emission_color = (0.0, 0.0, 0.0)
-        buffer += common.encode_float(opacity) + common.encode_string("")
-        buffer += common.encode_color(base_color) + common.encode_string("")
-        buffer += common.encode_float(metallic) + common.encode_string("")
-        buffer += common.encode_float(roughness) + common.encode_string("")
-        buffer += common.encode_string("")
-        buffer += common.encode_color(emission_color) + common.encode_string("")
-        return buffer
+        writer.write_float(opacity)
+        writer.write_string("")
+        writer.write_color(base_color)
+        writer.write_string("")
+        writer.write_float(metallic)
+        writer.write_string("")
+        writer.write_float(roughness)
+        writer.write_string("")
+        writer.write_string("")
+        writer.write_color(emission_color)
+        writer.write_string("")
+        return writer.getbuffer()
     elif diffuse:
         opacity = 1.0
         opacity_texture = None
@@ -246,38 +248,38 @@ def get_material_buffer(client: Client, material):
             emission = emission_input.default_value
             emission_texture = client.get_texture(emission_input)
 
-    buffer += common.encode_float(opacity)
+    writer.write_float(opacity)
     if opacity_texture:
-        buffer += common.encode_string(opacity_texture)
+        writer.write_string(opacity_texture)
     else:
-        buffer += common.encode_string("")
-    buffer += common.encode_color(base_color)
+        writer.write_string("")
+    writer.write_color(base_color)
     if base_color_texture:
-        buffer += common.encode_string(base_color_texture)
+        writer.write_string(base_color_texture)
     else:
-        buffer += common.encode_string("")
+        writer.write_string("")
 
-    buffer += common.encode_float(metallic)
+    writer.write_float(metallic)
     if metallic_texture:
-        buffer += common.encode_string(metallic_texture)
+        writer.write_string(metallic_texture)
     else:
-        buffer += common.encode_string("")
+        writer.write_string("")
 
-    buffer += common.encode_float(roughness)
+    writer.write_float(roughness)
     if roughness_texture:
-        buffer += common.encode_string(roughness_texture)
+        writer.write_string(roughness_texture)
     else:
-        buffer += common.encode_string("")
+        writer.write_string("")
 
     if normal_texture:
-        buffer += common.encode_string(normal_texture)
+        writer.write_string(normal_texture)
     else:
-        buffer += common.encode_string("")
+        writer.write_string("")
 
-    buffer += common.encode_color(emission)
+    writer.write_color(emission)
     if emission_texture:
-        buffer += common.encode_string(emission_texture)
+        writer.write_string(emission_texture)
     else:
-        buffer += common.encode_string("")
+        writer.write_string("")
 
-    return buffer
+    return writer.getbuffer()
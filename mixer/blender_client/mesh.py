@@ -3,7 +3,6 @@ import struct
 
 import bpy
 import bmesh
-from mathutils import Vector
 
 from mixer.broadcaster import common
 from mixer.stats import stats_timer
@@ -95,7 +94,7 @@ def decode_bmesh_layer(data, index, layer_collection, element_seq, decode_layer_
     return index
 
 
-def encode_bmesh_layer(layer_collection, element_seq, extract_layer_tuple_func):
+def encode_bmesh_layer(writer: common.BufferWriter, layer_collection, element_seq, extract_layer_tuple_func):
     buffer = []
     count = 0
     for i in range(len(layer_collection)):
@@ -104,10 +103,9 @@ def encode_bmesh_layer(layer_collection, element_seq, extract_layer_tuple_func):
             buffer.extend(extract_layer_tuple_func(elt, layer))
             count += 1
 
-    binary_buffer = struct.pack("1I", len(layer_collection))
+    writer.write(struct.pack("1I", len(layer_collection)))
     if len(layer_collection) > 0:
-        binary_buffer += struct.pack(extract_layer_tuple_func.struct * count, *buffer)
-    return binary_buffer
+        writer.write(struct.pack(extract_layer_tuple_func.struct * count, *buffer))
 
 
 # We cannot iterate directly over bm.loops, so we use a generator
@@ -118,7 +116,7 @@ def loops_iterator(bm):
 
 
 @stats_timer(share_data)
-def encode_baked_mesh(obj):
+def encode_baked_mesh(writer: common.BufferWriter, obj):
     """
     Bake an object as a triangle mesh and encode it.
     """
@@ -134,7 +132,7 @@ def encode_baked_mesh(obj):
     mesh = obj.data if obj.type == "MESH" else obj.to_mesh()
     if mesh is None:
         # This happens for empty curves
-        return bytes()
+        return
 
     bm = bmesh.new()
     bm.from_mesh(mesh)
@@ -184,48 +182,33 @@ def encode_baked_mesh(obj):
     stats_timer.checkpoint("make_buffers")
 
     # Vericex count + binary vertices buffer
-    size = len(vertices) // 3
-    binary_vertices_buffer = common.int_to_bytes(size, 4) + struct.pack(f"{len(vertices)}f", *vertices)
+    writer.write_floats(vertices, 3)
 
     stats_timer.checkpoint("write_verts")
 
     # Normals count + binary normals buffer
-    size = len(normals) // 3
-    binary_normals_buffer = common.int_to_bytes(size, 4) + struct.pack(f"{len(normals)}f", *normals)
+    writer.write_floats(normals, 3)
 
     stats_timer.checkpoint("write_normals")
 
     # UVs count + binary uvs buffer
-    size = len(uvs) // 2
-    binary_uvs_buffer = common.int_to_bytes(size, 4) + struct.pack(f"{len(uvs)}f", *uvs)
+    writer.write_floats(uvs, 2)
 
     stats_timer.checkpoint("write_uvs")
 
     # material indices + binary material indices buffer
-    size = len(material_indices) // 2
-    binary_material_indices_buffer = common.int_to_bytes(size, 4) + struct.pack(
-        f"{len(material_indices)}I", *material_indices
-    )
+    writer.write_uints(material_indices, 2)
 
     stats_timer.checkpoint("write_material_indices")
 
     # triangle indices count + binary triangle indices buffer
-    size = len(indices) // 3
-    binary_indices_buffer = common.int_to_bytes(size, 4) + struct.pack(f"{len(indices)}I", *indices)
+    writer.write_uints(indices, 3)
 
     stats_timer.checkpoint("write_tri_idx_buff")
 
-    return (
-        binary_vertices_buffer
-        + binary_normals_buffer
-        + binary_uvs_buffer
-        + binary_material_indices_buffer
-        + binary_indices_buffer
-    )
-
 
 @stats_timer(share_data)
-def encode_base_mesh_geometry(mesh_data):
+def encode_base_mesh_geometry(writer: common.BufferWriter, mesh_data):
     stats_timer = share_data.current_stats_timer
 
     # We do not synchronize "select" and "hide" state of mesh elements
@@ -236,8 +219,6 @@ def encode_base_mesh_geometry(mesh_data):
 
     stats_timer.checkpoint("bmesh_from_mesh")
 
-    binary_buffer = bytes()
-
     logger.debug("Writing %d vertices", len(bm.verts))
     bm.verts.ensure_lookup_table()
 
@@ -247,7 +228,7 @@ def encode_base_mesh_geometry(mesh_data):
 
     stats_timer.checkpoint("make_verts_buffer")
 
-    binary_buffer += struct.pack(f"1I{len(verts_array)}f", len(bm.verts), *verts_array)
+    writer.write_floats(verts_array, 3)
 
     stats_timer.checkpoint("encode_verts_buffer")
 
@@ -259,7 +240,7 @@ def encode_base_mesh_geometry(mesh_data):
     # Other ignored layers:
     # - shape: shape keys are handled with Shape Keys at the mesh and object level
     # - float, int, string: don't really know their role
-    binary_buffer += encode_bmesh_layer(bm.verts.layers.bevel_weight, bm.verts, extract_layer_float)
+    encode_bmesh_layer(writer, bm.verts.layers.bevel_weight, bm.verts, extract_layer_float)
 
     stats_timer.checkpoint("verts_layers")
 
@@ -272,7 +253,7 @@ def encode_base_mesh_geometry(mesh_data):
 
     stats_timer.checkpoint("make_edges_buffer")
 
-    binary_buffer += struct.pack(f"1I{len(edges_array)}I", len(bm.edges), *edges_array)
+    writer.write_uints(edges_array, 4)
 
     stats_timer.checkpoint("encode_edges_buffer")
 
@@ -281,8 +262,8 @@ def encode_base_mesh_geometry(mesh_data):
     # Other ignored layers:
     # - freestyle: of type NotImplementedType, maybe reserved for future dev
     # - float, int, string: don't really know their role
-    binary_buffer += encode_bmesh_layer(bm.edges.layers.bevel_weight, bm.edges, extract_layer_float)
-    binary_buffer += encode_bmesh_layer(bm.edges.layers.crease, bm.edges, extract_layer_float)
+    encode_bmesh_layer(writer, bm.edges.layers.bevel_weight, bm.edges, extract_layer_float)
+    encode_bmesh_layer(writer, bm.edges.layers.crease, bm.edges, extract_layer_float)
 
     stats_timer.checkpoint("edges_layers")
 
@@ -296,7 +277,8 @@ def encode_base_mesh_geometry(mesh_data):
 
     stats_timer.checkpoint("make_faces_buffer")
 
-    binary_buffer += struct.pack(f"1I{len(faces_array)}I", len(bm.faces), *faces_array)
+    writer.write_int(len(bm.faces))
+    writer.write_array(faces_array, "I")
 
     stats_timer.checkpoint("encode_faces_buffer")
 
@@ -305,7 +287,7 @@ def encode_base_mesh_geometry(mesh_data):
     # Other ignored layers:
     # - freestyle: of type NotImplementedType, maybe reserved for future dev
     # - float, int, string: don't really know their role
-    binary_buffer += encode_bmesh_layer(bm.faces.layers.face_map, bm.faces, extract_layer_int)
+    encode_bmesh_layer(writer, bm.faces.layers.face_map, bm.faces, extract_layer_int)
 
     stats_timer.checkpoint("faces_layers")
 
@@ -314,18 +296,16 @@ def encode_base_mesh_geometry(mesh_data):
     # Ignored layers for now: None
     # Other ignored layers:
     # - float, int, string: don't really know their role
-    binary_buffer += encode_bmesh_layer(bm.loops.layers.uv, loops_iterator(bm), extract_layer_uv)
-    binary_buffer += encode_bmesh_layer(bm.loops.layers.color, loops_iterator(bm), extract_layer_color)
+    encode_bmesh_layer(writer, bm.loops.layers.uv, loops_iterator(bm), extract_layer_uv)
+    encode_bmesh_layer(writer, bm.loops.layers.color, loops_iterator(bm), extract_layer_color)
 
     stats_timer.checkpoint("loops_layers")
 
     bm.free()
 
-    return binary_buffer
-
 
 @stats_timer(share_data)
-def encode_base_mesh(obj):
+def encode_base_mesh(writer: common.BufferWriter, obj):
 
     # Temporary for curves and other objects that support to_mesh()
     # #todo Implement correct base encoding for these objects
@@ -333,40 +313,39 @@ def encode_base_mesh(obj):
     if mesh_data is None:
         # This happens for empty curves
         # This is temporary, when curves will be fully implemented we will encode something
-        return bytes()
+        return
 
-    binary_buffer = encode_base_mesh_geometry(mesh_data)
+    encode_base_mesh_geometry(writer, mesh_data)
 
     # Shape keys
     # source https://blender.stackexchange.com/questions/111661/creating-shape-keys-using-python
     if mesh_data.shape_keys is None:
-        binary_buffer += common.encode_int(0)  # Indicate 0 key blocks
+        writer.write_int(0)  # Indicate 0 key blocks
     else:
         logger.debug("Writing %d shape keys", len(mesh_data.shape_keys.key_blocks))
 
-        binary_buffer += common.encode_int(len(mesh_data.shape_keys.key_blocks))
+        writer.write_int(len(mesh_data.shape_keys.key_blocks))
         # Encode names
         for key_block in mesh_data.shape_keys.key_blocks:
-            binary_buffer += common.encode_string(key_block.name)
+            writer.write_string(key_block.name)
         # Encode vertex group names
         for key_block in mesh_data.shape_keys.key_blocks:
-            binary_buffer += common.encode_string(key_block.vertex_group)
+            writer.write_string(key_block.vertex_group)
         # Encode relative key names
         for key_block in mesh_data.shape_keys.key_blocks:
-            binary_buffer += common.encode_string(key_block.relative_key.name)
+            writer.write_string(key_block.relative_key.name)
         # Encode data
-        shape_keys_buffer = []
-        fmt_str = ""
         for key_block in mesh_data.shape_keys.key_blocks:
-            shape_keys_buffer.extend(
-                (key_block.mute, key_block.value, key_block.slider_min, key_block.slider_max, len(key_block.data))
-            )
-            fmt_str += f"1I1f1f1f1I{(3 * len(key_block.data))}f"
-            for i in range(len(key_block.data)):
-                shape_keys_buffer.extend(key_block.data[i].co)
-        binary_buffer += struct.pack(f"{fmt_str}", *shape_keys_buffer)
+            writer.write_bool(key_block.mute)
+            writer.write_float(key_block.value)
+            writer.write_float(key_block.slider_min)
+            writer.write_float(key_block.slider_max)
+            writer.write_int(len(key_block.data))
+            co = [0.0] * (3 * len(key_block.data))
+            key_block.data.foreach_get("co", co)
+            writer.write_array(co, "f")
 
-        binary_buffer += common.encode_bool(mesh_data.shape_keys.use_relative)
+        writer.write_bool(mesh_data.shape_keys.use_relative)
 
     # Vertex Groups
     verts_per_group = {}
@@ -377,70 +356,61 @@ def encode_base_mesh(obj):
         for vg in vert.groups:
             verts_per_group[vg.group].append((vert.index, vg.weight))
 
-    binary_buffer += common.encode_int(len(obj.vertex_groups))
+    writer.write_int(len(obj.vertex_groups))
     for vertex_group in obj.vertex_groups:
-        binary_buffer += common.encode_string(vertex_group.name)
-        binary_buffer += common.encode_bool(vertex_group.lock_weight)
-        binary_buffer += common.encode_int(len(verts_per_group[vertex_group.index]))
+        writer.write_string(vertex_group.name)
+        writer.write_bool(vertex_group.lock_weight)
+        writer.write_int(len(verts_per_group[vertex_group.index]))
         for vg_elmt in verts_per_group[vertex_group.index]:
-            binary_buffer += common.encode_int(vg_elmt[0])
-            binary_buffer += common.encode_float(vg_elmt[1])
+            writer.write_int(vg_elmt[0])
+            writer.write_float(vg_elmt[1])
 
     # Normals
-    binary_buffer += common.encode_bool(mesh_data.use_auto_smooth)
-    binary_buffer += common.encode_float(mesh_data.auto_smooth_angle)
-    binary_buffer += common.encode_bool(mesh_data.has_custom_normals)
+    writer.write_bool(mesh_data.use_auto_smooth)
+    writer.write_float(mesh_data.auto_smooth_angle)
+    writer.write_bool(mesh_data.has_custom_normals)
 
     if mesh_data.has_custom_normals:
         mesh_data.calc_normals_split()  # Required otherwise all normals are (0, 0, 0)
         normals = []
         for loop in mesh_data.loops:
             normals.extend((*loop.normal,))
-        binary_buffer += struct.pack(f"{len(normals)}f", *normals)
+        writer.write_array(normals, "f")
 
     # UV Maps
     for uv_layer in mesh_data.uv_layers:
-        binary_buffer += common.encode_string(uv_layer.name)
-        binary_buffer += common.encode_bool(uv_layer.active_render)
+        writer.write_string(uv_layer.name)
+        writer.write_bool(uv_layer.active_render)
 
     # Vertex Colors
     for vertex_colors in mesh_data.vertex_colors:
-        binary_buffer += common.encode_string(vertex_colors.name)
-        binary_buffer += common.encode_bool(vertex_colors.active_render)
+        writer.write_string(vertex_colors.name)
+        writer.write_bool(vertex_colors.active_render)
 
     if obj.type != "MESH":
         obj.to_mesh_clear()
 
-    return binary_buffer
-
 
 @stats_timer(share_data)
-def encode_mesh(obj, do_encode_base_mesh, do_encode_baked_mesh):
-    binary_buffer = bytes()
-
+def encode_mesh(writer: common.BufferWriter, obj, do_encode_base_mesh, do_encode_baked_mesh):
+    # The byte size of each mesh is written before it
+    size_offset = writer.reserve_int()
     if do_encode_base_mesh:
         logger.info("encode_base_mesh %s", obj.name_full)
-        mesh_buffer = encode_base_mesh(obj)
-        binary_buffer += common.encode_int(len(mesh_buffer))
-        binary_buffer += mesh_buffer
-    else:
-        binary_buffer += common.encode_int(0)
+        encode_base_mesh(writer, obj)
+    writer.patch_size(size_offset)
 
+    size_offset = writer.reserve_int()
     if do_encode_baked_mesh:
         logger.info("encode_baked_mesh %s", obj.name_full)
-        mesh_buffer = encode_baked_mesh(obj)
-        binary_buffer += common.encode_int(len(mesh_buffer))
-        binary_buffer += mesh_buffer
-    else:
-        binary_buffer += common.encode_int(0)
+        encode_baked_mesh(writer, obj)
+    writer.patch_size(size_offset)
 
     # Materials
     materials = []
     for material in obj.data.materials:
         materials.append(material.name_full if material is not None else "")
-    binary_buffer += common.encode_string_array(materials)
-
-    return binary_buffer
+    writer.write_string_array(materials)
 
 
 @stats_timer(share_data)
@@ -451,11 +421,17 @@ def decode_bakes_mesh(obj, data, index):
     if byte_size == 0:
         return index
 
-    positions, index = common.decode_vector3_array(data, index)
-    normals, index = common.decode_vector3_array(data, index)
-    uvs, index = common.decode_vector2_array(data, index)
-    material_indices, index = common.decode_int2_array(data, index)
-    triangles, index = common.decode_int3_array(data, index)
+    positions, index = common.decode_floats(data, index, 3)
+    normals, index = common.decode_floats(data, index, 3)
+    uvs, index = common.decode_floats(data, index, 2)
+    material_indices, index = common.decode_uints(data, index, 2)
+    triangles, index = common.decode_uints(data, index, 3)
+
+    positions = common.group_items(positions, 3)
+    normals = common.group_items(normals, 3)
+    uvs = common.group_items(uvs, 2)
+    material_indices = common.group_items(material_indices, 2)
+    triangle_count = len(triangles) // 3
 
     bm = bmesh.new()
     for i in range(len(positions)):
@@ -471,24 +447,21 @@ def decode_bakes_mesh(obj, data, index):
 
     current_material_index = 0
     index_in_material_indices = 0
-    next_triangle_index = len(triangles)
+    next_triangle_index = triangle_count
     if len(material_indices) > 1:
         next_triangle_index = material_indices[index_in_material_indices + 1][0]
     if len(material_indices) > 0:
         current_material_index = material_indices[index_in_material_indices][1]
 
-    for i in range(len(triangles)):
+    for i in range(triangle_count):
         if i >= next_triangle_index:
             index_in_material_indices = index_in_material_indices + 1
-            next_triangle_index = len(triangles)
+            next_triangle_index = triangle_count
             if len(material_indices) > index_in_material_indices + 1:
                 next_triangle_index = material_indices[index_in_material_indices + 1][0]
             current_material_index = material_indices[index_in_material_indices][1]
 
-        triangle = triangles[i]
-        i1 = triangle[0]
-        i2 = triangle[1]
-        i3 = triangle[2]
+        i1, i2, i3 = triangles[3 * i : 3 * i + 3]
         try:
             face = bm.faces.new((bm.verts[i1], bm.verts[i2], bm.verts[i3]))
             face.material_index = current_material_index
@@ -518,29 +491,23 @@ def decode_bakes_mesh(obj, data, index):
 def decode_base_mesh(client, obj, data, index):
     bm = bmesh.new()
 
-    position_count, index = common.decode_int(data, index)
-    logger.debug("Reading %d vertices", position_count)
+    positions, index = common.decode_floats(data, index, 3)
+    logger.debug("Reading %d vertices", len(positions) // 3)
 
-    for _pos_idx in range(position_count):
-        co, index = common.decode_vector3(data, index)
+    for co in common.group_items(positions, 3):
         bm.verts.new(co)
 
     bm.verts.ensure_lookup_table()
 
     index = decode_bmesh_layer(data, index, bm.verts.layers.bevel_weight, bm.verts, decode_layer_float)
 
-    edge_count, index = common.decode_int(data, index)
-    logger.debug("Reading %d edges", edge_count)
+    edges_data, index = common.decode_uints(data, index, 4)
+    logger.debug("Reading %d edges", len(edges_data) // 4)
 
-    edges_data = struct.unpack(f"{edge_count * 4}I", data[index : index + edge_count * 4 * 4])
-    index += edge_count * 4 * 4
-
-    for edge_idx in range(edge_count):
-        v1 = edges_data[edge_idx * 4]
-        v2 = edges_data[edge_idx * 4 + 1]
+    for v1, v2, smooth, seam in common.group_items(edges_data, 4):
         edge = bm.edges.new((bm.verts[v1], bm.verts[v2]))
-        edge.smooth = bool(edges_data[edge_idx * 4 + 2])
-        edge.seam = bool(edges_data[edge_idx * 4 + 3])
+        edge.smooth = bool(smooth)
+        edge.seam = bool(seam)
 
     index = decode_bmesh_layer(data, index, bm.edges.layers.bevel_weight, bm.edges, decode_layer_float)
     index = decode_bmesh_layer(data, index, bm.edges.layers.crease, bm.edges, decode_layer_float)
@@ -552,8 +519,7 @@ def decode_base_mesh(client, obj, data, index):
         material_idx, index = common.decode_int(data, index)
         smooth, index = common.decode_bool(data, index)
         vert_count, index = common.decode_int(data, index)
-        face_vertices = struct.unpack(f"{vert_count}I", data[index : index + vert_count * 4])
-        index += vert_count * 4
+        face_vertices, index = common.unpack_array(data, index, "I", vert_count)
         verts = [bm.verts[i] for i in face_vertices]
         face = bm.faces.new(verts)
         face.material_index = material_idx
@@ -590,9 +556,8 @@ def decode_base_mesh(client, obj, data, index):
             shape_key.slider_min, index = common.decode_float(data, index)
             shape_key.slider_max, index = common.decode_float(data, index)
             shape_key_data_size, index = common.decode_int(data, index)
-            for i in range(shape_key_data_size):
-                shape_key.data[i].co = Vector(struct.unpack("3f", data[index : index + 3 * 4]))
-                index += 3 * 4
+            co, index = common.unpack_array(data, index, "f", 3 * shape_key_data_size)
+            shape_key.data.foreach_set("co", co)
         obj.data.shape_keys.use_relative, index = common.decode_bool(data, index)
 
     # Vertex Groups
@@ -615,11 +580,8 @@ def decode_base_mesh(client, obj, data, index):
     has_custom_normal, index = common.decode_bool(data, index)
 
     if has_custom_normal:
-        normals = []
-        for _loop in obj.data.loops:
-            normal, index = common.decode_vector3(data, index)
-            normals.append(normal)
-        obj.data.normals_split_custom_set(normals)
+        normals, index = common.unpack_array(data, index, "f", 3 * len(obj.data.loops))
+        obj.data.normals_split_custom_set(common.group_items(normals, 3))
 
     # UV Maps and Vertex Colors are added automatically based on layers in the bmesh
     # We just need to update their name and active_render state:
@@ -10,7 +10,7 @@ logger = logging.getLogger(__name__)
 
 def send_scene(client: Client, scene_name: str):
     logger.info("send_scene %s", scene_name)
-    buffer = common.encode_string(scene_name)
+    buffer = common.encode_message(common.MessageType.SCENE, scene_name)
     client.add_command(common.Command(common.MessageType.SCENE, buffer, 0))
 
 
@@ -30,7 +30,7 @@ def delete_scene(scene):
 
 
 def build_scene(data):
-    scene_name, _ = common.decode_string(data, 0)
+    scene_name = common.decode_message(common.MessageType.SCENE, data)[0].name
     logger.info("build_scene %s", scene_name)
 
     # remove what was previously the last scene that could not be removed
@@ -51,12 +51,12 @@ def build_scene(data):
 
 def send_scene_removed(client: Client, scene_name: str):
     logger.info("send_scene_removed %s", scene_name)
-    buffer = common.encode_string(scene_name)
+    buffer = common.encode_message(common.MessageType.SCENE_REMOVED, scene_name)
     client.add_command(common.Command(common.MessageType.SCENE_REMOVED, buffer, 0))
 
 
 def build_scene_removed(data):
-    scene_name, _ = common.decode_string(data, 0)
+    scene_name = common.decode_message(common.MessageType.SCENE_REMOVED, data)[0].name
     logger.info("build_scene_removed %s", scene_name)
     scene = share_data.blender_scenes.get(scene_name)
     delete_scene(scene)
@@ -65,13 +65,12 @@ def build_scene_removed(data):
 
 def send_scene_renamed(client: Client, old_name: str, new_name: str):
     logger.info("send_scene_renamed %s to %s", old_name, new_name)
-    buffer = common.encode_string(old_name) + common.encode_string(new_name)
+    buffer = common.encode_message(common.MessageType.SCENE_RENAMED, old_name, new_name)
     client.add_command(common.Command(common.MessageType.SCENE_RENAMED, buffer, 0))
 
 
 def build_scene_renamed(data):
-    old_name, index = common.decode_string(data, 0)
-    new_name, _ = common.decode_string(data, index)
+    (old_name, new_name), _ = common.decode_message(common.MessageType.SCENE_RENAMED, data)
     logger.info("build_scene_renamed %s to %s", old_name, new_name)
     scene = share_data.blender_scenes.get(old_name)
     scene.name = new_name
@@ -81,13 +80,12 @@ def build_scene_renamed(data):
 def send_add_collection_to_scene(client: Client, scene_name: str, collection_name: str):
     logger.info("send_add_collection_to_scene %s <- %s", scene_name, collection_name)
 
-    buffer = common.encode_string(scene_name) + common.encode_string(collection_name)
+    buffer = common.encode_message(common.MessageType.ADD_COLLECTION_TO_SCENE, scene_name, collection_name)
     client.add_command(common.Command(common.MessageType.ADD_COLLECTION_TO_SCENE, buffer, 0))
 
 
 def build_collection_to_scene(data):
-    scene_name, index = common.decode_string(data, 0)
-    collection_name, _ = common.decode_string(data, index)
+    (scene_name, collection_name), _ = common.decode_message(common.MessageType.ADD_COLLECTION_TO_SCENE, data)
     logger.info("build_collection_to_scene %s <- %s", scene_name, collection_name)
 
     scene = share_data.blender_scenes[scene_name]
@@ -100,13 +98,12 @@ def build_collection_to_scene(data):
 def send_remove_collection_from_scene(client: Client, scene_name: str, collection_name: str):
     logger.info("send_remove_collection_from_scene %s <- %s", scene_name, collection_name)
 
-    buffer = common.encode_string(scene_name) + common.encode_string(collection_name)
+    buffer = common.encode_message(common.MessageType.REMOVE_COLLECTION_FROM_SCENE, scene_name, collection_name)
     client.add_command(common.Command(common.MessageType.REMOVE_COLLECTION_FROM_SCENE, buffer, 0))
 
 
 def build_remove_collection_from_scene(data):
-    scene_name, index = common.decode_string(data, 0)
-    collection_name, _ = common.decode_string(data, index)
+    (scene_name, collection_name), _ = common.decode_message(common.MessageType.REMOVE_COLLECTION_FROM_SCENE, data)
     logger.info("build_remove_collection_from_scene %s <- %s", scene_name, collection_name)
     scene = share_data.blender_scenes[scene_name]
     collection = share_data.blender_collections.get(collection_name)
@@ -121,19 +118,18 @@ def build_remove_collection_from_scene(data):
 
 def send_add_object_to_vrtist(client: Client, scene_name: str, obj_name: str):
     logger.debug("send_add_object_to_vrtist %s <- %s", scene_name, obj_name)
-    buffer = common.encode_string(scene_name) + common.encode_string(obj_name)
+    buffer = common.encode_message(common.MessageType.ADD_OBJECT_TO_VRTIST, scene_name, obj_name)
     client.add_command(common.Command(common.MessageType.ADD_OBJECT_TO_VRTIST, buffer, 0))
 
 
 def send_add_object_to_scene(client: Client, scene_name: str, obj_name: str):
     logger.info("send_add_object_to_scene %s <- %s", scene_name, obj_name)
-    buffer = common.encode_string(scene_name) + common.encode_string(obj_name)
+    buffer = common.encode_message(common.MessageType.ADD_OBJECT_TO_SCENE, scene_name, obj_name)
     client.add_command(common.Command(common.MessageType.ADD_OBJECT_TO_SCENE, buffer, 0))
 
 
 def build_add_object_to_scene(data):
-    scene_name, index = common.decode_string(data, 0)
-    object_name, _ = common.decode_string(data, index)
+    (scene_name, object_name), _ = common.decode_message(common.MessageType.ADD_OBJECT_TO_SCENE, data)
     logger.info("build_add_object_to_scene %s <- %s", scene_name, object_name)
 
     scene = share_data.blender_scenes[scene_name]
@@ -146,13 +142,12 @@ def build_add_object_to_scene(data):
 
 def send_remove_object_from_scene(client: Client, scene_name: str, object_name: str):
     logger.info("send_remove_object_from_scene %s <- %s", scene_name, object_name)
-    buffer = common.encode_string(scene_name) + common.encode_string(object_name)
+    buffer = common.encode_message(common.MessageType.REMOVE_OBJECT_FROM_SCENE, scene_name, object_name)
     client.add_command(common.Command(common.MessageType.REMOVE_OBJECT_FROM_SCENE, buffer, 0))
 
 
 def build_remove_object_from_scene(data):
-    scene_name, index = common.decode_string(data, 0)
-    object_name, _ = common.decode_string(data, index)
+    (scene_name, object_name), _ = common.decode_message(common.MessageType.REMOVE_OBJECT_FROM_SCENE, data)
     logger.info("build_remove_object_from_scene %s <- %s", scene_name, object_name)
     scene = share_data.blender_scenes[scene_name]
     object_ = share_data.blender_objects.get(object_name)
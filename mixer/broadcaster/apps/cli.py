@@ -35,6 +35,14 @@ class CliClient(client.Client):
         command = common.Command(common.MessageType.DELETE_ROOM, name.encode())
         self.add_and_process_command(command)
 
+    def save_room(self, name, file_name):
+        data = common.encode_string(name) + common.encode_string(file_name)
+        self.add_and_process_command(common.Command(common.MessageType.SAVE_ROOM, data), common.MessageType.SAVE_ROOM)
+
+    def load_room(self, name, file_name):
+        data = common.encode_string(name) + common.encode_string(file_name)
+        self.add_and_process_command(common.Command(common.MessageType.LOAD_ROOM, data), common.MessageType.LOAD_ROOM)
+
     def list_clients(self):
         command = common.Command(common.MessageType.LIST_CLIENTS)
         self.add_and_process_command(command, common.MessageType.LIST_CLIENTS)
@@ -78,6 +86,16 @@ def process_room_command(args):
                     client.delete_room(name)
             else:
                 print("Expected one or more room names")
+
+        elif args.command in ("save", "load"):
+            if len(args.name) != 1 or args.file is None:
+                print("Expected one room name and --file")
+                return
+            client = CliClient(args)
+            if args.command == "save":
+                client.save_room(args.name[0], args.file)
+            else:
+                client.load_room(args.name[0], args.file)
     except ServerError as e:
         logger.error(e, exc_info=True)
     finally:
@@ -201,12 +219,17 @@ def parse_cli_args():
     room_parser = sub_parsers.add_parser("room", help="Rooms related commands")
     room_parser.add_argument(
         "command",
-        help='Commands. Use "list" to list all the rooms of the server. Use "delete" to delete one or more rooms. Use "clear" to clear the commands stack of rooms. Use "clients" to list the clients connected to rooms.',
-        choices=("list", "delete", "clear", "clients"),
+        help='Commands. Use "list" to list all the rooms of the server. Use "delete" to delete one or more rooms. Use "clear" to clear the commands stack of rooms. Use "clients" to list the clients connected to rooms. Use "save" to make the server save a room to a file, and "load" to make it create a room from a file.',
+        choices=("list", "delete", "clear", "clients", "save", "load"),
     )
     room_parser.add_argument(
         "name", help="Room name. You can specify multiple room names separated by spaces.", nargs="*"
     )
+    room_parser.add_argument(
+        "--file",
+        help="Room file name for save and load, in the room_bake.save_room() format, opened by the server in its "
+        "--rooms-dir directory.",
+    )
     room_parser.set_defaults(func=process_room_command)
 
     # Client commands are relative to a client independently of any room
@@ -8,17 +8,26 @@ from __future__ import annotations
 
 import logging
 import argparse
+import collections
+import itertools
+import os
 import select
+import selectors
+import sys
 import threading
+import time
 import socket
-import queue
-from typing import List, Mapping, Dict, Optional, Any
+import uuid
+from typing import BinaryIO, Callable, Deque, Iterable, List, Mapping, Dict, Optional, Any, Set, Tuple
 
 from mixer.broadcaster.cli_utils import init_logging, add_logging_cli_args
 import mixer.broadcaster.common as common
 from mixer.broadcaster.common import update_attributes_and_get_diff
-
-SHUTDOWN = False
+from mixer.broadcaster.outgoing_queue import MAX_QUEUE_BYTE_SIZE, OutgoingQueue, SlowConsumerPolicy
+from mixer.broadcaster.presence import PRESENCE_TICK, Presence, split_client_attributes
+from mixer.broadcaster.room_bake import read_room_attributes, write_room_attributes
+from mixer.broadcaster.room_history import RoomHistory
+from mixer.broadcaster.room_journal import FSYNC_BYTE_SIZE, FSYNC_INTERVAL, RoomJournal, load_journals
 
 logger = logging.getLogger() if __name__ == "__main__" else logging.getLogger(__name__)
 _log_server_updates: bool = False
@@ -27,9 +36,40 @@ _log_server_updates: bool = False
 # client, then release the room mutex while broadcasting
 MAX_BROADCAST_COMMAND_COUNT = 64
 
+# The selector engine only wakes up on socket activity, except on Windows where select cannot be interrupted by
+# a KeyboardInterrupt
+SELECT_TIMEOUT = 1.0 if sys.platform == "win32" else None
+
+# Sessions of disconnected clients can be resumed during this delay, in seconds
+SESSION_TIMEOUT = 600.0
+
+# Delay in seconds between two removals of the expired sessions
+SESSION_CHECK_INTERVAL = 10.0
+
+# Delay in seconds between two checks of the heartbeats of the clients
+HEARTBEAT_CHECK_INTERVAL = 1.0
+
+# Clients are notified of the outgoing queue high-water mark of a client each time it doubles above this size
+MIN_REPORTED_QUEUE_BYTE_SIZE = 1024 * 1024
+
+# Delay in seconds between two checks of the memory budget of the rooms
+MEMORY_CHECK_INTERVAL = 1.0
+
+# Room attributes set by the server, that are not restored from a room file
+SERVER_ROOM_ATTRIBUTES = {
+    common.RoomAttributes.NAME,
+    common.RoomAttributes.KEEP_OPEN,
+    common.RoomAttributes.COMMAND_COUNT,
+    common.RoomAttributes.BYTE_SIZE,
+    common.RoomAttributes.JOINABLE,
+    common.RoomAttributes.SNAPSHOT_BYTE_SIZE,
+    common.RoomAttributes.SNAPSHOT_AGE,
+    common.RoomAttributes.JOIN_BYTE_SIZE,
+}
+
 
 class Connection:
-    """ Represent a connection with a client """
+    """Represent a connection with a client"""
 
     def __init__(self, server: Server, sock: socket.socket, address):
         self.socket: socket.socket = sock
@@ -39,8 +79,18 @@ class Connection:
         self.unique_id = f"{address[0]}:{address[1]}"
 
         self.custom_attributes: Dict[str, Any] = {}  # custom attributes are used between clients, but not by the server
-
-        self._command_queue: queue.Queue = queue.Queue()  # Pending commands to send to the client
+        self.capabilities: Set[str] = set()  # protocol extensions supported by the client and the server
+        self.session_token = uuid.uuid4().hex  # origin of the room commands sent by the client
+        self.subscription: Optional[Set[common.MessageType]] = None  # room message types sent to the client, or all
+        self.peer_idle_timeout = 0.0  # received in the HEARTBEAT messages of the client
+        self.heartbeat_time = time.monotonic()  # when the last HEARTBEAT was queued
+
+        self._frame_reader = common.FrameReader()
+        # Pending commands to send to the client
+        self.outgoing_commands = OutgoingQueue(server.max_queue_byte_size, server.slow_consumer_policy)
+        self._reported_high_water_mark = 0
+        self._disconnect_requested = False
+        self.write_statistics = common.WriteStatistics()
         self._server = server
 
         self.thread: threading.Thread = threading.Thread(None, self.run)
@@ -55,122 +105,213 @@ class Connection:
             common.ClientAttributes.IP: self.address[0],
             common.ClientAttributes.PORT: self.address[1],
             common.ClientAttributes.ROOM: self.room.name if self.room is not None else None,
+            common.ClientAttributes.QUEUE_HIGH_WATER_MARK: self.outgoing_commands.high_water_byte_size,
         }
 
-    def run(self):
-        def _send_error(s: str):
-            logger.warning("Sending error %s", s)
-            self.send_command(common.Command(common.MessageType.SEND_ERROR, common.encode_string(s)))
+    def _send_error(self, s: str):
+        logger.warning("Sending error %s", s)
+        self.send_command(common.Command(common.MessageType.SEND_ERROR, common.encode_string(s)))
 
-        def _join_room(command: common.Command):
-            if self.room is not None:
-                _send_error(f"Received join_room but room {self.room.name} is already joined")
-                return
-            room_name = command.data.decode()
-            try:
-                self._server.join_room(self, room_name)
-            except Exception as e:
-                _send_error(f"{e}")
+    def _join_room(self, command: common.Command):
+        if self.room is not None:
+            self._send_error(f"Received join_room but room {self.room.name} is already joined")
+            return
+        room_name = str(command.data, "utf-8")
+        try:
+            self._server.join_room(self, room_name)
+        except Exception as e:
+            self._send_error(f"{e}")
 
-        def _leave_room(command: common.Command):
-            if self.room is None:
-                _send_error(f"Received leave_room but no room is joined")
-                return
-            _ = command.data.decode()  # todo remove room_name from protocol
-            self._server.leave_room(self)
-            self.send_command(common.Command(common.MessageType.LEAVE_ROOM))
+    def _resume_room(self, command: common.Command):
+        if self.room is not None:
+            self._send_error(f"Received resume_room but room {self.room.name} is already joined")
+            return
+        room_name, offset = common.decode_string(command.data, 0)
+        session_token, offset = common.decode_string(command.data, offset)
+        sequence, _ = common.decode_int(command.data, offset)
+        try:
+            self._server.resume_room(self, room_name, session_token, sequence)
+        except Exception as e:
+            self._send_error(f"{e}")
 
-        def _list_rooms(command: common.Command):
-            self.send_command(self._server.get_list_rooms_command())
+    def _subscribe(self, command: common.Command):
+        self.subscription, _ = common.decode_subscription(command.data, 0)
+        logger.info("%s subscription: %s", self.unique_id, self.subscription)
 
-        def _delete_room(command: common.Command):
-            self._server.delete_room(command.data.decode())
+    def _leave_room(self, command: common.Command):
+        if self.room is None:
+            self._send_error(f"Received leave_room but no room is joined")
+            return
+        _ = str(command.data, "utf-8")  # todo remove room_name from protocol
+        self._server.leave_room(self)
+        self.send_command(common.Command(common.MessageType.LEAVE_ROOM))
 
-        def _set_custom_attributes(custom_attributes: Mapping[str, Any]):
-            diff = update_attributes_and_get_diff(self.custom_attributes, custom_attributes)
-            self._server.broadcast_client_update(self, diff)
+    def _list_rooms(self, command: common.Command):
+        self.send_command(self._server.get_list_rooms_command())
 
-        def _set_client_name(command: common.Command):
-            _set_custom_attributes({common.ClientAttributes.USERNAME: command.data.decode()})
+    def _delete_room(self, command: common.Command):
+        self._server.delete_room(str(command.data, "utf-8"))
 
-        def _list_clients(command: common.Command):
-            self.send_command(self._server.get_list_clients_command())
+    def _set_custom_attributes(self, custom_attributes: Mapping[str, Any]):
+        diff = update_attributes_and_get_diff(self.custom_attributes, custom_attributes)
+        self._server.broadcast_client_update(self, diff)
 
-        def _set_client_custom_attributes(command: common.Command):
-            _set_custom_attributes(common.decode_json(command.data, 0)[0])
+    def _set_client_name(self, command: common.Command):
+        self._set_custom_attributes({common.ClientAttributes.USERNAME: str(command.data, "utf-8")})
 
-        def _set_room_custom_attributes(command: common.Command):
-            room_name, offset = common.decode_string(command.data, 0)
-            custom_attributes, _ = common.decode_json(command.data, offset)
-            self._server.set_room_custom_attributes(room_name, custom_attributes)
+    def _list_clients(self, command: common.Command):
+        self.send_command(self._server.get_list_clients_command())
 
-        def _set_room_keep_open(command: common.Command):
-            room_name, offset = common.decode_string(command.data, 0)
-            value, _ = common.decode_bool(command.data, offset)
-            self._server.set_room_keep_open(room_name, value)
+    def _set_client_custom_attributes(self, command: common.Command):
+        self._set_custom_attributes(common.decode_json(command.data, 0)[0])
 
-        def _client_id(command: common.Command):
-            self.send_command(
-                common.Command(common.MessageType.CLIENT_ID, f"{self.address[0]}:{self.address[1]}".encode("utf8"))
-            )
+    def _set_room_custom_attributes(self, command: common.Command):
+        room_name, offset = common.decode_string(command.data, 0)
+        custom_attributes, _ = common.decode_json(command.data, offset)
+        self._server.set_room_custom_attributes(room_name, custom_attributes)
 
-        def _content(command: common.Command):
-            if self.room is None:
-                _send_error("Unjoined client trying to set room joinable")
-                return
-            if self.room.joinable:
-                _send_error(f"Trying to set joinable room {self.room.name} which is already joinable")
-                return
-            self.room.joinable = True
-            self._server.broadcast_room_update(self.room, {common.RoomAttributes.JOINABLE: True})
-
-        command_handlers = {
-            common.MessageType.JOIN_ROOM: _join_room,
-            common.MessageType.LEAVE_ROOM: _leave_room,
-            common.MessageType.LIST_ROOMS: _list_rooms,
-            common.MessageType.DELETE_ROOM: _delete_room,
-            common.MessageType.SET_ROOM_CUSTOM_ATTRIBUTES: _set_room_custom_attributes,
-            common.MessageType.SET_ROOM_KEEP_OPEN: _set_room_keep_open,
-            common.MessageType.LIST_CLIENTS: _list_clients,
-            common.MessageType.SET_CLIENT_NAME: _set_client_name,
-            common.MessageType.SET_CLIENT_CUSTOM_ATTRIBUTES: _set_client_custom_attributes,
-            common.MessageType.CLIENT_ID: _client_id,
-            common.MessageType.CONTENT: _content,
-        }
+    def _set_room_keep_open(self, command: common.Command):
+        room_name, offset = common.decode_string(command.data, 0)
+        value, _ = common.decode_bool(command.data, offset)
+        self._server.set_room_keep_open(room_name, value)
 
-        def _handle_incoming_commands():
-            received_commands = common.read_all_messages(self.socket)
-            count = len(received_commands)
-            if count > 0:
-                logger.debug("Received from %s - %d commands ", self.unique_id, count)
-
-            for command in received_commands:
-                if _log_server_updates or command.type not in (common.MessageType.SET_CLIENT_CUSTOM_ATTRIBUTES,):
-                    logger.debug("Received from %s - %s", self.unique_id, command.type)
-
-                if command.type in command_handlers:
-                    command_handlers[command.type](command)
-                elif command.type.value > common.MessageType.COMMAND.value:
-                    if self.room is not None:
-                        self.room.add_command(command, self)
-                    else:
-                        logger.warning(
-                            "%s:%s - %s received but no room was joined",
-                            self.address[0],
-                            self.address[1],
-                            command.type,
-                        )
-                else:
-                    logger.error("Command %s received but no handler for it on server", command.type)
+    def _save_room(self, command: common.Command):
+        room_name, offset = common.decode_string(command.data, 0)
+        file_name, _ = common.decode_string(command.data, offset)
+        try:
+            self._server.save_room(room_name, file_name)
+        except (ValueError, OSError) as e:
+            self._send_error(f"Cannot save room {room_name} to {file_name}: {e}")
+            return
+        self.send_command(common.Command(common.MessageType.SAVE_ROOM, common.encode_string(room_name)))
+
+    def _load_room(self, command: common.Command):
+        room_name, offset = common.decode_string(command.data, 0)
+        file_name, _ = common.decode_string(command.data, offset)
+        try:
+            self._server.load_room(room_name, file_name)
+        except (ValueError, OSError) as e:
+            self._send_error(f"Cannot load room {room_name} from {file_name}: {e}")
+            return
+        self.send_command(common.Command(common.MessageType.LOAD_ROOM, common.encode_string(room_name)))
 
-        def _handle_outgoing_commands():
-            self.fetch_outgoing_commands()
+    def _client_id(self, command: common.Command):
+        self.send_command(
+            common.Command(common.MessageType.CLIENT_ID, f"{self.address[0]}:{self.address[1]}".encode("utf8"))
+        )
+
+    def _capabilities(self, command: common.Command):
+        capabilities, _ = common.decode_json(command.data, 0)
+        self.capabilities = common.SUPPORTED_CAPABILITIES.intersection(capabilities)
+        if common.Capabilities.FRAGMENT in self.capabilities:
+            self.outgoing_commands.fragment_size = common.FRAGMENT_SIZE
+        self.send_command(
+            common.Command(common.MessageType.CAPABILITIES, common.encode_json(sorted(self.capabilities)))
+        )
+        if common.Capabilities.RESUME in self.capabilities:
+            self.send_session()
+        if common.Capabilities.HEARTBEAT in self.capabilities:
+            self.send_heartbeat()
+
+    def _heartbeat(self, command: common.Command):
+        self.peer_idle_timeout, _ = common.decode_float(command.data, 0)
+
+    def send_heartbeat(self):
+        """
+        Queue a HEARTBEAT, with the idle timeout of the server. Meant to be used by any thread.
+        """
+        self.heartbeat_time = time.monotonic()
+        self.add_command(common.make_heartbeat_command(self._server.idle_timeout), bounded=False)
 
-        global SHUTDOWN
-        while not SHUTDOWN:
+    def idle_time(self) -> float:
+        """
+        Return the delay in seconds since data was last received from the client.
+        """
+        return time.monotonic() - self._frame_reader.receive_time
+
+    def send_session(self):
+        self.send_command(common.Command(common.MessageType.SESSION, common.encode_string(self.session_token)))
+
+    def _batch(self, command: common.Command):
+        try:
+            commands = common.batch_contents(command)
+        except ValueError as e:
+            logger.error("%s - corrupted BATCH dropped: %s", self.unique_id, e)
+            return
+        if self.room is None:
+            logger.warning("%s:%s - BATCH received but no room was joined", self.address[0], self.address[1])
+            return
+        room_commands = [command for command in commands if command.type > common.MessageType.COMMAND]
+        if len(room_commands) != len(commands):
+            logger.error("%s - BATCH with commands that are not room commands, ignored", self.unique_id)
+        if room_commands:
+            self.room.add_commands(room_commands, self)
+
+    def _content(self, command: common.Command):
+        if self.room is None:
+            self._send_error("Unjoined client trying to set room joinable")
+            return
+        if self.room.joinable:
+            self._send_error(f"Trying to set joinable room {self.room.name} which is already joinable")
+            return
+        self.room.joinable = True
+        self._server.broadcast_room_update(self.room, {common.RoomAttributes.JOINABLE: True})
+
+    _command_handlers: Mapping[common.MessageType, Callable[[Connection, common.Command], None]] = {
+        common.MessageType.JOIN_ROOM: _join_room,
+        common.MessageType.RESUME_ROOM: _resume_room,
+        common.MessageType.LEAVE_ROOM: _leave_room,
+        common.MessageType.LIST_ROOMS: _list_rooms,
+        common.MessageType.DELETE_ROOM: _delete_room,
+        common.MessageType.SET_ROOM_CUSTOM_ATTRIBUTES: _set_room_custom_attributes,
+        common.MessageType.SET_ROOM_KEEP_OPEN: _set_room_keep_open,
+        common.MessageType.LIST_CLIENTS: _list_clients,
+        common.MessageType.SET_CLIENT_NAME: _set_client_name,
+        common.MessageType.SET_CLIENT_CUSTOM_ATTRIBUTES: _set_client_custom_attributes,
+        common.MessageType.CLIENT_ID: _client_id,
+        common.MessageType.CONTENT: _content,
+        common.MessageType.CAPABILITIES: _capabilities,
+        common.MessageType.SUBSCRIBE: _subscribe,
+        common.MessageType.SAVE_ROOM: _save_room,
+        common.MessageType.LOAD_ROOM: _load_room,
+        common.MessageType.HEARTBEAT: _heartbeat,
+        common.MessageType.BATCH: _batch,
+    }
+
+    def handle_incoming_commands(self, received_commands: List[common.Command]):
+        """
+        Process commands received from the client, whatever the engine that read them from the socket.
+        """
+        count = len(received_commands)
+        if count > 0:
+            logger.debug("Received from %s - %d commands ", self.unique_id, count)
+
+        for command in received_commands:
+            if _log_server_updates or command.type not in (common.MessageType.SET_CLIENT_CUSTOM_ATTRIBUTES,):
+                logger.debug("Received from %s - %s", self.unique_id, command.type)
+
+            if command.type in self._command_handlers:
+                self._command_handlers[command.type](self, command)
+            elif command.type.value > common.MessageType.COMMAND.value:
+                if self.room is not None:
+                    self.room.add_command(command, self)
+                else:
+                    logger.warning(
+                        "%s:%s - %s received but no room was joined",
+                        self.address[0],
+                        self.address[1],
+                        command.type,
+                    )
+            else:
+                logger.error("Command %s received but no handler for it on server", command.type)
+
+    def run(self):
+        while not self._server.shutdown_requested and not self._disconnect_requested:
             try:
-                _handle_incoming_commands()
-                _handle_outgoing_commands()
+                self.handle_incoming_commands(self._frame_reader.read_all(self.socket))
+                self.fetch_outgoing_commands()
+                if self.outgoing_commands.resync_pending() and self.room is not None:
+                    self._server.resync_client(self)
             except common.ClientDisconnectedException:
                 break
 
@@ -178,89 +319,306 @@ class Connection:
 
     def fetch_outgoing_commands(self):
         while True:
-            try:
-                command = self._command_queue.get_nowait()
-            except queue.Empty:
+            commands = self.outgoing_commands.get_batch(common.WRITE_BATCH_SIZE)
+            if not commands:
                 break
 
-            self.send_command(command)
-            self._command_queue.task_done()
+            self._log_sent_commands(commands)
+            common.write_messages(self.socket, commands, self.write_statistics)
+
+    def subscribed(self, command: common.Command) -> bool:
+        """
+        Return True if the client handles the room command.
+        """
+        return self.subscription is None or command.type in self.subscription
+
+    def accepts_batch(self, compressed: bool) -> bool:
+        """
+        Return True if the client handles a BATCH of room commands, compressed ones if compressed is True, as is.
+        """
+        return (
+            common.Capabilities.BATCH in self.capabilities
+            and self.subscription is None
+            and (not compressed or common.Capabilities.COMPRESS in self.capabilities)
+        )
 
-    def add_command(self, command: common.Command):
+    def add_command(self, command: common.Command, bounded: bool = True):
         """
         Add command to be consumed later. Meant to be used by other threads.
+
+        The slow consumer policy applies when bounded commands overflow the queue.
+        """
+        if self._disconnect_requested:
+            return
+        command = self.decodable_command(command)
+        if command is None:
+            return
+        if not self.outgoing_commands.put(command, bounded):
+            self.request_disconnect()
+            return
+        self._report_high_water_mark()
+
+    def decodable_command(self, command: common.Command) -> Optional[common.Command]:
+        """
+        Return command, with its payload inflated if it is compressed and the client does not support compressed
+        payloads, or None if the payload is corrupted.
         """
-        self._command_queue.put(command)
+        if command.compression == common.Compression.NONE or common.Capabilities.COMPRESS in self.capabilities:
+            return command
+        try:
+            return common.decompress_command(command)
+        except ValueError as e:
+            logger.error("%s not sent to %s: %s", command.type, self.unique_id, e)
+            return None
+
+    def request_disconnect(self, reason: str = "slow consumer"):
+        """
+        Disconnect a client that does not consume its commands, or is dead. Meant to be used by other threads.
+        """
+        if self._disconnect_requested:
+            return
+        logger.warning("Disconnecting client %s: %s", self.unique_id, reason)
+        self._disconnect_requested = True
+        try:
+            # Unblock the connection thread if it is blocked writing to the client
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _report_high_water_mark(self):
+        high_water_mark = self.outgoing_commands.high_water_byte_size
+        if high_water_mark < max(MIN_REPORTED_QUEUE_BYTE_SIZE, 2 * self._reported_high_water_mark):
+            return
+        self._reported_high_water_mark = high_water_mark
+        logger.info("%s outgoing queue high-water mark: %d bytes", self.unique_id, high_water_mark)
+        self._server.broadcast_client_update(self, {common.ClientAttributes.QUEUE_HIGH_WATER_MARK: high_water_mark})
 
     def send_command(self, command: common.Command):
         """
         Directly send a command to the socket. Meant to be used by this thread.
         """
         assert threading.current_thread() is self.thread
-        if _log_server_updates or command.type not in (
-            common.MessageType.CLIENT_UPDATE,
-            common.MessageType.ROOM_UPDATE,
-        ):
-            logger.debug("Sending to %s:%s - %s", self.address[0], self.address[1], command.type)
-        common.write_message(self.socket, command)
+        self._log_sent_commands((command,))
+        common.write_message(self.socket, command, self.write_statistics)
+
+    def _log_sent_commands(self, commands: Iterable[common.Command]):
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        for command in commands:
+            if _log_server_updates or command.type not in (
+                common.MessageType.CLIENT_UPDATE,
+                common.MessageType.ROOM_UPDATE,
+            ):
+                logger.debug("Sending to %s:%s - %s", self.address[0], self.address[1], command.type)
 
 
 class Room:
     """
     Room class is responsible for:
     - handling its list of clients (as Connection instances)
-    - keep a list of commands, to be dispatched to new clients
+    - keep a compacted history of commands, to be dispatched to new clients
     - dispatch added commands to clients already in the room
     """
 
-    def __init__(self, server: Server, room_name: str, creator: Connection):
+    def __init__(self, server: Server, room_name: str, creator: Optional[Connection]):
         self.name = room_name
         self.keep_open = False  # Should the room remain open when no more clients are inside ?
-        self.byte_size = 0
         self.joinable = False  # A room becomes joinable when its first client has send all the initial content
 
         self.custom_attributes: Dict[str, Any] = {}  # custom attributes are used between clients, but not by the server
 
-        self._commands: List[common.Command] = []
+        self._server = server
+        self._history = RoomHistory()
+        self._history.spill_directory = server.spill_directory
+        self.activity_time = time.monotonic()  # last time a client joined or left
 
         self._commands_mutex: threading.RLock = threading.RLock()
-        self._connections: List[Connection] = [creator]
+        self._connections: List[Connection] = [creator] if creator is not None else []
 
         self.join_count: int = 0
+        self._journaled_sweep_count = 0  # sweep count of the history when the journal was last rewritten
         # this is used to ensure a room cannot be deleted while clients are joining (creator is not considered to be joining)
         # Server is responsible of increasing / decreasing join_count, with mutex protection
 
+        if creator is None:
+            return  # room recovered from its journal
         creator.room = self
         creator.send_command(common.Command(common.MessageType.JOIN_ROOM, common.encode_string(self.name)))
         creator.send_command(
             common.Command(common.MessageType.CONTENT)
         )  # self.joinable will be set to true by creator later
 
+    def recover(self, attributes: Mapping[str, Any], commands: Iterable[common.FramedCommand]):
+        """
+        Restore the attributes and the commands of the room from its journal, and make it joinable.
+        """
+        attributes = dict(attributes)
+        self.keep_open = attributes.pop(common.RoomAttributes.KEEP_OPEN, False)
+        self.custom_attributes = attributes
+        for command in commands:
+            self._history.append(command)
+        self.joinable = True
+
+    def restore(self, attributes: Mapping[str, Any], file: BinaryIO):
+        """
+        Restore the custom attributes and the commands of the room from a room file, positioned after its header. The
+        room is kept open, and its commands are indexed when a client joins it.
+        """
+        self._restore_custom_attributes(attributes)
+        self.keep_open = True
+        self._history.load_frames(file)
+        self.joinable = True
+
+    def preload(self, attributes: Mapping[str, Any], file_path: str, offset: int, byte_size: int):
+        """
+        Advertise a room baked in a room file, with the attributes read from its header and byte_size bytes of commands
+        from offset. The commands are only read when a client first joins the room. The room is kept open.
+        """
+        self._restore_custom_attributes(attributes)
+        self.keep_open = True
+        # The command count of the header is the one of the room when it was baked, corrected when the file is read
+        command_count = attributes.get(common.RoomAttributes.COMMAND_COUNT, 0)
+        self._history.defer_room_file(file_path, offset, byte_size, command_count)
+        self.joinable = True
+
+    def _restore_custom_attributes(self, attributes: Mapping[str, Any]):
+        self.custom_attributes = {
+            name: value for name, value in attributes.items() if name not in SERVER_ROOM_ATTRIBUTES
+        }
+
+    def save(self, file_path: str):
+        """
+        Write the attributes and the commands of the room to a room file.
+        """
+        with self._commands_mutex:
+            snapshot = self._history.full_snapshot()
+            attributes = self.attributes_dict()
+        # The snapshot is immutable, so the room is not blocked while it is written
+        with open(file_path, "wb") as file:
+            write_room_attributes(file, attributes)
+            file.write(snapshot.buffer)
+
+    def journal_content(self):
+        """
+        Journal the attributes and the commands of a room that was not created by a client.
+        """
+        with self._commands_mutex:
+            snapshot = self._history.full_snapshot()
+            self._journaled_sweep_count = self._history.sweep_count
+            self._server.journal.set_attributes(self.name, self.journaled_attributes())
+            self._server.journal.append_frames(self.name, snapshot.buffer)
+
+    def journaled_attributes(self) -> Dict[str, Any]:
+        return {**self.custom_attributes, common.RoomAttributes.KEEP_OPEN: self.keep_open}
+
+    @property
+    def byte_size(self) -> int:
+        return self._history.byte_size
+
     def client_count(self):
         return len(self._connections) + self.join_count
 
     def command_count(self):
-        return len(self._commands)
+        return self._history.command_count
 
-    def add_client(self, connection: Connection):
-        logger.info(f"Add Client {connection.unique_id} to Room {self.name}")
+    def memory_byte_size(self) -> int:
+        return self._history.memory_byte_size + self._history.index_byte_size
+
+    def can_resume(self, sequence: int) -> bool:
+        with self._commands_mutex:
+            return self._history.can_resume(sequence)
+
+    def spill(self):
+        """
+        Move the commands of the room held in memory to a file.
+        """
+        with self._commands_mutex:
+            memory_byte_size = self._history.memory_byte_size
+            if memory_byte_size == 0:
+                return
+            self._history.spill()
+        logger.info("Room %s: %d bytes spilled to disk", self.name, memory_byte_size)
 
-        connection.send_command(common.Command(common.MessageType.CLEAR_CONTENT))  # todo temporary size stored here
+    def unload(self):
+        """
+        Release the commands of the room down to a snapshot in a file, loaded again when a client joins. The room
+        attributes remain available.
+        """
+        with self._commands_mutex:
+            if self.client_count() > 0:
+                return  # a client joined since the room was selected to be unloaded
+            self._history.unload()
+        logger.info("Room %s unloaded to disk", self.name)
+
+    def add_client(
+        self, connection: Connection, resume_sequence: Optional[int] = None, resume_session: Optional[str] = None
+    ):
+        """
+        Send the room content to a joining client, then add it to the room.
 
-        offset = 0
+        A client that resumes a session already has the room content up to resume_sequence, and only receives the
+        commands after it, except those it sent itself with session resume_session.
+        """
+        logger.info(f"Add Client {connection.unique_id} to Room {self.name}")
+        start_time = time.monotonic()
+        self.activity_time = start_time
+        with self._commands_mutex:
+            if not self._history.loaded:
+                from_room_file = self._history.room_file is not None
+                self._history.load()
+                logger.info("Room %s loaded from disk in %.3f s", self.name, time.monotonic() - start_time)
+                if from_room_file:
+                    if self._server.journal is not None:
+                        self.journal_content()
+                    self._server.broadcast_room_update(
+                        self,
+                        {
+                            common.RoomAttributes.COMMAND_COUNT: self.command_count(),
+                            common.RoomAttributes.BYTE_SIZE: self.byte_size,
+                        },
+                    )
+
+        if resume_sequence is None:
+            with self._commands_mutex:
+                snapshot = self._history.snapshot_for_join()
+                snapshot_attributes = self.snapshot_attributes()
+            # The joining client needs the size of the content before receiving it, other clients can wait
+            if snapshot_attributes:
+                connection.send_command(
+                    common.Command(common.MessageType.ROOM_UPDATE, common.encode_json({self.name: snapshot_attributes}))
+                )
+            self._server.broadcast_room_update(self, snapshot_attributes)
+
+            connection.send_command(common.Command(common.MessageType.CLEAR_CONTENT))  # todo temporary size stored here
+
+            # The snapshot is immutable, send it without holding the mutex, then the tail of commands added after it
+            file_frames = snapshot.file_frames(f"Room {self.name} snapshot for {connection.unique_id}")
+            if (
+                file_frames is not None
+                and connection.subscription is None
+                and (not snapshot.compressed or common.Capabilities.COMPRESS in connection.capabilities)
+            ):
+                connection.add_command(file_frames, bounded=False)
+            else:
+                for command in snapshot.commands():
+                    if connection.subscribed(command):
+                        connection.add_command(command, bounded=False)
+            sequence = snapshot.sequence  # sequence of the last command sent to the client
+        else:
+            sequence = resume_sequence
 
         def _try_finish_sync():
             connection.fetch_outgoing_commands()
             with self._commands_mutex:
-                # from here no one can add commands anymore to self._commands (clients can still join and read previous commands)
-                command_count = self.command_count()
-                if command_count - offset > MAX_BROADCAST_COMMAND_COUNT:
+                # from here no one can add commands anymore to the history (clients can still join and read previous commands)
+                commands = self._history.commands_after(sequence, MAX_BROADCAST_COMMAND_COUNT + 1, resume_session)
+                if len(commands) > MAX_BROADCAST_COMMAND_COUNT:
                     return False  # while still more than MAX_BROADCAST_COMMAND_COUNT commands to broadcast, release the mutex
 
                 # now is time to synchronize all room participants: broadcast remaining commands to new client
-                for i in range(offset, command_count):
-                    command = self._commands[i]
-                    connection.add_command(command)
+                for _, command in commands:
+                    if connection.subscribed(command):
+                        connection.add_command(command, bounded=False)
 
                 # now he's part of the room, let him/her know
                 self._connections.append(connection)
@@ -271,16 +629,52 @@ class Room:
         while True:
             if _try_finish_sync():
                 break  # all done
-            # broadcast commands that were added since last check
-            command_count = self.command_count()
-            for i in range(offset, command_count):
-                command = self._commands[i]  # atomic wrt. the GIL
-                connection.add_command(command)
-            offset = command_count
+            # broadcast commands that were added since last check, holding the mutex only while they are collected
+            with self._commands_mutex:
+                commands = self._history.commands_after(sequence, excluded_origin=resume_session)
+            for sequence, command in commands:
+                if connection.subscribed(command):
+                    connection.add_command(command, bounded=False)
+
+        # The snapshot transfer is logged by the connection when sent with sendfile
+        logger.info(
+            "Client %s joined Room %s in %.3f s", connection.unique_id, self.name, time.monotonic() - start_time
+        )
 
     def remove_client(self, connection: Connection):
         logger.info("Remove Client % s from Room % s", connection.address, self.name)
         self._connections.remove(connection)
+        self.activity_time = time.monotonic()
+        # Room commands are no longer broadcast to the client, that gets the room content again if it joins again
+        connection.outgoing_commands.resume()
+
+    def resync_client(self, connection: Connection):
+        """
+        Send the room content again to a client whose room commands were dropped by the resync slow consumer policy.
+        """
+        logger.info("Resynchronize Client %s in Room %s", connection.unique_id, self.name)
+        with self._commands_mutex:
+            # Commands added from now are in the history sent by add_client
+            self._connections.remove(connection)
+            connection.outgoing_commands.resume()
+        self.add_client(connection)
+
+    def broadcast(self, command: common.Command):
+        """
+        Send a command to the clients of the room, joining clients excepted.
+        """
+        for connection in list(self._connections):
+            connection.add_command(command)
+
+    def snapshot_attributes(self) -> Dict[str, Any]:
+        snapshot = self._history.snapshot
+        if snapshot is None:
+            return {}
+        return {
+            common.RoomAttributes.SNAPSHOT_BYTE_SIZE: snapshot.byte_size,
+            common.RoomAttributes.SNAPSHOT_AGE: snapshot.age(),
+            common.RoomAttributes.JOIN_BYTE_SIZE: self._history.join_byte_size(),
+        }
 
     def attributes_dict(self):
         return {
@@ -289,50 +683,98 @@ class Room:
             common.RoomAttributes.COMMAND_COUNT: self.command_count(),
             common.RoomAttributes.BYTE_SIZE: self.byte_size,
             common.RoomAttributes.JOINABLE: self.joinable,
+            **self.snapshot_attributes(),
         }
 
     def add_command(self, command, sender: Connection):
-        def merge_command():
-            """
-            Add the command to the room list, possibly merge with the previous command.
-            """
-            command_type = command.type
-            if command_type.value > common.MessageType.OPTIMIZED_COMMANDS.value:
-                command_path = common.decode_string(command.data, 0)[0]
-                if self.command_count() > 0:
-                    stored_command = self._commands[-1]
-                    if (
-                        command_type == stored_command.type
-                        and command_path == common.decode_string(stored_command.data, 0)[0]
-                    ):
-                        self._commands.pop()
-                        self.byte_size -= stored_command.byte_size()
-            self._commands.append(command)
-            self.byte_size += command.byte_size()
+        self.add_commands([command], sender)
+
+    def add_commands(self, commands: List[common.Command], sender: Connection):
+        """
+        Add room commands received from sender to the history and broadcast them, with a single room update.
 
+        The commands of a BATCH are stored and compacted one by one, but broadcast in a single BATCH frame shared by
+        the receivers that accept it.
+        """
         with self._commands_mutex:
             current_byte_size = self.byte_size
             current_command_count = self.command_count()
-            merge_command()
+            stored_commands = []
+            for command in commands:
+                if self._server.journal is not None and self._journaled_sweep_count != self._history.sweep_count:
+                    # The commands swept from the history since the journal was written are removed from it too
+                    self._journaled_sweep_count = self._history.sweep_count
+                    self._server.journal.rewrite(self.name, self._history.frames())
+                # The history frames the command once for itself and all receivers, with its sequence number in the
+                # room as id. This also copies the payload out of the receive buffer of the sender, that must not be
+                # pinned
+                self._history.append(command, sender.session_token)
+                command = self._history.last_command()
+                if self._server.journal is not None:
+                    self._server.journal.append(self.name, command)
+                stored_commands.append(command)
+            if 0 < self._server.max_room_memory_byte_size < self._history.memory_byte_size:
+                self.spill()
 
             room_update = {}
             if self.byte_size != current_byte_size:
                 room_update[common.RoomAttributes.BYTE_SIZE] = self.byte_size
             if current_command_count != self.command_count():
                 room_update[common.RoomAttributes.COMMAND_COUNT] = self.command_count()
+            if self._history.snapshot is not None:
+                room_update[common.RoomAttributes.JOIN_BYTE_SIZE] = self._history.join_byte_size()
 
             sender._server.broadcast_room_update(self, room_update)
 
+            batch = None
+            compressed = any(command.compression != common.Compression.NONE for command in stored_commands)
             for connection in self._connections:
-                if connection != sender:
-                    connection.add_command(command)
+                if connection == sender:
+                    continue
+                if len(stored_commands) > 1 and connection.accepts_batch(compressed):
+                    if batch is None:
+                        batch = common.make_batch_command(stored_commands)
+                    connection.add_command(batch)
+                    continue
+                for command in stored_commands:
+                    if connection.subscribed(command):
+                        connection.add_command(command)
 
 
 class Server:
-    def __init__(self):
+    def __init__(
+        self,
+        max_queue_byte_size: int = MAX_QUEUE_BYTE_SIZE,
+        slow_consumer_policy: SlowConsumerPolicy = SlowConsumerPolicy.COLLAPSE,
+        presence_tick: float = PRESENCE_TICK,
+    ):
         self._rooms: Dict[str, Room] = {}
         self._connections: Dict[str, Connection] = {}
         self._mutex = threading.RLock()
+        self.shutdown_requested = False
+        self.max_queue_byte_size = max_queue_byte_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self._presence = Presence(presence_tick)
+        self.journal: Optional[RoomJournal] = None
+        # Room and disconnection time of the sessions of disconnected clients, by session token
+        self._sessions: Dict[str, Tuple[Room, float]] = {}
+        self._session_check_time = 0.0
+
+        self.max_memory_byte_size = 0  # memory budget of all the rooms, 0 for no limit
+        self.max_room_memory_byte_size = 0  # memory budget of each room, 0 for no limit
+        self.spill_directory: Optional[str] = None
+        self._memory_check_time = 0.0
+
+        self.heartbeat_interval = common.HEARTBEAT_INTERVAL
+        self.idle_timeout = common.IDLE_TIMEOUT  # 0 to never disconnect silent clients
+        self._heartbeat_check_time = 0.0
+
+        # Directory of the room files of SAVE_ROOM and LOAD_ROOM, that are refused if not set
+        self.rooms_directory: Optional[str] = None
+
+        self.local_socket_path: Optional[str] = None  # Unix domain socket listened on besides the TCP port
+        self.ready_port: Optional[int] = None  # port of the loopback interface notified when the server is listening
+        self._local_client_ids = itertools.count(1)  # Unix domain socket clients have no address
 
     def delete_room(self, room_name: str):
         with self._mutex:
@@ -343,14 +785,26 @@ class Server:
                 logger.warning("Room %s is not empty.", room_name)
                 return
 
-            del self._rooms[room_name]
+            room = self._rooms.pop(room_name)
+            self._presence.discard_room(room_name)
+            # The sessions in the room cannot be resumed anymore, and must not keep its history alive
+            self._sessions = {token: session for token, session in self._sessions.items() if session[0] is not room}
+            # Rooms left at shutdown are recovered at the next startup
+            if self.journal is not None and not self.shutdown_requested:
+                self.journal.delete(room_name)
             logger.info(f"Room {room_name} deleted")
 
             self.broadcast_to_all_clients(
                 common.Command(common.MessageType.ROOM_DELETED, common.encode_string(room_name))
             )
 
-    def join_room(self, connection: Connection, room_name: str):
+    def join_room(
+        self,
+        connection: Connection,
+        room_name: str,
+        resume_sequence: Optional[int] = None,
+        resume_session: Optional[str] = None,
+    ):
         assert connection.room is None
 
         def _create_room():
@@ -376,15 +830,73 @@ class Server:
             # Ensure the room will not be deleted because it now has at least one client
             room.join_count += 1
 
-        room.add_client(connection)
-        # this call can take a while because history broadcasting occurs, so the mutex is released here
+        if resume_session is not None:
+            # The client session continues, so that its commands are not sent back if it resumes again
+            connection.session_token = resume_session
+            connection.send_session()
 
-        # from here client is in the room list, we can decrease join_count
-        with self._mutex:
-            room.join_count -= 1
+        try:
+            room.add_client(connection, resume_sequence, resume_session)
+            # this call can take a while because history broadcasting occurs, so the mutex is released here
+        finally:
+            # from here client is in the room list, or could not join it, we can decrease join_count
+            with self._mutex:
+                room.join_count -= 1
 
         assert connection.room is not None
         self.broadcast_client_update(connection, {common.ClientAttributes.ROOM: connection.room.name})
+        self._exchange_room_attributes(connection, room)
+
+    def _exchange_room_attributes(self, connection: Connection, room: Room):
+        """
+        Send the room scoped attributes of the clients of the room to a client that joined it, and the room scoped
+        attributes of this client to them.
+        """
+        with self._mutex:
+            members = {}
+            for member in room._connections:
+                _, room_attributes = split_client_attributes(member.client_attributes())
+                if member is not connection and room_attributes:
+                    members[member.unique_id] = room_attributes
+            if members:
+                connection.add_command(common.Command(common.MessageType.CLIENT_UPDATE, common.encode_json(members)))
+
+        _, room_attributes = split_client_attributes(connection.client_attributes())
+        self.broadcast_client_update(connection, room_attributes)
+
+    def resume_room(self, connection: Connection, room_name: str, session_token: str, sequence: int):
+        """
+        Join a room again with only the commands after sequence, if the client session was in the room when it was
+        disconnected. Otherwise the client joins the room as usual.
+        """
+        with self._mutex:
+            session_room, disconnect_time = self._sessions.pop(session_token, (None, 0.0))
+            room = self._rooms.get(room_name)
+
+        if (
+            room is not None
+            and room is session_room
+            and time.monotonic() - disconnect_time <= SESSION_TIMEOUT
+            and room.can_resume(sequence)
+        ):
+            logger.info("Resume session of %s in room %s after %d", connection.unique_id, room_name, sequence)
+            self.join_room(connection, room_name, sequence, session_token)
+        else:
+            logger.info("Cannot resume session of %s in room %s, joining it", connection.unique_id, room_name)
+            self.join_room(connection, room_name)
+
+    def resync_client(self, connection: Connection):
+        room = connection.room
+        assert room is not None
+
+        with self._mutex:
+            # The room cannot be deleted while the client is out of its list
+            room.join_count += 1
+
+        room.resync_client(connection)
+
+        with self._mutex:
+            room.join_count -= 1
 
     def leave_room(self, connection: Connection):
         assert connection.room is not None
@@ -408,20 +920,63 @@ class Server:
                 connection.add_command(command)
 
     def broadcast_client_update(self, connection: Connection, attributes: Dict[str, Any]):
+        """
+        Broadcast the updated attributes of a client at the next presence tick, to all clients or to the clients of
+        its room depending on the attribute.
+        """
         if attributes == {}:
             return
 
-        self.broadcast_to_all_clients(
-            common.Command(common.MessageType.CLIENT_UPDATE, common.encode_json({connection.unique_id: attributes}))
-        )
+        self._presence.update_client(connection.unique_id, attributes)
+        if self._presence.tick == 0:
+            self.broadcast_presence()
 
     def broadcast_room_update(self, room: Room, attributes: Dict[str, Any]):
+        """
+        Broadcast the updated attributes of a room to all clients at the next presence tick.
+        """
         if attributes == {}:
             return
 
-        self.broadcast_to_all_clients(
-            common.Command(common.MessageType.ROOM_UPDATE, common.encode_json({room.name: attributes}),)
-        )
+        self._presence.update_room(room.name, attributes)
+        if self._presence.tick == 0:
+            self.broadcast_presence()
+
+    def broadcast_presence(self):
+        """
+        Broadcast the client and room attribute updates, if they are due. Updates of the same client or room are
+        merged, and sent in a single CLIENT_UPDATE and a single ROOM_UPDATE per scope.
+        """
+        # Hold the server mutex, so that no update is sent after its client is disconnected or its room deleted
+        with self._mutex:
+            client_updates, room_updates = self._presence.pop_due()
+
+            global_updates = {}
+            updates_by_room: Dict[str, Dict[str, Dict[str, Any]]] = {}
+            for client_id, attributes in client_updates.items():
+                connection = self._connections.get(client_id)
+                if connection is None:
+                    continue
+                global_attributes, room_attributes = split_client_attributes(attributes)
+                if global_attributes:
+                    global_updates[client_id] = global_attributes
+                if room_attributes and connection.room is not None:
+                    updates_by_room.setdefault(connection.room.name, {})[client_id] = room_attributes
+
+            if global_updates:
+                self.broadcast_to_all_clients(
+                    common.Command(common.MessageType.CLIENT_UPDATE, common.encode_json(global_updates))
+                )
+            for room_name, updates in updates_by_room.items():
+                room = self._rooms.get(room_name)
+                if room is not None:
+                    room.broadcast(common.Command(common.MessageType.CLIENT_UPDATE, common.encode_json(updates)))
+
+            room_updates = {name: attributes for name, attributes in room_updates.items() if name in self._rooms}
+            if room_updates:
+                self.broadcast_to_all_clients(
+                    common.Command(common.MessageType.ROOM_UPDATE, common.encode_json(room_updates))
+                )
 
     def set_room_custom_attributes(self, room_name: str, custom_attributes: Mapping[str, Any]):
         with self._mutex:
@@ -429,8 +984,11 @@ class Server:
                 logger.warning("Room %s does not exist.", room_name)
                 return
 
-            diff = update_attributes_and_get_diff(self._rooms[room_name].custom_attributes, custom_attributes)
-            self.broadcast_room_update(self._rooms[room_name], diff)
+            room = self._rooms[room_name]
+            diff = update_attributes_and_get_diff(room.custom_attributes, custom_attributes)
+            self.broadcast_room_update(room, diff)
+            if diff and self.journal is not None:
+                self.journal.set_attributes(room_name, room.journaled_attributes())
 
     def set_room_keep_open(self, room_name: str, value: bool):
         with self._mutex:
@@ -441,6 +999,8 @@ class Server:
             if room.keep_open != value:
                 room.keep_open = value
                 self.broadcast_room_update(room, {common.RoomAttributes.KEEP_OPEN: room.keep_open})
+                if self.journal is not None:
+                    self.journal.set_attributes(room_name, room.journaled_attributes())
 
     def get_list_rooms_command(self) -> common.Command:
         with self._mutex:
@@ -459,6 +1019,9 @@ class Server:
 
         # Clean leaving of the room
         if connection.room is not None:
+            if common.Capabilities.RESUME in connection.capabilities:
+                with self._mutex:
+                    self._sessions[connection.session_token] = (connection.room, time.monotonic())
             self.leave_room(connection)
 
         try:
@@ -466,38 +1029,531 @@ class Server:
         except Exception as e:
             logger.warning(e)
         logger.info("%s closed", connection.address)
+        logger.info("%s write statistics: %s", connection.unique_id, connection.write_statistics)
+        outgoing_commands = connection.outgoing_commands
+        logger.info(
+            "%s outgoing queue: high-water mark %d bytes, %d commands, %d overflows, %d commands dropped",
+            connection.unique_id,
+            outgoing_commands.high_water_byte_size,
+            outgoing_commands.high_water_command_count,
+            outgoing_commands.overflow_count,
+            outgoing_commands.dropped_count,
+        )
+        # The commands of a dead client must not stay in memory until the connection is collected
+        outgoing_commands.clear()
 
+        self._presence.discard_client(connection.unique_id)
         self.broadcast_to_all_clients(
             common.Command(common.MessageType.CLIENT_DISCONNECTED, common.encode_string(connection.unique_id))
         )
 
-    def run(self, port):
-        global SHUTDOWN
+    def expire_sessions(self):
+        """
+        Forget the sessions disconnected for more than SESSION_TIMEOUT.
+
+        Called periodically by the server loop, the sessions being checked at most every SESSION_CHECK_INTERVAL.
+        """
+        now = time.monotonic()
+        if now < self._session_check_time + SESSION_CHECK_INTERVAL:
+            return
+        self._session_check_time = now
+        with self._mutex:
+            for token, (_, disconnect_time) in list(self._sessions.items()):
+                if now - disconnect_time > SESSION_TIMEOUT:
+                    del self._sessions[token]
+
+    def set_heartbeat(self, interval: float, idle_timeout: float):
+        """
+        Send a HEARTBEAT every interval seconds to the clients with the heartbeat capability, and disconnect those that
+        send nothing during idle_timeout seconds, 0 to never disconnect them.
+        """
+        self.heartbeat_interval = interval
+        self.idle_timeout = idle_timeout
+
+    def check_heartbeats(self):
+        """
+        Send the heartbeats that are due, and disconnect the clients that stayed silent for more than idle_timeout.
+
+        Called periodically by the server loop, the clients being checked at most every HEARTBEAT_CHECK_INTERVAL.
+        """
+        now = time.monotonic()
+        if now < self._heartbeat_check_time + HEARTBEAT_CHECK_INTERVAL:
+            return
+        self._heartbeat_check_time = now
+        with self._mutex:
+            connections = list(self._connections.values())
+        for connection in connections:
+            if common.Capabilities.HEARTBEAT not in connection.capabilities:
+                continue
+            idle_time = connection.idle_time()
+            if 0 < self.idle_timeout < idle_time:
+                connection.request_disconnect(f"nothing received for {idle_time:.0f} s")
+            elif now - connection.heartbeat_time >= common.heartbeat_interval(
+                self.heartbeat_interval, connection.peer_idle_timeout
+            ):
+                connection.send_heartbeat()
+
+    def make_connection(self, sock: socket.socket, address) -> Connection:
+        return Connection(self, sock, address)
+
+    def add_connection(self, sock: socket.socket, address):
+        common.enable_keepalive(sock)
+        connection = self.make_connection(sock, address)
+        with self._mutex:
+            self._connections[connection.unique_id] = connection
+        connection.start()
+        logger.info(f"New connection from {address}")
+        self.broadcast_client_update(connection, connection.client_attributes())
+
+    def open_journal(
+        self, directory: str, fsync_interval: float = FSYNC_INTERVAL, fsync_byte_size: int = FSYNC_BYTE_SIZE
+    ):
+        """
+        Recover the rooms journaled in directory, then journal the rooms of the server there.
+        """
+        assert self.journal is None
+        os.makedirs(directory, exist_ok=True)
+        with self._mutex:
+            # The journals of the rooms of other processes are left to them
+            for room_name, attributes, commands in load_journals(directory, self.owns_room):
+                room = Room(self, room_name, None)
+                room.recover(attributes, commands)
+                self._rooms[room_name] = room
+                logger.info("Room %s recovered from its journal: %d commands", room_name, room.command_count())
+        self.journal = RoomJournal(directory, fsync_interval, fsync_byte_size)
+
+    def set_memory_budget(self, max_byte_size: int, max_room_byte_size: int = 0, spill_directory: Optional[str] = None):
+        """
+        Spill rooms to files in spill_directory when the commands held in memory by all the rooms are larger than
+        max_byte_size, or when those of a room are larger than max_room_byte_size. 0 for no limit.
+        """
+        if spill_directory is not None:
+            os.makedirs(spill_directory, exist_ok=True)
+        with self._mutex:
+            self.max_memory_byte_size = max_byte_size
+            self.max_room_memory_byte_size = max_room_byte_size
+            self.spill_directory = spill_directory
+            for room in self._rooms.values():
+                room._history.spill_directory = spill_directory
+
+    def enforce_memory_budget(self):
+        """
+        Spill rooms to disk while the rooms hold more than max_memory_byte_size in memory: first unload the rooms
+        without clients, the least recently used first, then spill the history of the rooms that hold the most memory.
+
+        Called periodically by the server loop, the budget being checked at most every MEMORY_CHECK_INTERVAL.
+        """
+        now = time.monotonic()
+        if self.max_memory_byte_size <= 0 or now < self._memory_check_time + MEMORY_CHECK_INTERVAL:
+            return
+        self._memory_check_time = now
+
+        with self._mutex:
+            rooms = list(self._rooms.values())
+            memory_byte_size = sum(room.memory_byte_size() for room in rooms)
+            if memory_byte_size <= self.max_memory_byte_size:
+                return
+            cold_rooms = sorted(
+                (room for room in rooms if room.client_count() == 0 and room.joinable), key=lambda r: r.activity_time
+            )
+            active_rooms = sorted(
+                (room for room in rooms if room not in cold_rooms), key=lambda r: r.memory_byte_size(), reverse=True
+            )
+        logger.debug(
+            "Rooms memory %d bytes exceeds the budget of %d bytes", memory_byte_size, self.max_memory_byte_size
+        )
+
+        # Outside of the server mutex since files are written. A client joining a cold room meanwhile loads it again
+        for room in cold_rooms + active_rooms:
+            if memory_byte_size <= self.max_memory_byte_size:
+                break
+            room_memory_byte_size = room.memory_byte_size()
+            if room in cold_rooms:
+                room.unload()
+            else:
+                room.spill()
+            memory_byte_size -= room_memory_byte_size - room.memory_byte_size()
+
+    def room_file_path(self, file_name: str) -> str:
+        """
+        Return the path of a room file of SAVE_ROOM and LOAD_ROOM, that must be a bare file name of the rooms directory.
+        Raise ValueError if the rooms directory is not set or the file name is not inside it.
+        """
+        if self.rooms_directory is None:
+            raise ValueError("Room files are disabled, the server is not started with --rooms-dir")
+        if file_name in ("", ".", "..") or "/" in file_name or "\\" in file_name or os.path.splitdrive(file_name)[0]:
+            raise ValueError(f"Invalid room file name {file_name!r}, expected a file name without directory")
+        directory = os.path.realpath(self.rooms_directory)
+        # A symbolic link must not lead out of the directory
+        file_path = os.path.realpath(os.path.join(directory, file_name))
+        if os.path.dirname(file_path) != directory:
+            raise ValueError(f"Room file {file_name} is outside of the rooms directory")
+        return file_path
+
+    def save_room(self, room_name: str, file_name: str):
+        """
+        Write a room to a file of the rooms directory, in the room_bake.save_room() format.
+        Raise ValueError if the room does not exist or the file name is refused, OSError if the file cannot be written.
+        """
+        file_path = self.room_file_path(file_name)
+        with self._mutex:
+            room = self._rooms.get(room_name)
+        if room is None:
+            raise ValueError(f"Room {room_name} does not exist")
+        start_time = time.monotonic()
+        room.save(file_path)
+        logger.info("Room %s saved to %s in %.3f s", room_name, file_path, time.monotonic() - start_time)
+
+    def load_room(self, room_name: str, file_name: str):
+        """
+        Create a room from a file of the rooms directory, in the room_bake.save_room() format.
+        Raise ValueError if the room exists or the file is refused or invalid, OSError if the file cannot be read.
+        """
+        file_path = self.room_file_path(file_name)
+        with self._mutex:
+            if room_name in self._rooms:
+                raise ValueError(f"Room {room_name} already exists")
+        start_time = time.monotonic()
+        room = Room(self, room_name, None)
+        with open(file_path, "rb") as file:
+            room.restore(read_room_attributes(file), file)
+
+        with self._mutex:
+            if room_name in self._rooms:
+                raise ValueError(f"Room {room_name} already exists")
+            self._rooms[room_name] = room
+            if self.journal is not None:
+                room.journal_content()
+        logger.info(
+            "Room %s loaded from %s in %.3f s: %d commands",
+            room_name,
+            file_path,
+            time.monotonic() - start_time,
+            room.command_count(),
+        )
+        self.broadcast_room_update(room, room.attributes_dict())
+
+    def preload_rooms(self, directory: str):
+        """
+        Advertise the rooms baked in the files of directory, in the room_bake.save_room() format, each named after its
+        file. Only the file headers are read, the commands of a room are read when a client first joins it. Existing
+        rooms, like the rooms recovered from the journal, are not replaced.
+        The directory is also the one of the room files of SAVE_ROOM and LOAD_ROOM.
+        """
+        with self._mutex:
+            self.rooms_directory = directory
+            for file_name in sorted(os.listdir(directory)):
+                file_path = os.path.join(directory, file_name)
+                room_name = os.path.splitext(file_name)[0]
+                if not os.path.isfile(file_path) or not self.owns_room(room_name):
+                    continue
+                if room_name in self._rooms:
+                    logger.info("Room %s already exists, not preloaded from %s", room_name, file_path)
+                    continue
+                try:
+                    with open(file_path, "rb") as file:
+                        attributes = read_room_attributes(file)
+                        offset = file.tell()
+                        byte_size = os.fstat(file.fileno()).st_size - offset
+                except (ValueError, OSError) as e:
+                    logger.warning("Cannot preload a room from %s: %s", file_path, e)
+                    continue
+                room = Room(self, room_name, None)
+                room.preload(attributes, file_path, offset, byte_size)
+                self._rooms[room_name] = room
+                logger.info("Room %s preloaded from %s: %d bytes", room_name, file_path, byte_size)
+
+    def owns_room(self, room_name: str) -> bool:
+        """
+        Return True if the room is managed by this server, and not by another process of the same service.
+        """
+        return True
+
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def shutdown(self):
+        self.shutdown_requested = True
+
+    def listen(self, port: int) -> List[socket.socket]:
+        """
+        Return the non blocking sockets the server accepts connections on: the TCP socket of port, and the Unix domain
+        socket at local_socket_path if set. Then notify ready_port if set.
+        """
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         binding_host = ""
         sock.bind((binding_host, port))
-        sock.setblocking(0)
+        sock.setblocking(False)
         sock.listen(1000)
-
+        sockets = [sock]
         logger.info("Listening on port % s", port)
+
+        if self.local_socket_path is not None:
+            try:
+                sockets.append(_listen_local(self.local_socket_path))
+                logger.info("Listening on %s", self.local_socket_path)
+            except OSError as e:
+                logger.warning("Cannot listen on %s: %s", self.local_socket_path, e)
+
+        if self.ready_port is not None:
+            common.notify_ready(self.ready_port)
+        return sockets
+
+    def accept(self, sock: socket.socket):
+        client_socket, client_address = sock.accept()
+        if not client_address:
+            client_address = ("local", next(self._local_client_ids))
+        self.add_connection(client_socket, client_address)
+
+    def run(self, port):
+        sockets = self.listen(port)
+        while not self.shutdown_requested:
+            try:
+                # Check for a new client every 10th of a second, and for presence updates at each tick
+                timeout = min(0.1, self._presence.tick) if self._presence.tick > 0 else 0.1
+                readable, _, _ = select.select(sockets, [], [], timeout)
+                for sock in readable:
+                    self.accept(sock)
+                self.broadcast_presence()
+                self.enforce_memory_budget()
+                self.expire_sessions()
+                self.check_heartbeats()
+            except KeyboardInterrupt:
+                break
+
+        logger.info("Shutting down server")
+        self.shutdown_requested = True
+        _close_listening(sockets)
+        self.close_journal()
+
+
+class SelectorConnection(Connection):
+    """
+    Connection driven by the event loop of a SelectorServer.
+
+    The socket is non blocking and all methods are called from the event loop thread. Commands are framed lazily when
+    the socket is writable, a bounded batch at a time, so that a joining client does not get a copy of the whole room
+    history built synchronously in the event loop.
+    """
+
+    def __init__(self, server: SelectorServer, sock: socket.socket, address):
+        super().__init__(server, sock, address)
+        self.socket.setblocking(False)
+        self.closed = False
+        self._selector_server = server
+        # Framed buffers of the batch being written, memoryviews or FileRanges
+        self._write_buffers: Deque[Any] = collections.deque()
+
+    def start(self):
+        self._selector_server.selector.register(self.socket, selectors.EVENT_READ, self)
+
+    def fetch_outgoing_commands(self):
+        # Output is flushed by the event loop when the socket becomes writable
+        pass
+
+    def add_command(self, command: common.Command, bounded: bool = True):
+        if self.closed or self._disconnect_requested:
+            return
+        command = self.decodable_command(command)
+        if command is None:
+            return
+        self._log_sent_commands((command,))
+        was_idle = len(self.outgoing_commands) == 0 and len(self._write_buffers) == 0
+        if not self.outgoing_commands.put(command, bounded):
+            self.request_disconnect()
+            return
+        self._report_high_water_mark()
+        if was_idle:
+            self._selector_server.selector.modify(self.socket, selectors.EVENT_READ | selectors.EVENT_WRITE, self)
+
+    def send_command(self, command: common.Command):
+        self.add_command(command, bounded=False)
+
+    def request_disconnect(self, reason: str = "slow consumer"):
+        if self._disconnect_requested:
+            return
+        logger.warning("Disconnecting client %s: %s", self.unique_id, reason)
+        self._disconnect_requested = True
+        self._selector_server.request_disconnect(self)
+
+    def on_readable(self):
+        if self._frame_reader.recv(self.socket):
+            self.handle_incoming_commands(self._frame_reader.commands())
+
+    def _frame_batch(self):
+        """
+        Frame pending commands until WRITE_BATCH_SIZE bytes are ready. Payloads are referenced, not copied.
+        """
+        commands = self.outgoing_commands.get_batch(common.WRITE_BATCH_SIZE)
+        common.frame_commands(commands, self._write_buffers)
+        self.write_statistics.add_messages(len(commands))
+
+    def on_writable(self):
         while True:
+            if not self._write_buffers:
+                self._frame_batch()
+                if not self._write_buffers:
+                    if self.outgoing_commands.resync_pending() and self.room is not None:
+                        self._selector_server.resync_client(self)
+                        continue
+                    break
+
+            if not common.send_buffers(self.socket, self._write_buffers, self.write_statistics):
+                return
+
+        self._selector_server.selector.modify(self.socket, selectors.EVENT_READ, self)
+
+
+class SelectorServer(Server):
+    """
+    Server engine multiplexing all sockets in a single thread with the selectors module.
+
+    Unlike the thread engine that polls each socket continuously, the event loop only wakes up when a socket is
+    readable or writable, or when shutdown() is called. Server and Room logic is shared with the thread engine: since
+    everything runs in the loop thread, mutexes are never contended.
+    """
+
+    def __init__(
+        self,
+        max_queue_byte_size: int = MAX_QUEUE_BYTE_SIZE,
+        slow_consumer_policy: SlowConsumerPolicy = SlowConsumerPolicy.COLLAPSE,
+        presence_tick: float = PRESENCE_TICK,
+    ):
+        super().__init__(max_queue_byte_size, slow_consumer_policy, presence_tick)
+        self.selector = selectors.DefaultSelector()
+        self._wakeup_receiver, self._wakeup_sender = socket.socketpair()
+        self._disconnect_requests: List[SelectorConnection] = []
+        self._listening_sockets: List[socket.socket] = []
+
+    def make_connection(self, sock: socket.socket, address) -> Connection:
+        return SelectorConnection(self, sock, address)
+
+    def shutdown(self):
+        super().shutdown()
+        try:
+            self._wakeup_sender.send(b"\0")
+        except OSError:
+            pass
+
+    def request_disconnect(self, connection: SelectorConnection):
+        # Disconnected after the current events are processed, since the connection may be in a room being iterated
+        self._disconnect_requests.append(connection)
+
+    def handle_client_disconnect(self, connection: Connection):
+        assert isinstance(connection, SelectorConnection)
+        if connection.closed:
+            return
+        connection.closed = True
+        self.selector.unregister(connection.socket)
+        super().handle_client_disconnect(connection)
+
+    def run(self, port):
+        self._listening_sockets = self.listen(port)
+        for sock in self._listening_sockets:
+            self.selector.register(sock, selectors.EVENT_READ)
+        logger.info("Selector engine started")
+        self.serve()
+
+    def serve(self):
+        """
+        Run the event loop until shutdown() is called.
+        """
+        self.selector.register(self._wakeup_receiver, selectors.EVENT_READ)
+        while not self.shutdown_requested:
+            timeout = self._presence.timeout()
+            if SELECT_TIMEOUT is not None and (timeout is None or timeout > SELECT_TIMEOUT):
+                timeout = SELECT_TIMEOUT
+            # Wake up to send heartbeats and detect dead clients
+            if self._connections and (timeout is None or timeout > HEARTBEAT_CHECK_INTERVAL):
+                timeout = HEARTBEAT_CHECK_INTERVAL
             try:
-                timeout = 0.1  # Check for a new client every 10th of a second
-                readable, _, _ = select.select([sock], [], [], timeout)
-                if len(readable) > 0:
-                    client_socket, client_address = sock.accept()
-                    connection = Connection(self, client_socket, client_address)
-                    with self._mutex:
-                        self._connections[connection.unique_id] = connection
-                    connection.start()
-                    logger.info(f"New connection from {client_address}")
-                    self.broadcast_client_update(connection, connection.client_attributes())
+                events = self.selector.select(timeout)
             except KeyboardInterrupt:
                 break
 
+            for key, mask in events:
+                if key.fileobj in self._listening_sockets:
+                    try:
+                        self.accept(key.fileobj)
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    except OSError as e:
+                        logger.warning("Error while accepting a connection: %s", e)
+                    continue
+
+                if key.fileobj is self._wakeup_receiver:
+                    self._wakeup_receiver.recv(1024)
+                    continue
+
+                connection = key.data
+                try:
+                    if mask & selectors.EVENT_READ and not connection.closed:
+                        connection.on_readable()
+                    if mask & selectors.EVENT_WRITE and not connection.closed:
+                        connection.on_writable()
+                except common.ClientDisconnectedException:
+                    self.handle_client_disconnect(connection)
+                except Exception as e:
+                    logger.error("Error while processing %s: %s", connection.unique_id, e, exc_info=True)
+                    self.handle_client_disconnect(connection)
+
+            while self._disconnect_requests:
+                self.handle_client_disconnect(self._disconnect_requests.pop())
+
+            self.broadcast_presence()
+            self.enforce_memory_budget()
+            self.expire_sessions()
+            self.check_heartbeats()
+
         logger.info("Shutting down server")
-        SHUTDOWN = True
+        self.shutdown_requested = True
+        with self._mutex:
+            connections = list(self._connections.values())
+        for connection in connections:
+            self.handle_client_disconnect(connection)
+        for sock in self._listening_sockets:
+            self.selector.unregister(sock)
+        _close_listening(self._listening_sockets)
+        self.selector.unregister(self._wakeup_receiver)
+        self.selector.close()
+        self._wakeup_receiver.close()
+        self._wakeup_sender.close()
+        self.close_journal()
+
+
+def _listen_local(path: str) -> socket.socket:
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not common.is_private_directory(directory):
+        raise OSError(f"{directory} is accessible by other users")
+    if os.path.exists(path):
+        # Left by a server that did not stop cleanly, unless a server still listens on it
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            if probe.connect_ex(path) == 0:
+                raise OSError(f"{path} is used by another server")
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.setblocking(False)
+    sock.listen(1000)
+    return sock
+
+
+def _close_listening(sockets: Iterable[socket.socket]):
+    for sock in sockets:
+        address = sock.getsockname()
         sock.close()
+        if isinstance(address, str):
+            # The file of a Unix domain socket
+            try:
+                os.unlink(address)
+            except OSError as e:
+                logger.warning(e)
+
+
+ENGINES = {"thread": Server, "selector": SelectorServer}
 
 
 def main():
@@ -507,15 +1563,176 @@ def main():
 
     _log_server_updates = args.log_server_updates
 
-    server = Server()
+    server_args = (
+        args.max_queue_size * 1024 * 1024,
+        SlowConsumerPolicy(args.slow_consumer_policy),
+        args.presence_tick / 1000,
+    )
+    memory_budget = None
+    if args.max_memory or args.max_room_memory:
+        memory_budget = {
+            "max_byte_size": args.max_memory * 1024 * 1024,
+            "max_room_byte_size": args.max_room_memory * 1024 * 1024,
+            "spill_directory": args.spill_dir,
+        }
+    heartbeat = {"interval": args.heartbeat_interval / 1000, "idle_timeout": args.idle_timeout / 1000}
+    journal = None
+    if args.journal_dir:
+        journal = {
+            "directory": args.journal_dir,
+            "fsync_interval": args.journal_fsync_interval / 1000,
+            "fsync_byte_size": args.journal_fsync_size * 1024 * 1024,
+        }
+
+    if args.workers > 0:
+        # Imported here since the supervisor module depends on this one
+        from mixer.broadcaster.apps.supervisor import Supervisor
+
+        if memory_budget is not None:
+            memory_budget["max_byte_size"] //= args.workers
+        worker_options = {
+            "logging_args": argparse.Namespace(log_level=args.log_level, log_file=args.log_file),
+            "max_queue_byte_size": server_args[0],
+            "slow_consumer_policy": server_args[1],
+            "presence_tick": server_args[2],
+            "memory_budget": memory_budget,
+            "journal": journal,
+            "rooms_directory": args.rooms_dir,
+            "heartbeat": heartbeat,
+        }
+        supervisor = Supervisor(args.workers, worker_options, *server_args)
+        supervisor.set_heartbeat(**heartbeat)
+        set_listening_options(supervisor, args)
+        supervisor.run(args.port)
+        return
+
+    server = ENGINES[args.engine](*server_args)
+    server.set_heartbeat(**heartbeat)
+    set_listening_options(server, args)
+    if memory_budget is not None:
+        server.set_memory_budget(**memory_budget)
+    if journal is not None:
+        server.open_journal(**journal)
+    if args.rooms_dir:
+        server.preload_rooms(args.rooms_dir)
     server.run(args.port)
 
 
+def set_listening_options(server: Server, args: argparse.Namespace):
+    if args.local_socket:
+        server.local_socket_path = common.local_socket_path(args.port)
+        if server.local_socket_path is None:
+            logger.warning("No Unix domain sockets on this platform, --local-socket ignored")
+    server.ready_port = args.ready_port
+
+
 def parse_cli_args():
     parser = argparse.ArgumentParser(description="Start broadcasting server for Mixer")
     add_logging_cli_args(parser)
     parser.add_argument("--port", type=int, default=common.DEFAULT_PORT)
     parser.add_argument("--log-server-updates", action="store_true")
+    parser.add_argument(
+        "--local-socket",
+        action="store_true",
+        help="Also accept connections on a Unix domain socket, that the clients of this host use instead of TCP. "
+        "Unix only.",
+    )
+    parser.add_argument(
+        "--ready-port",
+        type=int,
+        help="Connect to this port of the loopback interface once the server accepts connections, to notify the "
+        "process that started the server.",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES.keys(),
+        default="thread",
+        help="Use one thread per client connection, or a single event loop multiplexing all sockets.",
+    )
+    parser.add_argument(
+        "--max-queue-size",
+        type=int,
+        default=MAX_QUEUE_BYTE_SIZE // (1024 * 1024),
+        help="Maximum size in MiB of the commands waiting to be sent to a client, 0 for no limit.",
+    )
+    parser.add_argument(
+        "--slow-consumer-policy",
+        choices=[policy.value for policy in SlowConsumerPolicy],
+        default=SlowConsumerPolicy.COLLAPSE.value,
+        help="When the queue of a client overflows, remove superseded TRANSFORM and FRAME commands, "
+        "drop room commands and resynchronize the client from a room snapshot later, or disconnect the client. "
+        "A client is disconnected if its queue still overflows.",
+    )
+    parser.add_argument(
+        "--presence-tick",
+        type=float,
+        default=PRESENCE_TICK * 1000,
+        help="Delay in milliseconds between two broadcasts of the client and room attribute updates, "
+        "that are merged in the meantime. 0 to broadcast each update immediately.",
+    )
+    parser.add_argument(
+        "--heartbeat-interval",
+        type=float,
+        default=common.HEARTBEAT_INTERVAL * 1000,
+        help="Delay in milliseconds between two heartbeats sent to the clients that support them.",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=common.IDLE_TIMEOUT * 1000,
+        help="Disconnect a client that supports heartbeats when nothing is received from it during this delay in "
+        "milliseconds, 0 to never disconnect it.",
+    )
+    parser.add_argument(
+        "--journal-dir",
+        help="Journal the rooms in this directory, and recover the rooms journaled there at startup.",
+    )
+    parser.add_argument(
+        "--journal-fsync-interval",
+        type=float,
+        default=FSYNC_INTERVAL * 1000,
+        help="Sync a room journal to disk when its oldest unsynced command is older than this delay in milliseconds.",
+    )
+    parser.add_argument(
+        "--journal-fsync-size",
+        type=int,
+        default=FSYNC_BYTE_SIZE // (1024 * 1024),
+        help="Sync a room journal to disk when its unsynced commands are larger than this size in MiB, 0 for no limit.",
+    )
+    parser.add_argument(
+        "--rooms-dir",
+        help="Open a room for each room file of this directory at startup, named after the file, without reading the "
+        "room commands until a client joins the room. Rooms recovered from the journal take precedence. The room files "
+        "of the save and load room commands are read and written in this directory, these commands are refused "
+        "without it.",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=int,
+        default=0,
+        help="Maximum size in MiB of the room commands held in memory, 0 for no limit. Above it, rooms without clients "
+        "are unloaded to disk, then the commands of the largest rooms are spilled to disk.",
+    )
+    parser.add_argument(
+        "--max-room-memory",
+        type=int,
+        default=0,
+        help="Maximum size in MiB of the commands of a room held in memory, 0 for no limit. Above it, the commands of "
+        "the room are spilled to disk.",
+    )
+    parser.add_argument(
+        "--spill-dir",
+        help="Directory of the files rooms are spilled to, and of the large room snapshots. "
+        "Defaults to the temporary directory, that should not be in memory when memory limits are set.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Number of worker processes the rooms are spread on, 0 to run all rooms in this process. "
+        "With workers, this process accepts the connections and passes each client to the worker of the room it "
+        "joins, the memory budget is shared between the workers, and the engine is the selector engine. Unix only.",
+    )
     return parser.parse_args(), parser
 
 
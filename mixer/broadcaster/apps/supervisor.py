@@ -0,0 +1,483 @@
+"""
+Multi-process server, that broadcasts the rooms on several cores.
+
+A supervisor process accepts the client connections, and passes the socket of a client to a worker process when the
+client joins, saves or loads a room of this worker:
+- each room lives in one worker, chosen with a hash of the room name, so that every process knows where a room lives,
+- the supervisor handles the clients outside of rooms. A client that leaves its room stays in its worker, until it
+  joins a room of another worker,
+- a client socket is passed with the state of its connection and the data received from the client but not processed
+  yet, so that the client does not notice the move,
+- client and room updates, room deletions and client disconnections are sent to the other processes, the supervisor
+  relaying them between the workers. Each process keeps the attributes of the rooms and clients of the other processes
+  to answer LIST_ROOMS and LIST_CLIENTS. Room scoped client attributes are only known by the process of the room,
+- DELETE_ROOM, SET_ROOM_CUSTOM_ATTRIBUTES and SET_ROOM_KEEP_OPEN about a room of another process are forwarded to it.
+
+A worker is connected to the supervisor by a pair of Unix sockets: a stream for the messages, and a datagram socket
+that passes the client sockets, each one before the HAND_OFF message that describes it.
+
+Only available on Unix. All processes run the selector engine.
+"""
+
+from __future__ import annotations
+
+import argparse
+import array
+import logging
+import multiprocessing
+import select
+import socket
+import time
+import zlib
+from typing import Any, Dict, List, Mapping, Optional
+
+from mixer.broadcaster.apps.server import SelectorConnection, SelectorServer
+from mixer.broadcaster.cli_utils import init_logging
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import MessageType
+from mixer.broadcaster.outgoing_queue import MAX_QUEUE_BYTE_SIZE, OutgoingQueue, SlowConsumerPolicy
+from mixer.broadcaster.presence import PRESENCE_TICK, split_client_attributes
+
+logger = logging.getLogger(__name__)
+
+# Messages broadcast to all clients, that are sent to the clients of the other processes too
+SHARED_MESSAGE_TYPES = {
+    MessageType.CLIENT_UPDATE,
+    MessageType.ROOM_UPDATE,
+    MessageType.ROOM_DELETED,
+    MessageType.CLIENT_DISCONNECTED,
+}
+
+# Messages handled by the worker of the room named at their start, when sent by a client outside of a room
+ROOM_NAMED_MESSAGE_TYPES = {MessageType.RESUME_ROOM, MessageType.SAVE_ROOM, MessageType.LOAD_ROOM}
+
+# Delay in seconds for a worker to stop after the supervisor
+WORKER_STOP_TIMEOUT = 5.0
+
+# Delay in seconds for a client to read the commands queued before it is passed to another worker
+HAND_OFF_FLUSH_TIMEOUT = 1.0
+
+
+def room_worker(room_name: str, worker_count: int) -> int:
+    """
+    Return the index of the worker process of a room.
+    """
+    return zlib.crc32(room_name.encode("utf8")) % worker_count
+
+
+def send_socket(channel: socket.socket, sock: socket.socket):
+    channel.sendmsg([b"\0"], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", [sock.fileno()]))])
+
+
+def receive_socket(channel: socket.socket) -> socket.socket:
+    fds = array.array("i")
+    _, ancillary, _, _ = channel.recvmsg(1, socket.CMSG_SPACE(fds.itemsize))
+    for level, kind, data in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[: len(data) - len(data) % fds.itemsize])
+    if len(fds) != 1:
+        raise OSError(f"Expected one socket, received {len(fds)}")
+    return socket.socket(fileno=fds[0])
+
+
+class Peer(SelectorConnection):
+    """
+    Connection with another process of the server: the supervisor in a worker, or a worker in the supervisor.
+    """
+
+    def __init__(self, server: ShardServer, sock: socket.socket, socket_channel: socket.socket, index: Optional[int]):
+        super().__init__(server, sock, ("worker" if index is not None else "supervisor", index))
+        self.outgoing_commands = OutgoingQueue(0)
+        self.socket_channel = socket_channel
+        self.index = index  # worker index, None for the supervisor
+        self._shard_server = server
+
+    def handle_incoming_commands(self, received_commands: List[common.Command]):
+        for command in received_commands:
+            self._shard_server.handle_peer_command(self, command)
+
+    def hand_off(self, sock: socket.socket, command: common.Command):
+        # The socket is received by the peer when it processes the command, sent after it
+        send_socket(self.socket_channel, sock)
+        self.add_command(command, bounded=False)
+
+    def close(self):
+        self.socket.close()
+        self.socket_channel.close()
+
+
+class ShardConnection(SelectorConnection):
+    """
+    Client connection that is passed to the process of the room the client joins.
+    """
+
+    def __init__(self, server: ShardServer, sock: socket.socket, address):
+        super().__init__(server, sock, address)
+        self._shard_server = server
+
+    def on_readable(self):
+        if self._frame_reader.recv(self.socket):
+            self.process_commands(self._frame_reader.commands())
+
+    def receive_data(self, data):
+        """
+        Process data received from the client by another process.
+        """
+        self.process_commands(self._frame_reader.feed(data))
+
+    def process_commands(self, commands: List[common.Command]):
+        for index, command in enumerate(commands):
+            worker = self._shard_server.foreign_worker(self, command)
+            if worker is not None:
+                self._shard_server.hand_off(self, worker, commands[index:])
+                return
+            self.handle_incoming_commands([command])
+
+    def unprocessed_data(self, commands: List[common.Command]) -> bytes:
+        """
+        Return the frames of commands and the data received after them, that are not processed yet.
+        Raise ValueError while a frame is reassembled from fragments.
+        """
+        return b"".join(bytes(command.to_byte_buffer()) for command in commands) + self._frame_reader.pending_data()
+
+    def flush(self):
+        """
+        Send the queued commands, waiting at most HAND_OFF_FLUSH_TIMEOUT for the client to read them.
+        Raise ClientDisconnectedException if they cannot be sent in time.
+        """
+        deadline = time.monotonic() + HAND_OFF_FLUSH_TIMEOUT
+        while True:
+            if not self._write_buffers:
+                self._frame_batch()
+                if not self._write_buffers:
+                    break
+            if common.send_buffers(self.socket, self._write_buffers, self.write_statistics):
+                continue
+            # The whole server waits, a client that does not read is disconnected
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                logger.warning("%s does not read its commands, cannot pass it to another worker", self.unique_id)
+                raise common.ClientDisconnectedException()
+            select.select([], [self.socket], [], timeout)
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "address": list(self.address),
+            "session_token": self.session_token,
+            "capabilities": sorted(self.capabilities),
+            "peer_idle_timeout": self.peer_idle_timeout,
+            "custom_attributes": self.custom_attributes,
+            "subscription": (
+                sorted(message_type.value for message_type in self.subscription)
+                if self.subscription is not None
+                else None
+            ),
+        }
+
+    def restore(self, state: Mapping[str, Any]):
+        self.session_token = state["session_token"]
+        self.capabilities = set(state["capabilities"])
+        self.peer_idle_timeout = state["peer_idle_timeout"]
+        if common.Capabilities.FRAGMENT in self.capabilities:
+            self.outgoing_commands.fragment_size = common.FRAGMENT_SIZE
+        self.custom_attributes = state["custom_attributes"]
+        if state["subscription"] is not None:
+            self.subscription = {common.int_to_message_type(value) for value in state["subscription"]}
+
+
+class ShardServer(SelectorServer):
+    """
+    Process of a multi-process server: the supervisor if index is None, otherwise the worker with this index.
+    """
+
+    def __init__(
+        self,
+        worker_count: int,
+        index: Optional[int] = None,
+        max_queue_byte_size: int = MAX_QUEUE_BYTE_SIZE,
+        slow_consumer_policy: SlowConsumerPolicy = SlowConsumerPolicy.COLLAPSE,
+        presence_tick: float = PRESENCE_TICK,
+    ):
+        super().__init__(max_queue_byte_size, slow_consumer_policy, presence_tick)
+        self.worker_count = worker_count
+        self.index = index
+        self._peers: Dict[Optional[int], Peer] = {}  # by worker index, the supervisor at None
+
+        # Attributes of the rooms and clients of the other processes
+        self._remote_rooms: Dict[str, Dict[str, Any]] = {}
+        self._remote_clients: Dict[str, Dict[str, Any]] = {}
+
+    def add_peer(self, index: Optional[int], sock: socket.socket, socket_channel: socket.socket):
+        peer = Peer(self, sock, socket_channel, index)
+        self._peers[index] = peer
+        peer.start()
+
+    def owns_room(self, room_name: str) -> bool:
+        return self.index is not None and room_worker(room_name, self.worker_count) == self.index
+
+    def _peer(self, worker: int) -> Peer:
+        # Workers only know the supervisor, that relays to the other workers
+        return self._peers[worker] if self.index is None else self._peers[None]
+
+    def make_connection(self, sock: socket.socket, address) -> ShardConnection:
+        return ShardConnection(self, sock, address)
+
+    def foreign_worker(self, connection: ShardConnection, command: common.Command) -> Optional[int]:
+        """
+        Return the worker of the room joined, saved or loaded by command, if the room lives in another process.
+        """
+        if connection.room is not None:
+            return None
+        if command.type == MessageType.JOIN_ROOM:
+            room_name = str(command.data, "utf-8")
+        elif command.type in ROOM_NAMED_MESSAGE_TYPES:
+            room_name, _ = common.decode_string(command.data, 0)
+        else:
+            return None
+        if self.owns_room(room_name):
+            return None
+        return room_worker(room_name, self.worker_count)
+
+    def hand_off(self, connection: ShardConnection, worker: int, commands: List[common.Command]):
+        """
+        Pass a client connection to another process, with the commands received and not processed yet.
+        """
+        try:
+            data = connection.unprocessed_data(commands)
+            connection.flush()
+        except (ValueError, common.ClientDisconnectedException) as e:
+            logger.warning("Cannot pass %s to worker %d: %s", connection.unique_id, worker, e)
+            self.handle_client_disconnect(connection)
+            return
+
+        self.selector.unregister(connection.socket)
+        connection.closed = True
+        with self._mutex:
+            del self._connections[connection.unique_id]
+            self._remote_clients[connection.unique_id], _ = split_client_attributes(connection.client_attributes())
+        self._presence.discard_client(connection.unique_id)
+
+        state = {**connection.state(), "worker": worker}
+        command = common.Command(MessageType.HAND_OFF, common.encode_json(state) + data)
+        self._peer(worker).hand_off(connection.socket, command)
+        connection.socket.close()
+        logger.info("%s passed to worker %d", connection.unique_id, worker)
+
+    def _receive_hand_off(self, peer: Peer, command: common.Command):
+        sock = receive_socket(peer.socket_channel)
+        state, offset = common.decode_json(command.data, 0)
+        if state["worker"] != self.index:
+            self._peer(state["worker"]).hand_off(sock, command)
+            sock.close()
+            return
+
+        connection = ShardConnection(self, sock, tuple(state["address"]))
+        connection.restore(state)
+        with self._mutex:
+            self._connections[connection.unique_id] = connection
+            self._remote_clients.pop(connection.unique_id, None)
+        connection.start()
+        logger.info("%s received by worker %d", connection.unique_id, self.index)
+        self.broadcast_client_update(connection, connection.client_attributes())
+        connection.receive_data(command.data[offset:])
+
+    def handle_peer_command(self, peer: Peer, command: common.Command):
+        if command.type == MessageType.HAND_OFF:
+            self._receive_hand_off(peer, command)
+        elif command.type in SHARED_MESSAGE_TYPES:
+            self._update_remote_attributes(command)
+            super().broadcast_to_all_clients(command)
+            for other in self._peers.values():
+                if other is not peer:
+                    other.add_command(command, bounded=False)
+        elif command.type == MessageType.DELETE_ROOM:
+            self.delete_room(str(command.data, "utf-8"))
+        elif command.type == MessageType.SET_ROOM_CUSTOM_ATTRIBUTES:
+            room_name, offset = common.decode_string(command.data, 0)
+            custom_attributes, _ = common.decode_json(command.data, offset)
+            self.set_room_custom_attributes(room_name, custom_attributes)
+        elif command.type == MessageType.SET_ROOM_KEEP_OPEN:
+            room_name, offset = common.decode_string(command.data, 0)
+            value, _ = common.decode_bool(command.data, offset)
+            self.set_room_keep_open(room_name, value)
+        else:
+            logger.error("Command %s received from %s but no handler for it", command.type, peer.unique_id)
+
+    def _update_remote_attributes(self, command: common.Command):
+        with self._mutex:
+            if command.type == MessageType.CLIENT_UPDATE:
+                for client_id, attributes in common.decode_json(command.data, 0)[0].items():
+                    if client_id not in self._connections:
+                        self._remote_clients.setdefault(client_id, {}).update(attributes)
+            elif command.type == MessageType.ROOM_UPDATE:
+                for room_name, attributes in common.decode_json(command.data, 0)[0].items():
+                    if room_name not in self._rooms:
+                        self._remote_rooms.setdefault(room_name, {}).update(attributes)
+            elif command.type == MessageType.ROOM_DELETED:
+                self._remote_rooms.pop(common.decode_string(command.data, 0)[0], None)
+            elif command.type == MessageType.CLIENT_DISCONNECTED:
+                self._remote_clients.pop(common.decode_string(command.data, 0)[0], None)
+
+    def broadcast_to_all_clients(self, command: common.Command):
+        super().broadcast_to_all_clients(command)
+        if command.type in SHARED_MESSAGE_TYPES:
+            for peer in self._peers.values():
+                peer.add_command(command, bounded=False)
+
+    def delete_room(self, room_name: str):
+        if self.owns_room(room_name):
+            super().delete_room(room_name)
+            return
+        command = common.Command(MessageType.DELETE_ROOM, room_name.encode("utf8"))
+        self._peer(room_worker(room_name, self.worker_count)).add_command(command, bounded=False)
+
+    def set_room_custom_attributes(self, room_name: str, custom_attributes: Mapping[str, Any]):
+        if self.owns_room(room_name):
+            super().set_room_custom_attributes(room_name, custom_attributes)
+            return
+        command = common.make_set_room_attributes_command(room_name, custom_attributes)
+        self._peer(room_worker(room_name, self.worker_count)).add_command(command, bounded=False)
+
+    def set_room_keep_open(self, room_name: str, value: bool):
+        if self.owns_room(room_name):
+            super().set_room_keep_open(room_name, value)
+            return
+        command = common.Command(
+            MessageType.SET_ROOM_KEEP_OPEN, common.encode_string(room_name) + common.encode_bool(value)
+        )
+        self._peer(room_worker(room_name, self.worker_count)).add_command(command, bounded=False)
+
+    def save_room(self, room_name: str, file_name: str):
+        self._check_owned(room_name)
+        super().save_room(room_name, file_name)
+
+    def load_room(self, room_name: str, file_name: str):
+        self._check_owned(room_name)
+        super().load_room(room_name, file_name)
+
+    def _check_owned(self, room_name: str):
+        # Clients outside of rooms are passed to the worker of the room, see foreign_worker()
+        if not self.owns_room(room_name):
+            raise ValueError(f"Room {room_name} lives in another worker process, leave the current room first")
+
+    def get_list_rooms_command(self) -> common.Command:
+        with self._mutex:
+            rooms = {name: attributes for name, attributes in self._remote_rooms.items()}
+            rooms.update({name: room.attributes_dict() for name, room in self._rooms.items()})
+            return common.Command(MessageType.LIST_ROOMS, common.encode_json(rooms))
+
+    def get_list_clients_command(self) -> common.Command:
+        with self._mutex:
+            clients = {client_id: attributes for client_id, attributes in self._remote_clients.items()}
+            clients.update({client_id: c.client_attributes() for client_id, c in self._connections.items()})
+            return common.Command(MessageType.LIST_CLIENTS, common.encode_json(clients))
+
+    def handle_client_disconnect(self, connection):
+        if not isinstance(connection, Peer):
+            super().handle_client_disconnect(connection)
+            return
+        if connection.closed:
+            return
+        connection.closed = True
+        self.selector.unregister(connection.socket)
+        connection.close()
+        if connection.index is None:
+            logger.info("Supervisor disconnected, stopping worker %d", self.index)
+        else:
+            logger.error("Worker %d disconnected, stopping the server", connection.index)
+        self.shutdown()
+
+
+class Supervisor(ShardServer):
+    """
+    Process that accepts the client connections, and starts the worker processes.
+    """
+
+    def __init__(
+        self,
+        worker_count: int,
+        worker_options: Optional[Dict[str, Any]] = None,
+        max_queue_byte_size: int = MAX_QUEUE_BYTE_SIZE,
+        slow_consumer_policy: SlowConsumerPolicy = SlowConsumerPolicy.COLLAPSE,
+        presence_tick: float = PRESENCE_TICK,
+    ):
+        """
+        worker_options are the keyword arguments of run_worker.
+        """
+        super().__init__(worker_count, None, max_queue_byte_size, slow_consumer_policy, presence_tick)
+        self._worker_options = worker_options or {}
+        self._workers: List[multiprocessing.Process] = []
+
+    def run(self, port):
+        # Spawn rather than fork, since the supervisor may run threads
+        context = multiprocessing.get_context("spawn")
+        for index in range(self.worker_count):
+            sock, worker_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+            socket_channel, worker_socket_channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+            process = context.Process(
+                target=run_worker,
+                args=(index, self.worker_count, worker_sock, worker_socket_channel),
+                kwargs=self._worker_options,
+                name=f"mixer_worker_{index}",
+                daemon=True,
+            )
+            process.start()
+            worker_sock.close()
+            worker_socket_channel.close()
+            self.add_peer(index, sock, socket_channel)
+            self._workers.append(process)
+        logger.info("Started %d worker processes", self.worker_count)
+
+        try:
+            super().run(port)
+        finally:
+            # Workers stop when the supervisor disconnects
+            for peer in self._peers.values():
+                if not peer.closed:
+                    peer.close()
+            for process in self._workers:
+                process.join(WORKER_STOP_TIMEOUT)
+                if process.is_alive():
+                    logger.warning("Terminating %s", process.name)
+                    process.terminate()
+
+
+def run_worker(
+    index: int,
+    worker_count: int,
+    sock: socket.socket,
+    socket_channel: socket.socket,
+    logging_args: Optional[argparse.Namespace] = None,
+    max_queue_byte_size: int = MAX_QUEUE_BYTE_SIZE,
+    slow_consumer_policy: SlowConsumerPolicy = SlowConsumerPolicy.COLLAPSE,
+    presence_tick: float = PRESENCE_TICK,
+    memory_budget: Optional[Dict[str, Any]] = None,
+    journal: Optional[Dict[str, Any]] = None,
+    rooms_directory: Optional[str] = None,
+    heartbeat: Optional[Dict[str, Any]] = None,
+):
+    """
+    Run a worker process, with memory_budget, journal and heartbeat the arguments of set_memory_budget(),
+    open_journal() and set_heartbeat(), and rooms_directory the one of preload_rooms().
+    """
+    if logging_args is not None:
+        if logging_args.log_file:
+            # Each process rotates its own log file
+            logging_args = argparse.Namespace(**vars(logging_args))
+            logging_args.log_file = f"{logging_args.log_file}.worker{index}"
+        init_logging(logging_args)
+    server = ShardServer(worker_count, index, max_queue_byte_size, slow_consumer_policy, presence_tick)
+    server.add_peer(None, sock, socket_channel)
+    if heartbeat is not None:
+        server.set_heartbeat(**heartbeat)
+    if memory_budget is not None:
+        server.set_memory_budget(**memory_budget)
+    if journal is not None:
+        server.open_journal(**journal)
+    if rooms_directory is not None:
+        server.preload_rooms(rooms_directory)
+    # Make the recovered and preloaded rooms known to the other processes
+    for room in list(server._rooms.values()):
+        server.broadcast_room_update(room, room.attributes_dict())
+    logger.info("Worker %d started", index)
+    server.serve()
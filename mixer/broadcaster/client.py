@@ -1,14 +1,20 @@
+import os
 import socket
 import logging
 import time
-from typing import Dict, Any, Mapping, Optional, List, Callable
+from typing import Dict, Any, Iterable, Mapping, Optional, List, Callable, Set
 
 import mixer.broadcaster.common as common
 from mixer.broadcaster.common import MessageType
 from mixer.broadcaster.common import update_attributes_and_get_diff, update_named_attributes
+from mixer.broadcaster.outgoing_queue import INTERACTIVE_MESSAGE_TYPES, OutgoingQueue
 
 logger = logging.getLogger() if __name__ == "__main__" else logging.getLogger(__name__)
 
+# Delay in seconds a subscribed client waits for the server capabilities before joining a room. Servers without
+# capabilities never send them
+CAPABILITIES_TIMEOUT = 5.0
+
 
 class Client:
     """
@@ -19,17 +25,44 @@ class Client:
     - maintain an updated view of clients and room states from server's inputs
     """
 
-    def __init__(self, host=common.DEFAULT_HOST, port=common.DEFAULT_PORT):
+    def __init__(
+        self,
+        host=common.DEFAULT_HOST,
+        port=common.DEFAULT_PORT,
+        heartbeat_interval: float = common.HEARTBEAT_INTERVAL,
+        idle_timeout: float = common.IDLE_TIMEOUT,
+    ):
+        """
+        With the heartbeat capability, a HEARTBEAT is sent at least every heartbeat_interval seconds by
+        fetch_outgoing_commands(), and the connection is closed when nothing is received from the server during
+        idle_timeout seconds, 0 to never close it.
+        """
         self.host = host
         self.port = port
-        self.pending_commands: List[common.Command] = []
+        # Unix domain socket tried before TCP, that a server of this host listens on if started with --local-socket
+        self.local_socket_path = common.local_socket_path(port) if common.is_local_host(host) else None
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self._outgoing_commands = OutgoingQueue(0)  # Pending commands, sent by fetch_outgoing_commands()
         self.socket = None
+        self._frame_reader = common.FrameReader()
+        self.write_statistics = common.WriteStatistics()
 
         self.client_id: Optional[str] = None  # Will be filled with a unique string identifying this client
         self.current_custom_attributes: Dict[str, Any] = {}
         self.clients_attributes: Dict[str, Dict[str, Any]] = {}
         self.rooms_attributes: Dict[str, Dict[str, Any]] = {}
         self.current_room: Optional[str] = None
+        self.capabilities: Set[str] = set()  # protocol extensions supported by this client and the server
+        self._awaiting_capabilities = False  # until the server capabilities are received, or not expected anymore
+        self._received_commands: List[common.Command] = []  # received while waiting, not returned yet
+        self.session_token: Optional[str] = None  # sent by the server if it supports the resume capability
+        self._resume_token: Optional[str] = None  # token of the session of the previous connection
+        # Sequence of the last room command received, interactive commands excepted since they may overtake others
+        self.room_sequence = 0
+        self.subscription: Optional[List[common.MessageTypes]] = None  # room message types to receive, or all
+        self._server_idle_timeout = 0.0  # received in the HEARTBEAT messages of the server
+        self._heartbeat_time = 0.0  # when the last HEARTBEAT was sent
 
     def __del__(self):
         if self.socket is not None:
@@ -48,12 +81,30 @@ class Client:
             raise RuntimeError("Client.connect : already connected")
 
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.host, self.port))
+            self.socket = self._connect_local()
+            if self.socket is None:
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.socket.connect((self.host, self.port))
+            common.enable_keepalive(self.socket)
+            self._frame_reader = common.FrameReader()
+            self.capabilities = set()
+            self._server_idle_timeout = 0.0
+            self._heartbeat_time = 0.0
+            self._awaiting_capabilities = True
+            self._received_commands = []
+            self._outgoing_commands.fragment_size = 0
+            self._resume_token, self.session_token = self.session_token, None
             local_address = self.socket.getsockname()
+            if isinstance(local_address, str):
+                local_address = ("unix", self.local_socket_path)
             logger.info(
                 "Connecting from local %s:%s to %s:%s", local_address[0], local_address[1], self.host, self.port,
             )
+            self.send_command(
+                common.Command(
+                    common.MessageType.CAPABILITIES, common.encode_json(sorted(common.SUPPORTED_CAPABILITIES))
+                )
+            )
             self.send_command(common.Command(common.MessageType.CLIENT_ID))
             self.send_command(common.Command(common.MessageType.LIST_CLIENTS))
             self.send_command(common.Command(common.MessageType.LIST_ROOMS))
@@ -66,9 +117,30 @@ class Client:
             self.socket = None
             raise
 
+    def _connect_local(self) -> Optional[socket.socket]:
+        """
+        Return a socket connected to the Unix domain socket of the server, None if the server does not listen on one.
+        """
+        path = self.local_socket_path
+        if path is None or not os.path.exists(path) or not common.is_private_directory(os.path.dirname(path)):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except OSError as e:
+            logger.info("Cannot connect to %s, using TCP: %s", path, e)
+            sock.close()
+            return None
+        return sock
+
     def disconnect(self):
         if self.socket:
-            self.socket.shutdown(socket.SHUT_RDWR)
+            logger.info("Write statistics: %s", self.write_statistics)
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                # Already closed by the server
+                pass
             self.socket.close()
             self.socket = None
 
@@ -76,7 +148,13 @@ class Client:
         return self.socket is not None
 
     def add_command(self, command: common.Command):
-        self.pending_commands.append(command)
+        """
+        Queue command, to be sent by fetch_outgoing_commands(). Its payload is compressed if the server supports it and
+        the compression policy of its message type applies.
+        """
+        if common.Capabilities.COMPRESS in self.capabilities:
+            command = common.compress_command(command)
+        self._outgoing_commands.put(command)
 
     def handle_connection_lost(self):
         logger.info("Connection lost for %s:%s", self.host, self.port)
@@ -101,17 +179,75 @@ class Client:
 
     def send_command(self, command: common.Command):
         try:
-            common.write_message(self.socket, command)
+            common.write_message(self.socket, command, self.write_statistics)
             return True
         except common.ClientDisconnectedException:
             self.handle_connection_lost()
             return False
 
     def join_room(self, room_name: str):
+        self._wait_capabilities()
+        self.room_sequence = 0
         return self.send_command(common.Command(common.MessageType.JOIN_ROOM, room_name.encode("utf8"), 0))
 
+    def resume_room(self, room_name: str):
+        """
+        Join again the room joined before the connection was lost, receiving only the room commands missed since.
+        The server sends the whole room content instead if the session cannot be resumed.
+        """
+        self._wait_capabilities()
+        if self._resume_token is None or common.Capabilities.RESUME not in self.capabilities:
+            return self.join_room(room_name)
+
+        return self.send_command(
+            common.Command(
+                common.MessageType.RESUME_ROOM,
+                common.encode_string(room_name)
+                + common.encode_string(self._resume_token)
+                + common.encode_int(self.room_sequence),
+            )
+        )
+
+    def subscribe(self, message_types: Optional[Iterable[common.MessageTypes]] = None):
+        """
+        Receive only the room messages of message_types, message types or inclusive ranges of message types, from now
+        on. None to receive all room messages.
+
+        The subscription is sent again after a reconnection, and ignored by servers that do not support it.
+        """
+        self.subscription = list(message_types) if message_types is not None else None
+        if common.Capabilities.SUBSCRIBE in self.capabilities:
+            return self._send_subscription()
+        return True
+
+    def _wait_capabilities(self):
+        """
+        Receive commands until the server capabilities are known if a subscription is set, so that the subscription
+        applies to the content of a room joined right after connecting. The commands received meanwhile are returned by
+        the next fetch_incoming_commands().
+        """
+        if self.subscription is None:
+            return
+        deadline = time.monotonic() + CAPABILITIES_TIMEOUT
+        while self._awaiting_capabilities and self.is_connected():
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                logger.warning("No capabilities received from %s:%s, subscription not sent", self.host, self.port)
+                self._awaiting_capabilities = False
+                break
+            try:
+                self._received_commands.extend(self._receive_commands(timeout))
+            except common.ClientDisconnectedException:
+                break
+
+    def _send_subscription(self):
+        return self.send_command(
+            common.Command(common.MessageType.SUBSCRIBE, common.encode_subscription(self.subscription))
+        )
+
     def leave_room(self, room_name: str):
         self.current_room = None
+        self.room_sequence = 0
         return self.send_command(common.Command(common.MessageType.LEAVE_ROOM, room_name.encode("utf8"), 0))
 
     def delete_room(self, room_name: str):
@@ -148,7 +284,46 @@ class Client:
         update_named_attributes(self.rooms_attributes, rooms_attributes)
 
     def _handle_client_id(self, command: common.Command):
-        self.client_id = command.data.decode()
+        self.client_id = str(command.data, "utf-8")
+
+    def _handle_capabilities(self, command: common.Command):
+        capabilities, _ = common.decode_json(command.data, 0)
+        self.capabilities = common.SUPPORTED_CAPABILITIES.intersection(capabilities)
+        self._awaiting_capabilities = False
+        if common.Capabilities.FRAGMENT in self.capabilities:
+            self._outgoing_commands.fragment_size = common.FRAGMENT_SIZE
+        if common.Capabilities.SUBSCRIBE in self.capabilities and self.subscription is not None:
+            self._send_subscription()
+
+    def _handle_heartbeat(self, command: common.Command):
+        self._server_idle_timeout, _ = common.decode_float(command.data, 0)
+
+    def _send_heartbeat(self):
+        """
+        Send a HEARTBEAT if none was sent for the heartbeat interval, so that the server keeps the connection.
+        """
+        if common.Capabilities.HEARTBEAT not in self.capabilities:
+            return
+        now = time.monotonic()
+        if now - self._heartbeat_time < common.heartbeat_interval(self.heartbeat_interval, self._server_idle_timeout):
+            return
+        self._heartbeat_time = now
+        self.send_command(common.make_heartbeat_command(self.idle_timeout))
+
+    def _check_idle(self):
+        """
+        Close the connection if the server, that sends heartbeats, sent nothing for the idle timeout.
+        """
+        if common.Capabilities.HEARTBEAT not in self.capabilities or self.idle_timeout <= 0:
+            return
+        idle_time = time.monotonic() - self._frame_reader.receive_time
+        if idle_time > self.idle_timeout:
+            logger.warning("Nothing received from %s:%s for %.0f s, disconnecting", self.host, self.port, idle_time)
+            self.disconnect()
+            raise common.ClientDisconnectedException()
+
+    def _handle_session(self, command: common.Command):
+        self.session_token, _ = common.decode_string(command.data, 0)
 
     def _handle_room_update(self, command: common.Command):
         rooms_attributes_update, _ = common.decode_json(command.data, 0)
@@ -189,6 +364,9 @@ class Client:
         MessageType.CLIENT_UPDATE: _handle_client_update,
         MessageType.CLIENT_DISCONNECTED: _handle_client_disconnected,
         MessageType.JOIN_ROOM: _handle_join_room,
+        MessageType.CAPABILITIES: _handle_capabilities,
+        MessageType.SESSION: _handle_session,
+        MessageType.HEARTBEAT: _handle_heartbeat,
     }
 
     def has_default_handler(self, message_type: MessageType):
@@ -198,13 +376,30 @@ class Client:
         """
         Gather incoming commands from the socket and return them as a list.
         Process those that have a default handler with the one registered.
+        Compressed payloads are inflated here, just before the commands are decoded.
         """
+        received_commands, self._received_commands = self._received_commands, []
+        received_commands.extend(self._receive_commands())
+        return self._decompress_commands(received_commands)
+
+    def _decompress_commands(self, commands: List[common.Command]) -> List[common.Command]:
+        result = []
+        for command in commands:
+            try:
+                result.append(common.decompress_command(command))
+            except ValueError as e:
+                logger.error("%s dropped: %s", command.type, e)
+        return result
+
+    def _receive_commands(self, timeout: Optional[float] = None) -> List[common.Command]:
         try:
-            received_commands = common.read_all_messages(self.socket)
+            received_commands = self._frame_reader.read_all(self.socket, timeout)
+            self._check_idle()
         except common.ClientDisconnectedException:
             self.handle_connection_lost()
             raise
 
+        received_commands = common.unbatch_commands(received_commands)
         count = len(received_commands)
         if count > 0:
             logger.debug("Received %d commands", len(received_commands))
@@ -212,23 +407,46 @@ class Client:
             logger.debug("Received %s", command.type)
             if command.type in self._default_command_handlers:
                 self._default_command_handlers[command.type](self, command)
+            elif command.type == MessageType.CLEAR_CONTENT:
+                self.room_sequence = 0
+            elif command.type > MessageType.COMMAND and command.type not in INTERACTIVE_MESSAGE_TYPES:
+                # The id of room commands is their sequence number in the room
+                self.room_sequence = max(self.room_sequence, command.id)
 
         return received_commands
 
     def fetch_outgoing_commands(self, commands_send_interval=0):
         """
-        Send commands in pending_commands queue to the server.
+        Send the commands added with add_command() to the server, interactive commands first.
+
+        Commands are coalesced in scatter-gather writes, unless commands_send_interval requires a delay between them.
+        With the batch capability, consecutive small room commands of a write are sent in BATCH messages.
         """
-        for idx, command in enumerate(self.pending_commands):
-            logger.debug("Send %s (%d / %d)", command.type, idx + 1, len(self.pending_commands))
+        if commands_send_interval > 0:
+            while len(self._outgoing_commands) > 0:
+                command = self._outgoing_commands.get_batch(1)[0]
+                logger.debug("Send %s (%d left)", command.type, len(self._outgoing_commands))
 
-            if not self.send_command(command):
-                break
+                if not self.send_command(command):
+                    break
 
-            if commands_send_interval > 0:
                 time.sleep(commands_send_interval)
-
-        self.pending_commands = []
+        else:
+            while len(self._outgoing_commands) > 0:
+                commands = self._outgoing_commands.get_batch(common.WRITE_BATCH_SIZE)
+                if common.Capabilities.BATCH in self.capabilities:
+                    commands = common.batch_commands(commands)
+                logger.debug("Send %d commands", len(commands))
+                try:
+                    common.write_messages(self.socket, commands, self.write_statistics)
+                except common.ClientDisconnectedException:
+                    self.handle_connection_lost()
+                    break
+
+        # Commands are dropped if the connection is lost
+        self._outgoing_commands.clear()
+        if self.is_connected():
+            self._send_heartbeat()
 
     def fetch_commands(self, commands_send_interval=0) -> List[common.Command]:
         self.fetch_outgoing_commands(commands_send_interval)
@@ -2,18 +2,77 @@
 This module defines types and utilities used by client and server code.
 """
 
-from enum import IntEnum
-from typing import Dict, Mapping, Any, Optional, List
+from enum import Enum, IntEnum
+from typing import Deque, Dict, Iterable, Mapping, Any, Optional, List, Set, Tuple, Union
+import array
+import collections
+import itertools
 import select
 import socket
 import struct
 import json
 import logging
-
+import lzma
+import os
+import tempfile
+import time
+import zlib
 
 DEFAULT_HOST = "localhost"
 DEFAULT_PORT = 12800
 
+# Host names of this host, that clients reach through the Unix domain socket of the server when it has one
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+# Frame header: payload size (int64), command id (int32), message type (int16)
+FRAME_HEADER_SIZE = 14
+_frame_header = struct.Struct("<QIH")
+
+# Bits of the message type field of a frame header that flag a compressed payload, with the Compression value
+COMPRESSION_MASK = 0xC000
+
+# Uncompressed size (uint64) stored before the compressed data in a compressed payload
+_uncompressed_size = struct.Struct("<Q")
+
+# Room messages up to this byte size are sent in BATCH messages of at most BATCH_SIZE bytes, to peers that support them
+BATCHED_MESSAGE_SIZE = 4 * 1024
+BATCH_SIZE = 64 * 1024
+
+# Default size of the buffers data is received in
+READ_BUFFER_SIZE = 256 * 1024
+
+# Maximum byte size of the commands coalesced in a single write
+WRITE_BATCH_SIZE = 1024 * 1024
+
+# Maximum number of buffers in a single scatter-gather write, below IOV_MAX on all platforms
+MAX_SEND_BUFFER_COUNT = 512
+
+# Size of the fragments large messages are split in, for peers that support fragments
+FRAGMENT_SIZE = 256 * 1024
+
+# Maximum byte size sent by a single sendfile syscall
+SENDFILE_SIZE = 16 * 1024 * 1024
+
+# Delay in seconds between two HEARTBEAT messages sent to a peer
+HEARTBEAT_INTERVAL = 5.0
+
+# A peer that sends HEARTBEAT messages is disconnected when nothing is received from it during this delay, in seconds
+IDLE_TIMEOUT = 60.0
+
+# TCP keepalive: delay in seconds before probing a silent peer, delay between probes, and probes before giving up
+KEEPALIVE_IDLE = 10
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_COUNT = 3
+
+# Delay in seconds for the data sent to a TCP peer to be acknowledged before the connection is dropped, on Linux
+TCP_USER_TIMEOUT = 30.0
+
+# Windows sockets have no sendmsg(), buffers are joined before sending instead
+_has_sendmsg = hasattr(socket.socket, "sendmsg")
+
+# Without sendfile(), file ranges are sent from their memory map
+_has_sendfile = hasattr(os, "sendfile")
+
 logger = logging.getLogger(__name__)
 
 
@@ -52,6 +111,17 @@ class MessageType(IntEnum):
 
     CLIENT_DISCONNECTED = 22  # Server: Notify a client has diconnected
 
+    CAPABILITIES = 23  # Client: announce supported protocol extensions; Server: reply with those it supports too
+    FRAGMENT = 24  # Part of the frame of a large message, sent in several fragments interleaved with other messages
+    SESSION = 25  # Server: send the token of the client session, to resume it after a reconnection
+    RESUME_ROOM = 26  # Client: join a room again, with the session token and the last room sequence number received
+    SUBSCRIBE = 27  # Client: set the room message types that the server sends to it
+    HAND_OFF = 28  # Server: internal, pass a client connection to another server process
+    SAVE_ROOM = 29  # Client: ask the server to save a room to a file of the server host; Server: notify it saved
+    LOAD_ROOM = 30  # Client: ask the server to create a room from a file of the server host; Server: notify it loaded
+    HEARTBEAT = 31  # Client and Server: sent periodically, so that the peer detects a dead connection
+    BATCH = 32  # Frames of several room messages, sent and broadcast as a single message
+
     COMMAND = 100
     DELETE = 101
     CAMERA = 102
@@ -153,6 +223,9 @@ class ClientAttributes:
     IP = "ip"  # Sent by server only, type = str
     PORT = "port"  # Sent by server only, type = int
     ROOM = "room"  # Sent by server only, type = str
+    QUEUE_HIGH_WATER_MARK = (
+        "queue_high_water_mark"  # Sent by server only, type = int, largest byte size of commands queued for the client
+    )
 
     # Client to server attributes, not used by the server but clients are encouraged to use these keys for the same semantic
     USERNAME = "user_name"  # type = str
@@ -187,6 +260,58 @@ class RoomAttributes:
     COMMAND_COUNT = "command_count"  # Sent by server only, type = bool, indicate how many commands the room contains
     BYTE_SIZE = "byte_size"  # Sent by server only, type = int, indicate the size in byte of the room
     JOINABLE = "joinable"  # Sent by server only, type = bool, indicate if the room is joinable
+    SNAPSHOT_BYTE_SIZE = "snapshot_byte_size"  # Sent by server only, type = int, size in byte of the room snapshot
+    SNAPSHOT_AGE = "snapshot_age"  # Sent by server only, type = float, age in seconds of the room snapshot when sent
+    JOIN_BYTE_SIZE = "join_byte_size"  # Sent by server only, type = int, size in byte of the snapshot and tail sent to a joining client
+
+
+class Capabilities:
+    """
+    Protocol extensions that a client and the server use only when both support them, exchanged with CAPABILITIES.
+
+    Documentation to update if you change this: doc/protocol.md
+    """
+
+    FRAGMENT = "fragment"  # Large messages can be sent as FRAGMENT messages
+    RESUME = "resume"  # The server sends a SESSION token, and a reconnecting client can send RESUME_ROOM
+    SUBSCRIBE = "subscribe"  # A client can send SUBSCRIBE
+    HEARTBEAT = "heartbeat"  # The client and the server send HEARTBEAT, and disconnect a peer that stays silent
+    COMPRESS = "compress"  # Room messages can have a compressed payload
+    BATCH = "batch"  # Room messages can be sent in BATCH messages
+
+
+# Capabilities implemented by this module, announced by clients and by the server
+SUPPORTED_CAPABILITIES = {
+    Capabilities.FRAGMENT,
+    Capabilities.RESUME,
+    Capabilities.SUBSCRIBE,
+    Capabilities.HEARTBEAT,
+    Capabilities.COMPRESS,
+    Capabilities.BATCH,
+}
+
+
+class Compression(IntEnum):
+    """
+    Compression of the payload of a frame, flagged in the message type field of its header.
+
+    Documentation to update if you change this: doc/protocol.md
+    """
+
+    NONE = 0
+    ZLIB = 0x4000
+    LZMA = 0x8000
+
+
+# Room message types whose payload is compressed when sent to a peer with the compress capability: minimum payload
+# size in bytes, compression, and compression level (zlib level or lzma preset)
+COMPRESSION_POLICIES: Dict[MessageType, Tuple[int, Compression, int]] = {
+    MessageType.MESH: (4096, Compression.ZLIB, 1),
+    MessageType.GREASE_PENCIL_MESH: (4096, Compression.ZLIB, 1),
+    MessageType.CAMERA_ANIMATION: (4096, Compression.ZLIB, 1),
+    MessageType.BLENDER_DATA_UPDATE: (1024, Compression.ZLIB, 1),
+    MessageType.SHOT_MANAGER_CONTENT: (1024, Compression.ZLIB, 6),
+}
 
 
 class ClientDisconnectedException(Exception):
@@ -229,7 +354,7 @@ def decode_string(data, index):
     string_length = bytes_to_int(data[index : index + 4])
     start = index + 4
     end = start + string_length
-    value = data[start:end].decode()
+    value = str(data[start:end], "utf-8")
     return value, end
 
 
@@ -242,6 +367,31 @@ def decode_json(data, index):
     return json.loads(value), end
 
 
+# A message type, or an inclusive range of message types
+MessageTypes = Union[MessageType, Tuple[MessageType, MessageType]]
+
+
+def encode_subscription(message_types: Optional[Iterable[MessageTypes]]):
+    """
+    Encode the room message types of a subscription, None to subscribe to all room messages.
+    """
+    if message_types is None:
+        return encode_json(None)
+    return encode_json([item if isinstance(item, int) else list(item) for item in message_types])
+
+
+def decode_subscription(data, index) -> Tuple[Optional[Set[MessageType]], int]:
+    value, end = decode_json(data, index)
+    if value is None:
+        return None, end
+
+    message_types = set()
+    for item in value:
+        first, last = (item, item) if isinstance(item, int) else item
+        message_types.update(t for t in MessageType if first <= t <= last)
+    return message_types, end
+
+
 def encode_float(value):
     return struct.pack("f", value)
 
@@ -319,10 +469,9 @@ def decode_quaternion(data, index):
 
 
 def encode_string_array(values):
-    buffer = encode_int(len(values))
-    for item in values:
-        buffer += encode_string(item)
-    return buffer
+    writer = BufferWriter()
+    writer.write_string_array(values)
+    return bytes(writer.getbuffer())
 
 
 def decode_string_array(data, index):
@@ -378,28 +527,743 @@ def decode_vector2_array(data, index):
     return decode_array(data, index, "2f", 2 * 4)
 
 
+# Bulk array codecs, that encode or decode a whole array in a single call instead of one struct call per element.
+# Decoded arrays are flat memoryview objects on the message data, with one value per element of the array.typecode,
+# so that a large mesh is neither unpacked to tuples nor copied. Values are in native byte order, like with struct.
+
+
+def pack_array(values, typecode: str) -> bytes:
+    """
+    Pack a sequence of numbers, or an array.array or memoryview of the typecode.
+    """
+    if isinstance(values, memoryview) and values.format == typecode:
+        return values.tobytes()
+    if not isinstance(values, array.array) or values.typecode != typecode:
+        values = array.array(typecode, values)
+    return values.tobytes()
+
+
+def unpack_array(data, index, typecode: str, length: int) -> Tuple[memoryview, int]:
+    """
+    Return a memoryview of the length values of the typecode packed at index, and the index after them.
+    """
+    end = index + length * struct.calcsize(typecode)
+    if end > len(data):
+        raise ValueError(f"Array of {length} '{typecode}' values overflows data of size {len(data)} at {index}")
+    return memoryview(data)[index:end].cast(typecode), end
+
+
+def encode_typed_array(values, typecode: str, item_length: int = 1) -> bytes:
+    """
+    Encode a flat sequence of numbers as an array of items of item_length values each, like 3 floats per vertex.
+    """
+    return int_to_bytes(len(values) // item_length, 4) + pack_array(values, typecode)
+
+
+def decode_typed_array(data, index, typecode: str, item_length: int = 1) -> Tuple[memoryview, int]:
+    """
+    Decode an array encoded by encode_typed_array() to a flat memoryview. The values of item i are
+    view[i * item_length : (i + 1) * item_length].
+    """
+    count = bytes_to_int(data[index : index + 4])
+    return unpack_array(data, index + 4, typecode, count * item_length)
+
+
+def encode_floats(values, item_length: int = 1) -> bytes:
+    return encode_typed_array(values, "f", item_length)
+
+
+def decode_floats(data, index, item_length: int = 1) -> Tuple[memoryview, int]:
+    return decode_typed_array(data, index, "f", item_length)
+
+
+def encode_uints(values, item_length: int = 1) -> bytes:
+    return encode_typed_array(values, "I", item_length)
+
+
+def decode_uints(data, index, item_length: int = 1) -> Tuple[memoryview, int]:
+    return decode_typed_array(data, index, "I", item_length)
+
+
+def group_items(values, item_length: int) -> List[Tuple]:
+    """
+    Group flat values by items of item_length values, for the APIs that require a sequence of vectors.
+    """
+    return list(zip(*[iter(values)] * item_length))
+
+
+_INT = struct.Struct("i")
+_UINT = struct.Struct("<I")
+_FLOAT = struct.Struct("f")
+_VECTOR2 = struct.Struct("2f")
+_VECTOR3 = struct.Struct("3f")
+_VECTOR4 = struct.Struct("4f")
+_MATRIX = struct.Struct("16f")
+
+
+class BufferWriter:
+    """
+    Payload builder that appends encoded values to a bytearray, so that building a payload is linear in its size,
+    where concatenating bytes objects is quadratic. The values are encoded like with the encode_* functions.
+
+    A size or count known only after the values that follow it, like the byte size of a nested payload, is reserved
+    with reserve_int() and written later with patch_int() or patch_size().
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def getbuffer(self) -> memoryview:
+        """
+        Return the payload without copying it, to use as Command data. Nothing can be written after this call, except
+        patches, while the memoryview is alive.
+        """
+        return memoryview(self._buffer)
+
+    def write(self, data):
+        """
+        Append encoded data, like a payload returned by an encode_* function.
+        """
+        self._buffer += data
+
+    def write_bool(self, value):
+        self._buffer += _UINT.pack(1 if value else 0)
+
+    def write_int(self, value: int):
+        self._buffer += _INT.pack(value)
+
+    def write_float(self, value: float):
+        self._buffer += _FLOAT.pack(value)
+
+    def write_string(self, value: str):
+        encoded_value = value.encode()
+        self._buffer += _UINT.pack(len(encoded_value))
+        self._buffer += encoded_value
+
+    def write_json(self, value):
+        self.write_string(json.dumps(value))
+
+    def write_string_array(self, values):
+        self._buffer += _UINT.pack(len(values))
+        for value in values:
+            self.write_string(value)
+
+    def write_vector2(self, value):
+        self._buffer += _VECTOR2.pack(value[0], value[1])
+
+    def write_vector3(self, value):
+        self._buffer += _VECTOR3.pack(value[0], value[1], value[2])
+
+    def write_vector4(self, value):
+        self._buffer += _VECTOR4.pack(value[0], value[1], value[2], value[3])
+
+    def write_color(self, value):
+        self._buffer += _VECTOR4.pack(value[0], value[1], value[2], value[3] if len(value) > 3 else 1.0)
+
+    def write_quaternion(self, value):
+        self._buffer += _VECTOR4.pack(value.w, value.x, value.y, value.z)
+
+    def write_matrix(self, value):
+        c0, c1, c2, c3 = value.col
+        self._buffer += _MATRIX.pack(*c0, *c1, *c2, *c3)
+
+    def write_array(self, values, typecode: str):
+        """
+        Append values like pack_array(), without an intermediate bytes object.
+        """
+        if isinstance(values, memoryview) and values.format == typecode:
+            self._buffer += values
+        elif isinstance(values, array.array) and values.typecode == typecode:
+            self._buffer += values
+        else:
+            self._buffer += array.array(typecode, values)
+
+    def write_typed_array(self, values, typecode: str, item_length: int = 1):
+        """
+        Append values like encode_typed_array().
+        """
+        self._buffer += _UINT.pack(len(values) // item_length)
+        self.write_array(values, typecode)
+
+    def write_floats(self, values, item_length: int = 1):
+        self.write_typed_array(values, "f", item_length)
+
+    def write_uints(self, values, item_length: int = 1):
+        self.write_typed_array(values, "I", item_length)
+
+    def write_message(self, message_type: MessageType, *values):
+        """
+        Append the fields of a message type that has a schema, like encode_message().
+        """
+        self._buffer += MESSAGE_SCHEMAS[message_type].encode(*values)
+
+    def reserve_int(self) -> int:
+        """
+        Append a placeholder for an int, and return its offset for patch_int() or patch_size().
+        """
+        offset = len(self._buffer)
+        self._buffer += bytes(4)
+        return offset
+
+    def patch_int(self, offset: int, value: int):
+        _INT.pack_into(self._buffer, offset, value)
+
+    def patch_size(self, offset: int):
+        """
+        Write at offset, reserved with reserve_int(), the byte size of the data appended after it.
+        """
+        self.patch_int(offset, len(self._buffer) - offset - 4)
+
+
+# Message schemas. A message type declares the fields of its payload once, and its schema encodes and decodes them
+# with precomputed struct.Struct objects instead of a chain of encode_* and decode_* calls. The encoded payloads are
+# the same as with these helpers.
+
+
+class FieldType(Enum):
+    STRING = "string"
+    BOOL = "bool"
+    INT = "int"
+    FLOAT = "float"
+    VECTOR3 = "vector3"
+    COLOR = "color"  # 3 or 4 floats when encoded, 4 floats when decoded
+    MATRIX = "matrix"  # 4 columns of 4 floats, a mathutils.Matrix or a sequence of columns when encoded
+
+
+# struct format and value count of the fixed size field types
+_FIELD_FORMATS = {
+    FieldType.BOOL: ("I", 1),
+    FieldType.INT: ("i", 1),
+    FieldType.FLOAT: ("f", 1),
+    FieldType.VECTOR3: ("3f", 3),
+    FieldType.COLOR: ("4f", 4),
+    FieldType.MATRIX: ("16f", 16),
+}
+
+_STRING_SIZE = struct.Struct("<I")
+
+
+def _encode_statements(name: str, field_type: FieldType) -> Tuple[List[str], List[str]]:
+    """
+    Return the statements that prepare the value of a field, and the struct arguments of the value.
+    """
+    if field_type == FieldType.STRING:
+        return [f"{name} = {name}.encode()"], [f"len({name})", name]
+    if field_type == FieldType.BOOL:
+        return [], [f"1 if {name} else 0"]
+    if field_type == FieldType.VECTOR3:
+        return [], [f"*{name}"]
+    if field_type == FieldType.COLOR:
+        return [f"_{name}_alpha = {name}[3] if len({name}) > 3 else 1.0"], [f"*{name}[:3]", f"_{name}_alpha"]
+    if field_type == FieldType.MATRIX:
+        columns = [f"_{name}_{i}" for i in range(4)]
+        return [f"{', '.join(columns)} = getattr({name}, 'col', {name})"], [f"*{column}" for column in columns]
+    return [], [name]
+
+
+def _decode_expression(field_type: FieldType, values: str, offset: int) -> str:
+    """
+    Return the expression of the value of a field, that starts at offset in the unpacked values.
+    """
+    if field_type == FieldType.BOOL:
+        return f"{values}[{offset}] == 1"
+    if field_type in (FieldType.VECTOR3, FieldType.COLOR):
+        return f"{values}[{offset}:{offset + _FIELD_FORMATS[field_type][1]}]"
+    if field_type == FieldType.MATRIX:
+        return "(" + ", ".join(f"{values}[{offset + i}:{offset + i + 4}]" for i in range(0, 16, 4)) + ")"
+    return f"{values}[{offset}]"
+
+
+class MessageSchema:
+    """
+    Payload layout of a message type, as a sequence of named fields.
+
+    Like namedtuple, the schema generates the source of its encode() and decode() functions, specialized for its fields.
+    A payload is encoded with a single Struct.pack() call, whose Struct depends on the byte size of the strings and is
+    cached. It is decoded with a single Struct.unpack_from() call per run of consecutive fixed size fields.
+    Decoded payloads are namedtuples whose attributes are the field names.
+    """
+
+    MAX_CACHED_STRUCT_COUNT = 256
+
+    def __init__(self, name: str, fields: List[Tuple[str, FieldType]]):
+        self.fields = fields
+        self.record = collections.namedtuple(name, [field_name for field_name, _ in fields])
+        self._structs: Dict[Any, struct.Struct] = {}
+
+        namespace = {
+            "_record": self.record,
+            "_structs": self._structs,
+            "_make_struct": self._make_struct,
+            "_unpack_size": _STRING_SIZE.unpack_from,
+        }
+        exec(self._encoder_source(), namespace)
+        exec(self._decoder_source(namespace), namespace)
+        self.encode = namespace["encode"]
+        self.decode = namespace["decode"]
+
+    def _string_names(self) -> List[str]:
+        return [field_name for field_name, field_type in self.fields if field_type == FieldType.STRING]
+
+    def _encoder_source(self) -> str:
+        lines = [f"def encode({', '.join(field_name for field_name, _ in self.fields)}):"]
+        args: List[str] = []
+        for field_name, field_type in self.fields:
+            statements, field_args = _encode_statements(field_name, field_type)
+            lines.extend(f"    {statement}" for statement in statements)
+            args.extend(field_args)
+
+        # The Struct is cached by string byte size, or by tuple of string byte sizes
+        sizes = [f"len({string_name})" for string_name in self._string_names()]
+        key = sizes[0] if len(sizes) == 1 else f"({', '.join(sizes)},)" if sizes else "()"
+        lines.append(f"    _key = {key}")
+        lines.append("    _layout = _structs.get(_key)")
+        lines.append("    if _layout is None:")
+        lines.append("        _layout = _make_struct(_key)")
+        lines.append(f"    return _layout.pack({', '.join(args)})")
+        return "\n".join(lines)
+
+    def _decoder_source(self, namespace: Dict[str, Any]) -> str:
+        lines = ["def decode(_data, _index=0):"]
+        runs: List[str] = []
+        formats: List[str] = []
+        expressions: List[Tuple[str, FieldType, int]] = []
+
+        def flush_run():
+            if formats:
+                layout = struct.Struct("<" + "".join(formats))
+                run = f"_unpack_run{len(runs)}"
+                runs.append(run)
+                namespace[run] = layout.unpack_from
+                lines.append(f"    _values = {run}(_data, _index)")
+                lines.append(f"    _index += {layout.size}")
+                for field_name, field_type, offset in expressions:
+                    lines.append(f"    {field_name} = {_decode_expression(field_type, '_values', offset)}")
+                formats.clear()
+                expressions.clear()
+
+        value_count = 0
+        for field_name, field_type in self.fields:
+            if field_type == FieldType.STRING:
+                flush_run()
+                value_count = 0
+                lines.append("    _start = _index + 4")
+                lines.append("    _index = _start + _unpack_size(_data, _index)[0]")
+                lines.append(f"    {field_name} = str(_data[_start:_index], 'utf-8')")
+            else:
+                field_format, field_value_count = _FIELD_FORMATS[field_type]
+                expressions.append((field_name, field_type, value_count))
+                formats.append(field_format)
+                value_count += field_value_count
+        flush_run()
+
+        lines.append(f"    return _record({', '.join(field_name for field_name, _ in self.fields)}), _index")
+        return "\n".join(lines)
+
+    def _make_struct(self, key) -> struct.Struct:
+        sizes = iter(key if isinstance(key, tuple) else (key,))
+        formats = []
+        for _, field_type in self.fields:
+            formats.append(f"I{next(sizes)}s" if field_type == FieldType.STRING else _FIELD_FORMATS[field_type][0])
+        layout = struct.Struct("<" + "".join(formats))
+        if len(self._structs) >= self.MAX_CACHED_STRUCT_COUNT:
+            self._structs.clear()
+        self._structs[key] = layout
+        return layout
+
+
+def _names(*names: str) -> List[Tuple[str, FieldType]]:
+    return [(name, FieldType.STRING) for name in names]
+
+
+MESSAGE_SCHEMAS: Dict[MessageType, MessageSchema] = {
+    MessageType.TRANSFORM: MessageSchema(
+        "Transform",
+        _names("path")
+        + [
+            ("parent_inverse_matrix", FieldType.MATRIX),
+            ("basis_matrix", FieldType.MATRIX),
+            ("local_matrix", FieldType.MATRIX),
+        ],
+    ),
+    MessageType.CAMERA: MessageSchema(
+        "Camera",
+        _names("path", "name")
+        + [
+            ("lens", FieldType.FLOAT),
+            ("clip_start", FieldType.FLOAT),
+            ("clip_end", FieldType.FLOAT),
+            ("aperture_fstop", FieldType.FLOAT),
+            ("sensor_fit", FieldType.INT),
+            ("sensor_width", FieldType.FLOAT),
+            ("sensor_height", FieldType.FLOAT),
+        ],
+    ),
+    MessageType.LIGHT: MessageSchema(
+        "Light",
+        _names("path", "name")
+        + [
+            ("light_type", FieldType.INT),
+            ("shadow", FieldType.INT),
+            ("color", FieldType.COLOR),
+            ("energy", FieldType.FLOAT),
+            ("spot_size", FieldType.FLOAT),
+            ("spot_blend", FieldType.FLOAT),
+        ],
+    ),
+    MessageType.FRAME: MessageSchema("Frame", [("frame", FieldType.INT)]),
+    MessageType.COLLECTION: MessageSchema(
+        "Collection",
+        _names("name")
+        + [
+            ("visible", FieldType.BOOL),
+            ("instance_offset", FieldType.VECTOR3),
+            ("temporary_visibility", FieldType.BOOL),
+        ],
+    ),
+    MessageType.COLLECTION_REMOVED: MessageSchema("CollectionRemoved", _names("name")),
+    MessageType.INSTANCE_COLLECTION: MessageSchema("InstanceCollection", _names("instance_name", "collection_name")),
+    MessageType.ADD_COLLECTION_TO_COLLECTION: MessageSchema(
+        "AddCollectionToCollection", _names("parent_name", "child_name")
+    ),
+    MessageType.REMOVE_COLLECTION_FROM_COLLECTION: MessageSchema(
+        "RemoveCollectionFromCollection", _names("parent_name", "child_name")
+    ),
+    MessageType.ADD_OBJECT_TO_COLLECTION: MessageSchema(
+        "AddObjectToCollection", _names("collection_name", "object_name")
+    ),
+    MessageType.REMOVE_OBJECT_FROM_COLLECTION: MessageSchema(
+        "RemoveObjectFromCollection", _names("collection_name", "object_name")
+    ),
+    MessageType.SCENE: MessageSchema("Scene", _names("name")),
+    MessageType.SCENE_REMOVED: MessageSchema("SceneRemoved", _names("name")),
+    MessageType.SCENE_RENAMED: MessageSchema("SceneRenamed", _names("old_name", "new_name")),
+    MessageType.ADD_COLLECTION_TO_SCENE: MessageSchema("AddCollectionToScene", _names("scene_name", "collection_name")),
+    MessageType.REMOVE_COLLECTION_FROM_SCENE: MessageSchema(
+        "RemoveCollectionFromScene", _names("scene_name", "collection_name")
+    ),
+    MessageType.ADD_OBJECT_TO_SCENE: MessageSchema("AddObjectToScene", _names("scene_name", "object_name")),
+    MessageType.REMOVE_OBJECT_FROM_SCENE: MessageSchema("RemoveObjectFromScene", _names("scene_name", "object_name")),
+    MessageType.ADD_OBJECT_TO_VRTIST: MessageSchema("AddObjectToVRtist", _names("scene_name", "object_name")),
+}
+
+
+def encode_message(message_type: MessageType, *values) -> bytes:
+    """
+    Encode the payload of a message type that has a schema, from the values of its fields.
+    """
+    return MESSAGE_SCHEMAS[message_type].encode(*values)
+
+
+def decode_message(message_type: MessageType, data, index: int = 0) -> Tuple[Any, int]:
+    """
+    Decode the payload of a message type that has a schema, to a namedtuple of its fields and the index after them.
+    """
+    return MESSAGE_SCHEMAS[message_type].decode(data, index)
+
+
 class Command:
-    _id = 100
+    # next() on itertools.count is atomic, so that ids are unique across threads
+    _ids = itertools.count(100)
 
-    def __init__(self, command_type: MessageType, data=b"", command_id=0):
+    def __init__(self, command_type: MessageType, data=b"", command_id=0, compression=Compression.NONE):
         self.data = data or b""
         self.type = command_type
         self.id = command_id
         if command_id == 0:
-            self.id = Command._id
-            Command._id += 1
+            self.id = next(Command._ids)
+        self.compression = compression  # of data, that decompress_command() inflates
 
     def byte_size(self):
         return 8 + 4 + 2 + len(self.data)
 
+    def frame_type(self) -> int:
+        """
+        Value of the message type field of the frame header, with the compression flags.
+        """
+        return self.type.value | self.compression
+
+    def frame_header(self) -> bytes:
+        """
+        Header to send before the payload, for writers that do not want to copy the payload with to_byte_buffer().
+        """
+        return _frame_header.pack(len(self.data), self.id, self.frame_type())
+
     def to_byte_buffer(self):
         size = int_to_bytes(len(self.data), 8)
         command_id = int_to_bytes(self.id, 4)
-        mtype = int_to_bytes(self.type.value, 2)
+        mtype = int_to_bytes(self.frame_type(), 2)
 
         return size + command_id + mtype + self.data
 
 
+class FramedCommand(Command):
+    """
+    Command framed once in an immutable buffer, its payload being a view on this buffer.
+
+    The server frames each room command when it enters the room, so that the room history, the live fan-out and the
+    join replay all share the same buffer, whatever the number of receivers.
+    """
+
+    def __init__(self, command: Command, frame: Optional[Any] = None):
+        """
+        Frame command, or reference frame if provided, that must hold the frame of command.
+        """
+        self.frame = frame if frame is not None else bytearray(command.frame_header()) + command.data
+        super().__init__(command.type, memoryview(self.frame)[FRAME_HEADER_SIZE:], command.id, command.compression)
+        self.id = command.id
+
+    def set_id(self, command_id: int):
+        """
+        Set the command id, in the frame header too. Only valid before the frame is shared.
+        """
+        self.id = command_id
+        _frame_header.pack_into(self.frame, 0, len(self.data), command_id, self.frame_type())
+
+    def to_byte_buffer(self):
+        return self.frame
+
+
+def frame_command(frame_type: int, data=b"", command_id: int = 0) -> Command:
+    """
+    Return the command of a frame, from the message type field of its header, that holds the compression flags.
+    """
+    return Command(
+        int_to_message_type(frame_type & ~COMPRESSION_MASK),
+        data,
+        command_id,
+        Compression(frame_type & COMPRESSION_MASK),
+    )
+
+
+def frame_message_type(frame_type: int) -> MessageType:
+    """
+    Return the message type of the message type field of a frame header, without the compression flags.
+    """
+    return int_to_message_type(frame_type & ~COMPRESSION_MASK)
+
+
+def compress_payload(data, compression: Compression, level: int) -> bytes:
+    """
+    Return the compressed payload of data: its size, then data compressed with compression at level.
+    """
+    if compression == Compression.ZLIB:
+        compressed_data = zlib.compress(data, level)
+    elif compression == Compression.LZMA:
+        compressed_data = lzma.compress(data, preset=level)
+    else:
+        raise ValueError(f"Unsupported compression {compression}")
+    return _uncompressed_size.pack(len(data)) + compressed_data
+
+
+def decompress_payload(data, compression: Compression, max_length: int = -1):
+    """
+    Return the data of a compressed payload, or only its first max_length bytes if max_length is not negative, that
+    are inflated without inflating the whole payload. Raise ValueError if the payload is corrupted.
+    """
+    if max_length == 0:
+        return b""
+    try:
+        size = _uncompressed_size.unpack_from(data, 0)[0]
+        compressed_data = memoryview(data)[_uncompressed_size.size :]
+        if compression == Compression.ZLIB:
+            if max_length < 0:
+                result = zlib.decompress(compressed_data, bufsize=max(size, 1))
+            else:
+                result = zlib.decompressobj().decompress(compressed_data, max_length)
+        elif compression == Compression.LZMA:
+            if max_length < 0:
+                result = lzma.decompress(compressed_data)
+            else:
+                result = lzma.LZMADecompressor().decompress(compressed_data, max_length)
+        else:
+            raise ValueError(f"Unsupported compression {compression}")
+    except (struct.error, zlib.error, lzma.LZMAError) as e:
+        raise ValueError(f"Corrupted {compression.name} payload: {e}")
+    if len(result) != (size if max_length < 0 else min(size, max_length)):
+        raise ValueError(f"{compression.name} payload of {len(result)} bytes instead of {size}")
+    return result
+
+
+def compress_command(command: Command) -> Command:
+    """
+    Return command with a compressed payload if its message type has a compression policy that applies to its size and
+    compression makes it smaller, command itself otherwise.
+    """
+    policy = COMPRESSION_POLICIES.get(command.type)
+    if policy is None or command.compression != Compression.NONE:
+        return command
+    min_size, compression, level = policy
+    if len(command.data) < min_size:
+        return command
+    data = compress_payload(command.data, compression, level)
+    if len(data) >= len(command.data):
+        return command
+    return Command(command.type, data, command.id, compression)
+
+
+def decompress_command(command: Command) -> Command:
+    """
+    Return command with its payload inflated, or command itself if it is not compressed. Raise ValueError if the
+    payload is corrupted.
+    """
+    if command.compression == Compression.NONE:
+        return command
+    return Command(command.type, decompress_payload(command.data, command.compression), command.id)
+
+
+def payload_prefix(command: Command, size: int):
+    """
+    Return the first size bytes of the payload of command, or less if it is smaller, inflating only these bytes if
+    the payload is compressed. Raise ValueError if the payload is corrupted.
+    """
+    if command.compression == Compression.NONE:
+        return command.data[:size]
+    return decompress_payload(command.data, command.compression, size)
+
+
+def make_batch_command(commands: Iterable[Command]) -> Command:
+    """
+    Return a BATCH command that holds the frames of commands, with their ids and compression flags.
+    """
+    frames = []
+    for command in commands:
+        if isinstance(command, FramedCommand):
+            frames.append(command.frame)
+        else:
+            frames.append(command.frame_header())
+            frames.append(command.data)
+    return Command(MessageType.BATCH, b"".join(frames))
+
+
+def batch_contents(command: Command) -> List[Command]:
+    """
+    Return the commands held by a BATCH command, whose payloads are views on its payload. Raise ValueError if the
+    payload is corrupted.
+    """
+    data = memoryview(command.data)
+    commands = []
+    offset = 0
+    while offset < len(data):
+        if offset + FRAME_HEADER_SIZE > len(data):
+            raise ValueError(f"Truncated frame header at {offset} in a BATCH of {len(data)} bytes")
+        size, command_id, frame_type = decode_frame_header(data, offset)
+        begin = offset + FRAME_HEADER_SIZE
+        offset = begin + size
+        if offset > len(data):
+            raise ValueError(f"Truncated frame of {size} bytes at {begin} in a BATCH of {len(data)} bytes")
+        commands.append(frame_command(frame_type, data[begin:offset], command_id))
+    return commands
+
+
+def _is_batchable(command: Command) -> bool:
+    return (
+        command.type > MessageType.COMMAND
+        and not isinstance(command, FileFrames)
+        and command.byte_size() <= BATCHED_MESSAGE_SIZE
+    )
+
+
+def batch_commands(commands: List[Command]) -> List[Command]:
+    """
+    Return commands, with the runs of consecutive small room commands replaced by BATCH commands that hold them.
+    The order of the commands is kept.
+    """
+    result: List[Command] = []
+    run: List[Command] = []
+    run_size = 0
+    for command in commands + [None]:
+        batchable = command is not None and _is_batchable(command)
+        if run and (not batchable or run_size + command.byte_size() > BATCH_SIZE):
+            result.append(make_batch_command(run) if len(run) > 1 else run[0])
+            run = []
+            run_size = 0
+        if batchable:
+            run.append(command)
+            run_size += command.byte_size()
+        elif command is not None:
+            result.append(command)
+    return result
+
+
+def unbatch_commands(commands: List[Command]) -> List[Command]:
+    """
+    Return commands, with the BATCH commands replaced by the commands they hold. A corrupted BATCH is dropped.
+    """
+    if all(command.type != MessageType.BATCH for command in commands):
+        return commands
+    result = []
+    for command in commands:
+        if command.type != MessageType.BATCH:
+            result.append(command)
+            continue
+        try:
+            result.extend(batch_contents(command))
+        except ValueError as e:
+            logger.error("Corrupted BATCH of %d bytes dropped: %s", len(command.data), e)
+    return result
+
+
+class FileFrames(Command):
+    """
+    Frames of several commands, stored contiguously in a file that is also memory mapped, and sent with sendfile.
+    """
+
+    def __init__(self, file, buffer, command_count: int, label: str = ""):
+        super().__init__(MessageType.COMMAND, b"", 1)
+        self.file = file
+        self.buffer = buffer  # memory map of the file, for platforms without sendfile
+        self.command_count = command_count
+        self.label = label  # to log the transfer throughput
+
+    def byte_size(self):
+        return len(self.buffer)
+
+    def to_byte_buffer(self):
+        return self.buffer
+
+
+class FileRange:
+    """
+    Part of the file of FileFrames not sent yet.
+    """
+
+    def __init__(self, frames: FileFrames, offset: int = 0, start_time: Optional[float] = None):
+        self.frames = frames
+        self.offset = offset
+        self.start_time = start_time
+
+    def __len__(self):
+        return len(self.frames.buffer) - self.offset
+
+    def __getitem__(self, item: slice):
+        assert item.stop is None
+        return FileRange(self.frames, self.offset + item.start, self.start_time)
+
+    def send(self, sock: socket.socket) -> int:
+        if self.start_time is None:
+            self.start_time = time.monotonic()
+        count = min(len(self), SENDFILE_SIZE)
+        if _has_sendfile:
+            return os.sendfile(sock.fileno(), self.frames.file.fileno(), self.offset, count)
+        return sock.send(memoryview(self.frames.buffer)[self.offset : self.offset + count])
+
+    def log_throughput(self):
+        duration = max(time.monotonic() - (self.start_time or 0.0), 1e-6)
+        byte_size = len(self.frames.buffer)
+        logger.info(
+            "%s: %d commands, %d bytes sent in %.3f s (%.1f MiB/s)",
+            self.frames.label,
+            self.frames.command_count,
+            byte_size,
+            duration,
+            byte_size / duration / (1024 * 1024),
+        )
+
+
 class CommandFormatter:
     def format_clients(self, clients):
         s = ""
@@ -427,98 +1291,387 @@ class CommandFormatter:
                 s += self.format_clients(clients)
         elif command.type == MessageType.SEND_ERROR:
             s += f"ERROR: {decode_string(command.data, 0)[0]}\n"
+        elif command.type in (MessageType.SAVE_ROOM, MessageType.LOAD_ROOM):
+            s += f"room {decode_string(command.data, 0)[0]}"
         else:
             pass
 
         return s
 
 
-def recv(socket: socket.socket, size: int):
+class FrameReader:
     """
-    Try to read size bytes from the socket.
-    Raise ClientDisconnectedException if the socket is disconnected.
+    Incremental decoder of the frames received on a socket.
+
+    Data is received with recv_into() in a bytearray that is never resized, and all the complete frames it holds are
+    decoded at once. Command payloads are memoryviews on this buffer, so a buffer region is never overwritten once its
+    frames have been handed out: when the free space is exhausted, the incomplete tail is moved to a new buffer, sized
+    to receive the whole frame in place when it is larger than the default buffer size.
+
+    FRAGMENT messages are reassembled transparently in a buffer allocated for the fragmented frame.
     """
-    result = b""
-    while size != 0:
-        r, _, _ = select.select([socket], [], [], 0.1)
-        if len(r) > 0:
-            try:
-                tmp = socket.recv(size)
-            except (ConnectionAbortedError, ConnectionResetError) as e:
-                logger.warning(e)
-                raise ClientDisconnectedException()
-
-            if len(tmp) == 0:
-                raise ClientDisconnectedException()
-
-            result += tmp
-            size -= len(tmp)
-    return result
 
+    def __init__(self, buffer_size: int = READ_BUFFER_SIZE):
+        self._buffer_size = buffer_size
+        self._view = memoryview(bytearray(buffer_size))
+        self._begin = 0  # start of the first incomplete frame
+        self._end = 0  # end of received data
+        self._fragmented_frame: Optional[bytearray] = None
+        self._fragmented_size = 0  # received size of the fragmented frame
+        self.receive_time = time.monotonic()  # when data was last received
+
+    def _reserve(self):
+        pending_size = self._end - self._begin
+        required_size = FRAME_HEADER_SIZE
+        if pending_size >= FRAME_HEADER_SIZE:
+            required_size += bytes_to_int(self._view[self._begin : self._begin + 8])
+
+        if self._begin + required_size <= len(self._view) and self._end < len(self._view):
+            return
+
+        view = memoryview(bytearray(max(self._buffer_size, required_size)))
+        view[:pending_size] = self._view[self._begin : self._end]
+        self._view = view
+        self._begin = 0
+        self._end = pending_size
+
+    def recv(self, sock: socket.socket) -> bool:
+        """
+        Receive available data with a single recv_into() call.
+        Raise ClientDisconnectedException if the socket is disconnected.
+        Return False if the socket is non blocking and no data is waiting.
+        """
+        self._reserve()
+        try:
+            size = sock.recv_into(self._view[self._end :])
+        except (BlockingIOError, InterruptedError):
+            return False
+        except (ConnectionAbortedError, ConnectionResetError) as e:
+            logger.warning(e)
+            raise ClientDisconnectedException()
 
-def read_message(socket: socket.socket, timeout: Optional[float] = None) -> Optional[Command]:
+        if size == 0:
+            raise ClientDisconnectedException()
+
+        self._end += size
+        self.receive_time = time.monotonic()
+        return True
+
+    def feed(self, data) -> List[Command]:
+        """
+        Add data received by other means than recv(), and decode the complete frames received so far.
+        """
+        commands: List[Command] = []
+        view = memoryview(data)
+        if len(view) > 0:
+            self.receive_time = time.monotonic()
+        while len(view) > 0:
+            self._reserve()
+            size = min(len(view), len(self._view) - self._end)
+            self._view[self._end : self._end + size] = view[:size]
+            self._end += size
+            view = view[size:]
+            commands.extend(self.commands())
+        return commands
+
+    def pending_data(self) -> bytes:
+        """
+        Return the data received and not decoded yet, the incomplete frame at the end.
+        Raise ValueError while a frame is reassembled from fragments.
+        """
+        if self._fragmented_frame is not None:
+            raise ValueError("Fragmented frame being reassembled")
+        return bytes(self._view[self._begin : self._end])
+
+    def commands(self) -> List[Command]:
+        """
+        Decode all the complete frames received so far.
+        """
+        commands: List[Command] = []
+        view = self._view
+        begin = self._begin
+        while self._end - begin >= FRAME_HEADER_SIZE:
+            frame_size, command_id, message_type = _frame_header.unpack_from(view, begin)
+            data_begin = begin + FRAME_HEADER_SIZE
+            end = data_begin + frame_size
+            if end > self._end:
+                break
+            if message_type == MessageType.FRAGMENT:
+                command = self._add_fragment(view[data_begin:end])
+                if command is not None:
+                    commands.append(command)
+            else:
+                commands.append(frame_command(message_type, view[data_begin:end], command_id))
+            begin = end
+
+        self._begin = begin
+        return commands
+
+    def _add_fragment(self, fragment: memoryview) -> Optional[Command]:
+        """
+        Copy a fragment in the fragmented frame, and return its command if the frame is complete.
+        """
+        if self._fragmented_frame is None:
+            # The first fragment starts with the header of the fragmented frame
+            frame_size = FRAME_HEADER_SIZE + bytes_to_int(fragment[0:8])
+            self._fragmented_frame = bytearray(frame_size)
+            self._fragmented_size = 0
+
+        frame = self._fragmented_frame
+        end = self._fragmented_size + len(fragment)
+        if end > len(frame):
+            logger.error("Fragment overflow: %d bytes received for a frame of %d bytes", end, len(frame))
+            raise ClientDisconnectedException()
+        frame[self._fragmented_size : end] = fragment
+        self._fragmented_size = end
+        if end < len(frame):
+            return None
+
+        self._fragmented_frame = None
+        _, command_id, message_type = _frame_header.unpack_from(frame, 0)
+        command = frame_command(message_type, b"", command_id)
+        return FramedCommand(command, frame)
+
+    def read_all(self, sock: Optional[socket.socket], timeout: Optional[float] = None) -> List[Command]:
+        """
+        Receive all data waiting on a blocking socket and return the complete commands.
+        Raise ClientDisconnectedException if the socket is disconnected.
+        Return empty list if no complete command is waiting on the socket.
+        """
+        if not sock:
+            logger.warning("read_all called with no socket")
+            return []
+
+        commands: List[Command] = []
+        select_timeout = timeout if timeout is not None else 0.0001
+        r, _, _ = select.select([sock], [], [], select_timeout)
+        while len(r) > 0:
+            self.recv(sock)
+            commands.extend(self.commands())
+            r, _, _ = select.select([sock], [], [], 0.0)
+
+        return commands
+
+
+class WriteStatistics:
     """
-    Try to read a full message from the socket.
-    Raise ClientDisconnectedException if the socket is disconnected.
-    Return None if no message is waiting on the socket.
+    Counters of the messages and bytes carried by each send syscall.
     """
-    if not socket:
-        logger.warning("read_message called with no socket")
-        return None
 
-    select_timeout = timeout if timeout is not None else 0.0001
-    r, _, _ = select.select([socket], [], [], select_timeout)
-    if len(r) == 0:
-        return None
+    def __init__(self):
+        self.syscall_count = 0
+        self.message_count = 0
+        self.byte_count = 0
 
-    try:
-        prefix_size = 14
-        msg = recv(socket, prefix_size)
+    def add_syscall(self, byte_count: int):
+        self.syscall_count += 1
+        self.byte_count += byte_count
+
+    def add_messages(self, message_count: int):
+        self.message_count += message_count
 
-        frame_size = bytes_to_int(msg[:8])
-        command_id = bytes_to_int(msg[8:12])
-        message_type = bytes_to_int(msg[12:])
+    def __str__(self):
+        syscall_count = max(self.syscall_count, 1)
+        return (
+            f"{self.message_count} messages, {self.byte_count} bytes in {self.syscall_count} syscalls "
+            f"({self.message_count / syscall_count:.1f} messages, {self.byte_count / syscall_count:.0f} bytes per syscall)"
+        )
 
-        msg = recv(socket, frame_size)
 
-        return Command(int_to_message_type(message_type), msg, command_id)
+def frame_commands(commands: Iterable[Command], buffers: Deque[Any]) -> int:
+    """
+    Append the frames of commands to buffers, as views so that payloads are not copied, or as FileRanges.
+    Return the framed byte size.
+    """
+    byte_size = 0
+    for command in commands:
+        if isinstance(command, FileFrames):
+            buffers.append(FileRange(command))
+        elif isinstance(command, FramedCommand):
+            buffers.append(memoryview(command.frame))
+        else:
+            buffers.append(memoryview(command.frame_header()))
+            if len(command.data) > 0:
+                buffers.append(memoryview(command.data))
+        byte_size += command.byte_size()
+    return byte_size
+
 
-    except ClientDisconnectedException:
-        raise
-    except Exception as e:
-        logger.error(e, exc_info=True)
-        raise
+def encode_frame_header(buffer, offset: int, size: int, command_id: int, message_type: int):
+    """
+    Write the header of a frame with a payload of size bytes at offset in buffer.
+    """
+    _frame_header.pack_into(buffer, offset, size, command_id, message_type)
 
 
-def read_all_messages(socket: socket.socket, timeout: Optional[float] = None) -> List[Command]:
+def decode_frame_header(buffer, offset: int = 0) -> Tuple[int, int, int]:
     """
-    Try to read all messages waiting on the socket.
+    Return the payload size, the id and the message type value of the frame header at offset in buffer.
+    """
+    return _frame_header.unpack_from(buffer, offset)
+
+
+def frame_slice(command: Command, begin: int, end: int):
+    """
+    Return the bytes between begin and end of the frame of command. Only the frame header is copied.
+    """
+    if isinstance(command, FramedCommand):
+        return memoryview(command.frame)[begin:end]
+    if begin >= FRAME_HEADER_SIZE:
+        return memoryview(command.data)[begin - FRAME_HEADER_SIZE : end - FRAME_HEADER_SIZE]
+    return command.frame_header()[begin:end] + bytes(memoryview(command.data)[: max(end - FRAME_HEADER_SIZE, 0)])
+
+
+def _is_memoryview(buffer) -> bool:
+    return isinstance(buffer, memoryview)
+
+
+def send_buffers(sock: socket.socket, buffers: Deque[Any], statistics: Optional[WriteStatistics] = None) -> bool:
+    """
+    Send buffers with a single scatter-gather syscall, then remove what was sent from buffers.
+    Buffers are memoryviews, or FileRanges sent by a sendfile syscall each.
     Raise ClientDisconnectedException if the socket is disconnected.
-    Return empty list if no message is waiting on the socket.
+    Return False if the socket is non blocking and cannot accept data.
     """
-    received_commands: List[Command] = []
-    while True:
-        command = read_message(socket, timeout=timeout)
-        if command is None:
+    first = buffers[0]
+    views = itertools.islice(itertools.takewhile(_is_memoryview, buffers), MAX_SEND_BUFFER_COUNT)
+    try:
+        if isinstance(first, FileRange):
+            sent = first.send(sock)
+        elif _has_sendmsg:
+            sent = sock.sendmsg(views)
+        else:
+            sent = sock.send(b"".join(views))
+    except (BlockingIOError, InterruptedError):
+        return False
+    except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError) as e:
+        logger.warning(e)
+        raise ClientDisconnectedException()
+
+    if statistics is not None:
+        statistics.add_syscall(sent)
+
+    while sent > 0:
+        buffer = buffers[0]
+        if sent < len(buffer):
+            buffers[0] = buffer[sent:]
             break
-        received_commands.append(command)
-    return received_commands
+        sent -= len(buffer)
+        buffers.popleft()
+        if isinstance(buffer, FileRange):
+            buffer.log_throughput()
+    return True
 
 
-def write_message(sock: Optional[socket.socket], command: Command):
+def write_messages(
+    sock: Optional[socket.socket], commands: List[Command], statistics: Optional[WriteStatistics] = None
+):
+    """
+    Write commands to a blocking socket, coalescing them in scatter-gather writes of at most WRITE_BATCH_SIZE bytes.
+    """
     if not sock:
-        logger.warning("write_message called with no socket")
+        logger.warning("write_messages called with no socket")
         return
 
-    buffer = command.to_byte_buffer()
+    buffers: Deque[Any] = collections.deque()
+    index = 0
+    while index < len(commands):
+        batch_size = 0
+        batch_begin = index
+        while index < len(commands) and batch_size < WRITE_BATCH_SIZE:
+            batch_size += frame_commands((commands[index],), buffers)
+            index += 1
+        if statistics is not None:
+            statistics.add_messages(index - batch_begin)
+        while buffers:
+            send_buffers(sock, buffers, statistics)
+
+
+def write_message(sock: Optional[socket.socket], command: Command, statistics: Optional[WriteStatistics] = None):
+    write_messages(sock, [command], statistics)
+
 
+def enable_keepalive(sock: socket.socket):
+    """
+    Make the system probe a TCP peer that stays silent, so that a peer gone without closing its connection is detected.
+    """
+    if sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return
     try:
-        _, w, _ = select.select([], [sock], [])
-        if sock.sendall(buffer) is not None:
-            raise ClientDisconnectedException()
-    except (ConnectionAbortedError, ConnectionResetError) as e:
-        logger.warning(e)
-        raise ClientDisconnectedException()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_IDLE)
+        elif hasattr(socket, "TCP_KEEPALIVE"):
+            # macOS
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, KEEPALIVE_IDLE)
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, KEEPALIVE_INTERVAL)
+        if hasattr(socket, "TCP_KEEPCNT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_COUNT)
+        if hasattr(socket, "TCP_USER_TIMEOUT"):
+            # Keepalive probes are not sent while sent data is not acknowledged
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, int(TCP_USER_TIMEOUT * 1000))
+        if hasattr(socket, "SIO_KEEPALIVE_VALS"):
+            # Windows
+            sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, KEEPALIVE_IDLE * 1000, KEEPALIVE_INTERVAL * 1000))
+    except OSError as e:
+        logger.warning("Cannot enable TCP keepalive: %s", e)
+
+
+def is_local_host(host: str) -> bool:
+    # Does not catch the addresses of the network interfaces
+    return host in LOCAL_HOSTS
+
+
+def local_socket_path(port: int) -> Optional[str]:
+    """
+    Return the path of the Unix domain socket of a server of this host listening on port, None if the platform has no
+    Unix domain sockets. The socket lives in a directory private to the user, so that other users cannot impersonate
+    the server.
+    """
+    if not hasattr(socket, "AF_UNIX") or not hasattr(os, "getuid"):
+        return None
+    directory = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(tempfile.gettempdir(), f"mixer-{os.getuid()}")
+    return os.path.join(directory, f"mixer-{port}.sock")
+
+
+def is_private_directory(directory: str) -> bool:
+    """
+    Return True if directory belongs to the user and is only accessible by them.
+    """
+    try:
+        status = os.stat(directory)
+    except OSError:
+        return False
+    return status.st_uid == os.getuid() and status.st_mode & 0o077 == 0
+
+
+def notify_ready(port: int):
+    """
+    Notify the process that started the server, listening on port of the loopback interface, that the server accepts
+    connections, by connecting to it.
+    """
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=1.0):
+            pass
+    except OSError as e:
+        logger.warning("Cannot notify readiness on port %s: %s", port, e)
+
+
+def make_heartbeat_command(idle_timeout: float) -> Command:
+    """
+    Return a HEARTBEAT command, that tells the peer the idle timeout of the sender, 0 if it never times out.
+    """
+    return Command(MessageType.HEARTBEAT, encode_float(idle_timeout))
+
+
+def heartbeat_interval(interval: float, peer_idle_timeout: float) -> float:
+    """
+    Return the delay between two HEARTBEAT messages, short enough for a peer that times out after peer_idle_timeout.
+    """
+    if peer_idle_timeout > 0:
+        return min(interval, peer_idle_timeout / 3)
+    return interval
 
 
 def make_set_room_attributes_command(room_name: str, attributes: dict):
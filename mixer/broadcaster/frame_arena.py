@@ -0,0 +1,264 @@
+"""
+Compact storage of framed commands, for room histories that hold millions of small commands.
+
+Frames are stored contiguously in a few large buffers, and located with arrays of buffer indices, offsets and message
+types, instead of one Command object with its own payload per command. Command objects are only materialized as
+FramedCommand views on the stored frames, when they are read.
+
+The arena buffers are:
+- an optional base buffer, like the buffer of a room snapshot, whose frames are indexed in place,
+- chunks allocated by the arena, that frames are copied to, with a size that doubles up to CHUNK_SIZE,
+- frames of large framed commands, that are adopted instead of copied.
+
+A stored frame is never modified nor moved, so that the views handed out remain valid while they are referenced.
+Compaction copies the frames that remain in chunks to new chunks, the previous ones being released when their last
+view is.
+
+The frames held in memory can be spilled to a file, where they are indexed in a memory map of the file. The system
+writes the pages of the map back to disk and evicts them under memory pressure, and reads them again when they are
+accessed.
+"""
+
+from array import array
+import mmap
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import mixer.broadcaster.common as common
+
+# Maximum size of the chunks frames are copied to
+CHUNK_SIZE = 4 * 1024 * 1024
+FIRST_CHUNK_SIZE = 64 * 1024
+
+# Framed commands larger than this size are adopted, their frame becoming an arena buffer
+ADOPT_BYTE_SIZE = common.FRAGMENT_SIZE
+
+
+def iter_commands(buffer) -> Iterator[common.FramedCommand]:
+    """
+    Yield the commands framed contiguously in buffer, as views on it.
+    """
+    view = memoryview(buffer)
+    offset = 0
+    while offset < len(buffer):
+        size, command_id, message_type = common.decode_frame_header(buffer, offset)
+        end = offset + common.FRAME_HEADER_SIZE + size
+        yield common.FramedCommand(common.frame_command(message_type, b"", command_id), view[offset:end])
+        offset = end
+
+
+def renumber_frames(buffer) -> int:
+    """
+    Set the id of the frames framed contiguously in the writable buffer to their position, starting at 1, and return
+    their count. Raise ValueError if buffer does not end with a complete frame.
+    """
+    offset = 0
+    count = 0
+    while offset < len(buffer):
+        if offset + common.FRAME_HEADER_SIZE > len(buffer):
+            raise ValueError(f"Partial frame header at offset {offset}")
+        size, _, message_type = common.decode_frame_header(buffer, offset)
+        count += 1
+        common.encode_frame_header(buffer, offset, size, count, message_type)
+        offset += common.FRAME_HEADER_SIZE + size
+    if offset != len(buffer):
+        raise ValueError(f"Partial frame at the end of {count} frames")
+    return count
+
+
+class FrameArena:
+    """
+    Sequence of framed commands, with append, random access, range iteration and compaction.
+
+    Not thread safe.
+    """
+
+    def __init__(self, base=None):
+        """
+        Index the frames of base, if provided, that must hold complete frames.
+        """
+        self._buffers: List[Any] = []
+        self._chunks: Dict[int, int] = {}  # used size of the chunks allocated by the arena, by buffer index
+        self._fill_index: Optional[int] = None  # index of the chunk frames are copied to
+
+        self._buffer_indices = array("I")
+        self._offsets = array("Q")
+        self._types = array("H")
+        self.byte_size = 0  # byte size of the indexed frames
+        self.memory_byte_size = 0  # byte size of the buffers that are not memory maps, including unindexed frames
+
+        if base is not None:
+            self._add_buffer(base)
+            offset = 0
+            while offset < len(base):
+                size, _, message_type = common.decode_frame_header(base, offset)
+                self._index(0, offset, message_type)
+                offset += common.FRAME_HEADER_SIZE + size
+            self.byte_size = offset
+
+    def __len__(self):
+        return len(self._offsets)
+
+    @property
+    def index_byte_size(self) -> int:
+        return len(self) * (self._buffer_indices.itemsize + self._offsets.itemsize + self._types.itemsize)
+
+    def append(self, command: common.Command, command_id: int):
+        """
+        Store the frame of command, with command_id in its header.
+        """
+        size = command.byte_size()
+        if (
+            isinstance(command, common.FramedCommand)
+            and isinstance(command.frame, bytearray)
+            and size > ADOPT_BYTE_SIZE
+        ):
+            command.set_id(command_id)
+            self._index(self._add_buffer(command.frame), 0, command.frame_type())
+        else:
+            buffer_index, offset = self._reserve(size)
+            chunk = self._buffers[buffer_index]
+            common.encode_frame_header(chunk, offset, len(command.data), command_id, command.frame_type())
+            chunk[offset + common.FRAME_HEADER_SIZE : offset + size] = command.data
+            self._index(buffer_index, offset, command.frame_type())
+        self.byte_size += size
+
+    def message_type(self, position: int) -> common.MessageType:
+        return common.frame_message_type(self._types[position])
+
+    def has_compressed_frames(self) -> bool:
+        return any(frame_type & common.COMPRESSION_MASK for frame_type in self._types)
+
+    def frame_size(self, position: int) -> int:
+        size, _, _ = common.decode_frame_header(self._buffers[self._buffer_indices[position]], self._offsets[position])
+        return common.FRAME_HEADER_SIZE + size
+
+    def frame(self, position: int) -> memoryview:
+        buffer = self._buffers[self._buffer_indices[position]]
+        offset = self._offsets[position]
+        size, _, _ = common.decode_frame_header(buffer, offset)
+        return memoryview(buffer)[offset : offset + common.FRAME_HEADER_SIZE + size]
+
+    def command(self, position: int) -> common.FramedCommand:
+        """
+        Return the command at position, as a view on its frame.
+        """
+        frame = self.frame(position)
+        _, command_id, frame_type = common.decode_frame_header(frame)
+        return common.FramedCommand(common.frame_command(frame_type, b"", command_id), frame)
+
+    def frames(self, start: int = 0, stop: Optional[int] = None) -> Iterator[memoryview]:
+        """
+        Yield the frames between positions start and stop.
+        """
+        for position in range(start, len(self) if stop is None else stop):
+            yield self.frame(position)
+
+    def commands(self, start: int = 0, stop: Optional[int] = None) -> Iterator[common.FramedCommand]:
+        """
+        Yield the commands between positions start and stop.
+        """
+        for position in range(start, len(self) if stop is None else stop):
+            yield self.command(position)
+
+    def compact(self, positions: Iterable[int]):
+        """
+        Keep only the frames at positions, in increasing order. Frames stored in chunks are copied to new chunks.
+        """
+        buffers, chunks = self._buffers, self._chunks
+        buffer_indices, offsets, types = self._buffer_indices, self._offsets, self._types
+        self._reset()
+
+        kept: Dict[int, int] = {}  # new index of the buffers kept in place, by previous index
+        for position in positions:
+            previous_index = buffer_indices[position]
+            buffer = buffers[previous_index]
+            offset = offsets[position]
+            size, _, _ = common.decode_frame_header(buffer, offset)
+            size += common.FRAME_HEADER_SIZE
+            if previous_index in chunks:
+                buffer_index, new_offset = self._reserve(size)
+                self._buffers[buffer_index][new_offset : new_offset + size] = memoryview(buffer)[offset : offset + size]
+                offset = new_offset
+            else:
+                buffer_index = self._keep(buffer, previous_index, kept)
+            self._index(buffer_index, offset, types[position])
+            self.byte_size += size
+
+    def spill(self, file):
+        """
+        Move the frames stored in memory to file, and index them in a memory map of file.
+        """
+        if self.memory_byte_size == 0:
+            return
+        buffers, buffer_indices, offsets, types = self._buffers, self._buffer_indices, self._offsets, self._types
+        byte_size = self.byte_size
+        self._reset()
+        self.byte_size = byte_size
+
+        kept: Dict[int, int] = {}
+        file_index: Optional[int] = None
+        file_size = 0
+        for position in range(len(types)):
+            previous_index = buffer_indices[position]
+            buffer = buffers[previous_index]
+            offset = offsets[position]
+            if isinstance(buffer, mmap.mmap):
+                buffer_index = self._keep(buffer, previous_index, kept)
+            else:
+                size, _, _ = common.decode_frame_header(buffer, offset)
+                file.write(memoryview(buffer)[offset : offset + common.FRAME_HEADER_SIZE + size])
+                if file_index is None:
+                    file_index = len(self._buffers)
+                    self._buffers.append(None)  # the memory map, once the file is written
+                buffer_index, offset = file_index, file_size
+                file_size += common.FRAME_HEADER_SIZE + size
+            self._index(buffer_index, offset, types[position])
+
+        if file_index is not None:
+            file.flush()
+            self._buffers[file_index] = mmap.mmap(file.fileno(), file_size, access=mmap.ACCESS_READ)
+
+    def _reset(self):
+        self._buffers, self._chunks, self._fill_index = [], {}, None
+        self._buffer_indices, self._offsets, self._types = array("I"), array("Q"), array("H")
+        self.byte_size = 0
+        self.memory_byte_size = 0
+
+    def _add_buffer(self, buffer) -> int:
+        self._buffers.append(buffer)
+        if not isinstance(buffer, mmap.mmap):
+            self.memory_byte_size += len(buffer)
+        return len(self._buffers) - 1
+
+    def _keep(self, buffer, previous_index: int, kept: Dict[int, int]) -> int:
+        """
+        Return the index of a buffer kept in place, added once.
+        """
+        buffer_index = kept.get(previous_index)
+        if buffer_index is None:
+            buffer_index = kept[previous_index] = self._add_buffer(buffer)
+        return buffer_index
+
+    def _index(self, buffer_index: int, offset: int, message_type: int):
+        self._buffer_indices.append(buffer_index)
+        self._offsets.append(offset)
+        self._types.append(message_type)
+
+    def _reserve(self, size: int):
+        """
+        Return the chunk index and offset of size free bytes in a chunk.
+        """
+        if self._fill_index is not None:
+            chunk = self._buffers[self._fill_index]
+            offset = self._chunks[self._fill_index]
+            if offset + size <= len(chunk):
+                self._chunks[self._fill_index] = offset + size
+                return self._fill_index, offset
+            chunk_size = min(2 * len(chunk), CHUNK_SIZE)
+        else:
+            chunk_size = FIRST_CHUNK_SIZE
+
+        # The remainder of the previous chunk is wasted, a large frame gets a chunk of its own
+        self._fill_index = self._add_buffer(bytearray(max(chunk_size, size)))
+        self._chunks[self._fill_index] = size
+        return self._fill_index, 0
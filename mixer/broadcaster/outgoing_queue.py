@@ -0,0 +1,288 @@
+"""
+Bounded queue of the commands waiting to be sent to a client.
+
+Commands are sent in two priority lanes, so that interactive commands are not stuck behind large payloads:
+- the interactive lane holds transforms, frame changes, and client and room updates,
+- the bulk lane holds all other commands. Large commands are sent in FRAGMENT messages when the receiver supports
+  them, and interactive commands are interleaved with the fragments.
+
+An interactive command overtakes the commands of the bulk lane only if they are all large commands about other
+subjects. Otherwise it is queued in the bulk lane, so that it is not received before the commands it depends on.
+
+The queue is measured in bytes. When a client does not read its commands fast enough, the queue overflows and a slow
+consumer policy applies:
+- collapse: superseded TRANSFORM and FRAME commands are removed from the queue,
+- resync: the queued room commands are dropped, and the room commands broadcast to the client are discarded until the
+  queue is drained. The client is then resynchronized from a snapshot of the room,
+- disconnect: the client is disconnected.
+
+If the queue still overflows after the policy applies, the client is disconnected.
+"""
+
+import collections
+from enum import Enum
+import itertools
+import logging
+import threading
+from typing import Deque, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import MessageType
+from mixer.broadcaster.room_history import COMPACTION_BARRIERS, compaction_key
+
+logger = logging.getLogger(__name__)
+
+MAX_QUEUE_BYTE_SIZE = 256 * 1024 * 1024
+
+# Commands that may overtake large commands
+INTERACTIVE_MESSAGE_TYPES = {
+    MessageType.TRANSFORM,
+    MessageType.FRAME,
+    MessageType.CLIENT_UPDATE,
+    MessageType.ROOM_UPDATE,
+}
+
+# Commands larger than this size may be overtaken by interactive commands
+LARGE_COMMAND_BYTE_SIZE = common.FRAGMENT_SIZE
+
+
+class SlowConsumerPolicy(Enum):
+    COLLAPSE = "collapse"
+    RESYNC = "resync"
+    DISCONNECT = "disconnect"
+
+
+def _collapse_key(command: common.Command) -> Optional[Tuple[MessageType, Hashable]]:
+    if command.type == MessageType.FRAME:
+        return MessageType.FRAME, None
+    if command.type == MessageType.TRANSFORM:
+        return compaction_key(command)
+    return None
+
+
+def _subject(command: common.Command) -> Optional[Hashable]:
+    """
+    Return the path of the object a command is about, for commands that start with a path.
+    """
+    if command.type > MessageType.OPTIMIZED_COMMANDS:
+        key = compaction_key(command)
+        if key is not None:
+            return key[1]
+    return None
+
+
+def _is_room_command(command: common.Command) -> bool:
+    # A BATCH holds room commands
+    return command.type > MessageType.COMMAND or command.type == MessageType.BATCH
+
+
+def _is_large(command: common.Command) -> bool:
+    # FileFrames hold several commands, that cannot be fragmented nor overtaken
+    return command.byte_size() > LARGE_COMMAND_BYTE_SIZE and not isinstance(command, common.FileFrames)
+
+
+class OutgoingQueue:
+    """
+    Commands to send to a client, filled by any thread and consumed by the thread that writes to the client socket.
+    """
+
+    def __init__(
+        self, max_byte_size: int = MAX_QUEUE_BYTE_SIZE, policy: SlowConsumerPolicy = SlowConsumerPolicy.COLLAPSE
+    ):
+        self.max_byte_size = max_byte_size  # 0 for an unbounded queue
+        self.policy = policy
+        self.fragment_size = 0  # size of the fragments of large commands, 0 if the receiver does not support them
+
+        self._interactive: Deque[common.Command] = collections.deque()
+        self._bulk: Deque[common.Command] = collections.deque()
+        self._ordered_count = 0  # commands of the bulk lane that interactive commands cannot overtake
+        self._large_subjects: Dict[Hashable, int] = {}  # subject count of the large commands of the bulk lane
+        self._fragmented_size = 0  # frame size of the first bulk command already sent in fragments
+        self._mutex = threading.Lock()
+        self.byte_size = 0
+        # The frames of unbounded commands are shared with the room history, they do not count in max_byte_size
+        self._unbounded_sizes: Dict[int, int] = {}  # byte size of the queued unbounded commands, by command id()
+        self.unbounded_byte_size = 0
+
+        self.high_water_byte_size = 0
+        self.high_water_command_count = 0
+        self.overflow_count = 0
+        self.dropped_count = 0  # commands removed by the slow consumer policy
+
+        self.paused = False  # room commands are discarded until the client is resynchronized
+
+    def __len__(self):
+        return len(self._interactive) + len(self._bulk)
+
+    def put(self, command: common.Command, bounded: bool = True) -> bool:
+        """
+        Queue a command. Commands that are not bounded, like the room history sent to a joining client, do not count in
+        the queue bound and do not trigger the slow consumer policy.
+        Return False if the queue overflows and the client must be disconnected.
+        """
+        with self._mutex:
+            if self.paused and _is_room_command(command):
+                self.dropped_count += 1
+                return True
+
+            if (
+                command.type in INTERACTIVE_MESSAGE_TYPES
+                and self._ordered_count == 0
+                and _subject(command) not in self._large_subjects
+            ):
+                self._interactive.append(command)
+            else:
+                self._bulk.append(command)
+                self._count_bulk(command, 1)
+
+            byte_size = command.byte_size()
+            self.byte_size += byte_size
+            if not bounded:
+                key = id(command)
+                self._unbounded_sizes[key] = self._unbounded_sizes.get(key, 0) + byte_size
+                self.unbounded_byte_size += byte_size
+            if self.byte_size > self.high_water_byte_size:
+                self.high_water_byte_size = self.byte_size
+            if len(self) > self.high_water_command_count:
+                self.high_water_command_count = len(self)
+
+            if bounded and self.max_byte_size > 0 and self._bounded_byte_size() > self.max_byte_size:
+                return self._overflow()
+            return True
+
+    def get_batch(self, max_byte_size: int) -> List[common.Command]:
+        """
+        Remove and return queued commands, interactive commands first, until their byte size reaches max_byte_size.
+        Large commands are returned as FRAGMENT commands if fragment_size is set.
+        """
+        commands: List[common.Command] = []
+        batch_size = 0
+        with self._mutex:
+            while self._interactive and batch_size < max_byte_size:
+                command = self._interactive.popleft()
+                commands.append(command)
+                batch_size += command.byte_size()
+                self._release_unbounded(command)
+
+            while self._bulk and batch_size < max_byte_size:
+                command = self._bulk[0]
+                frame_size = command.byte_size()
+                if 0 < self.fragment_size < frame_size and not isinstance(command, common.FileFrames):
+                    begin = self._fragmented_size
+                    end = min(begin + self.fragment_size, frame_size)
+                    commands.append(common.Command(MessageType.FRAGMENT, common.frame_slice(command, begin, end)))
+                    batch_size += end - begin
+                    if end < frame_size:
+                        self._fragmented_size = end
+                        continue
+                    self._fragmented_size = 0
+                else:
+                    commands.append(command)
+                    batch_size += frame_size
+                self._bulk.popleft()
+                self._count_bulk(command, -1)
+                self._release_unbounded(command)
+
+            self.byte_size -= batch_size
+        return commands
+
+    def clear(self):
+        with self._mutex:
+            self._fragmented_size = 0
+            self._set_lanes([], [])
+
+    def resync_pending(self) -> bool:
+        """
+        Return True if the client is paused and all commands queued before have been consumed.
+        """
+        return self.paused and len(self) == 0
+
+    def resume(self):
+        with self._mutex:
+            self.paused = False
+
+    def _bounded_byte_size(self) -> int:
+        return self.byte_size - self.unbounded_byte_size
+
+    def _release_unbounded(self, command: common.Command):
+        key = id(command)
+        size = self._unbounded_sizes.get(key)
+        if size is None:
+            return
+        byte_size = command.byte_size()
+        if size > byte_size:
+            self._unbounded_sizes[key] = size - byte_size
+        else:
+            del self._unbounded_sizes[key]
+        self.unbounded_byte_size -= byte_size
+
+    def _count_bulk(self, command: common.Command, increment: int):
+        # A large command about an unknown subject, like a BLENDER_DATA_UPDATE, may create any object
+        subject = _subject(command) if _is_large(command) else None
+        if subject is None:
+            self._ordered_count += increment
+            return
+
+        count = self._large_subjects.get(subject, 0) + increment
+        if count > 0:
+            self._large_subjects[subject] = count
+        else:
+            del self._large_subjects[subject]
+
+    def _overflow(self) -> bool:
+        self.overflow_count += 1
+        count = len(self)
+
+        # The first bulk command is kept if it is partially sent
+        bulk = list(self._bulk)
+        sending, bulk = (bulk[:1], bulk[1:]) if self._fragmented_size > 0 else ([], bulk)
+        if self.policy == SlowConsumerPolicy.COLLAPSE:
+            self._set_lanes(_collapse(self._interactive), sending + _collapse(bulk))
+        elif self.policy == SlowConsumerPolicy.RESYNC:
+            self._set_lanes(
+                [command for command in self._interactive if not _is_room_command(command)],
+                sending + [command for command in bulk if not _is_room_command(command)],
+            )
+            self.paused = True
+
+        logger.warning(
+            "Outgoing queue overflow (%s policy): %d commands dropped, %d bytes left",
+            self.policy.value,
+            count - len(self),
+            self.byte_size,
+        )
+        return self._bounded_byte_size() <= self.max_byte_size
+
+    def _set_lanes(self, interactive: List[common.Command], bulk: List[common.Command]):
+        self.dropped_count += len(self) - len(interactive) - len(bulk)
+        self._interactive = collections.deque(interactive)
+        self._bulk = collections.deque()
+        self._ordered_count = 0
+        self._large_subjects = {}
+        for command in bulk:
+            self._bulk.append(command)
+            self._count_bulk(command, 1)
+        # The part of the first bulk command already sent in fragments is not queued anymore
+        lanes = itertools.chain(self._interactive, self._bulk)
+        self.byte_size = sum(command.byte_size() for command in lanes) - self._fragmented_size
+        kept = {id(command) for command in itertools.chain(self._interactive, self._bulk)}
+        self._unbounded_sizes = {key: size for key, size in self._unbounded_sizes.items() if key in kept}
+        self.unbounded_byte_size = sum(self._unbounded_sizes.values())
+
+
+def _collapse(commands: Iterable[common.Command]) -> List[common.Command]:
+    # Walk from the newest command, a command is superseded by a newer one with the same key unless a barrier is in
+    # between
+    kept: List[common.Command] = []
+    newer_keys = set()
+    for command in reversed(list(commands)):
+        if command.type in COMPACTION_BARRIERS:
+            newer_keys.clear()
+        key = _collapse_key(command)
+        if key is not None:
+            if key in newer_keys:
+                continue
+            newer_keys.add(key)
+        kept.append(command)
+    kept.reverse()
+    return kept
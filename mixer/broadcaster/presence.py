@@ -0,0 +1,101 @@
+"""
+Coalescing of the client and room attribute updates broadcast by the server.
+
+Attribute updates are merged per client and per room, and broadcast at most once per tick, so that frequent updates
+like room counters or user frustums do not produce one message per change.
+
+Client attributes set by the server, the user name and the user color are broadcast to all clients. The other client
+attributes, like the selections and frustums of the Blender addon, are only sent to the clients of the same room.
+"""
+
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from mixer.broadcaster.common import ClientAttributes
+
+# Delay in seconds between two broadcasts of attribute updates
+PRESENCE_TICK = 0.05
+
+# Client attributes broadcast to all clients, the others are only sent to the clients of the same room
+GLOBAL_CLIENT_ATTRIBUTES = {
+    ClientAttributes.ID,
+    ClientAttributes.IP,
+    ClientAttributes.PORT,
+    ClientAttributes.ROOM,
+    ClientAttributes.QUEUE_HIGH_WATER_MARK,
+    ClientAttributes.USERNAME,
+    ClientAttributes.USERCOLOR,
+}
+
+Updates = Dict[str, Dict[str, Any]]  # attributes by client id or room name
+
+
+def split_client_attributes(attributes: Mapping[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Return the attributes broadcast to all clients, and those only sent to the clients of the same room.
+    """
+    global_attributes = {}
+    room_attributes = {}
+    for key, value in attributes.items():
+        if key in GLOBAL_CLIENT_ATTRIBUTES:
+            global_attributes[key] = value
+        else:
+            room_attributes[key] = value
+    return global_attributes, room_attributes
+
+
+class Presence:
+    """
+    Pending attribute updates, added by any thread and broadcast by the server when they are due.
+    """
+
+    def __init__(self, tick: float = PRESENCE_TICK):
+        self.tick = tick  # 0 to broadcast updates immediately
+        self._mutex = threading.Lock()
+        self._clients: Updates = {}
+        self._rooms: Updates = {}
+        self._due_time: Optional[float] = None  # None if no update is pending
+
+    def update_client(self, client_id: str, attributes: Mapping[str, Any]):
+        with self._mutex:
+            self._clients.setdefault(client_id, {}).update(attributes)
+            self._schedule()
+
+    def update_room(self, room_name: str, attributes: Mapping[str, Any]):
+        with self._mutex:
+            self._rooms.setdefault(room_name, {}).update(attributes)
+            self._schedule()
+
+    def discard_client(self, client_id: str):
+        with self._mutex:
+            self._clients.pop(client_id, None)
+
+    def discard_room(self, room_name: str):
+        with self._mutex:
+            self._rooms.pop(room_name, None)
+
+    def timeout(self) -> Optional[float]:
+        """
+        Return the delay in seconds until the pending updates are due, None if no update is pending.
+        """
+        due_time = self._due_time
+        if due_time is None:
+            return None
+        return max(0.0, due_time - time.monotonic())
+
+    def pop_due(self) -> Tuple[Updates, Updates]:
+        """
+        Remove and return the pending client and room updates if they are due.
+        """
+        with self._mutex:
+            if self._due_time is None or time.monotonic() < self._due_time:
+                return {}, {}
+            clients, rooms = self._clients, self._rooms
+            self._clients, self._rooms = {}, {}
+            self._due_time = None
+            return clients, rooms
+
+    def _schedule(self):
+        if self._due_time is None:
+            self._due_time = time.monotonic() + self.tick
@@ -7,9 +7,8 @@ An known issue is that all these functions are synchronous, so we cannot inform
 from mixer.broadcaster.common import MessageType, encode_json
 from mixer.broadcaster.common import Command
 from mixer.broadcaster.common import ClientDisconnectedException
-from mixer.broadcaster.common import read_all_messages
 from mixer.broadcaster.client import Client
-from typing import List, Tuple, Dict, Any
+from typing import Any, BinaryIO, Dict, List, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
@@ -28,10 +27,16 @@ def download_room(host: str, port: int, room_name: str) -> Tuple[Dict[str, Any],
         room_attributes = None
 
         try:
-            while room_attributes is None or len(commands) < room_attributes[RoomAttributes.COMMAND_COUNT]:
+            # The server sends the room snapshot and the commands after it, which may be more than the room command
+            # count, then JOIN_ROOM
+            joined = False
+            while not joined:
                 received_commands = client.fetch_incoming_commands()
 
                 for command in received_commands:
+                    if command.type == MessageType.JOIN_ROOM:
+                        joined = True
+                        break
                     if room_attributes is None and command.type == MessageType.LIST_ROOMS:
                         rooms_attributes, _ = decode_json(command.data, 0)
                         if room_name not in rooms_attributes:
@@ -46,10 +51,7 @@ def download_room(host: str, port: int, room_name: str) -> Tuple[Dict[str, Any],
                         continue  # don't store server protocol commands
 
                     commands.append(command)
-                    if room_attributes is not None:
-                        logger.debug(
-                            "Command %d / %d received", len(commands), room_attributes[RoomAttributes.COMMAND_COUNT]
-                        )
+                    logger.debug("Command %d received", len(commands))
         except ClientDisconnectedException:
             logger.error(f"Disconnected while downloading room {room_name} from {host}:{port}")
             return {}, []
@@ -79,7 +81,7 @@ def upload_room(host: str, port: int, room_name: str, room_attributes: dict, com
 
             # The server will send back room update messages since the room is joined.
             # Consume them to avoid a client/server deadlock on broadcaster full send socket
-            read_all_messages(client.socket, timeout=0.0)
+            client.fetch_incoming_commands()
 
         client.send_command(Command(MessageType.CONTENT))
 
@@ -88,25 +90,46 @@ def upload_room(host: str, port: int, room_name: str, room_attributes: dict, com
             raise ClientDisconnectedException("Client disconnected before the end of upload room")
 
 
+def write_room_attributes(file: BinaryIO, room_attributes: dict):
+    """
+    Write the header of a room file, that the frames of the room commands follow.
+    """
+    file.write(encode_json(room_attributes))
+
+
+def read_room_attributes(file: BinaryIO) -> dict:
+    """
+    Read the header of a room file, leaving file at the first frame of the room commands.
+    Raise ValueError if the header is invalid.
+    """
+    from mixer.broadcaster.common import bytes_to_int
+    import json
+
+    data = file.read(4)
+    if len(data) < 4:
+        raise ValueError("Missing room file header")
+    string_length = bytes_to_int(data)
+    attributes = json.loads(file.read(string_length).decode())
+    if not isinstance(attributes, dict):
+        raise ValueError("Invalid room file header")
+    return attributes
+
+
 def save_room(room_attributes: dict, commands: List[Command], file_path: str):
     with open(file_path, "wb") as f:
-        f.write(encode_json(room_attributes))
+        write_room_attributes(f, room_attributes)
         for c in commands:
             f.write(c.to_byte_buffer())
 
 
 def load_room(file_path: str) -> Tuple[dict, List[Command]]:
-    from mixer.broadcaster.common import bytes_to_int, int_to_message_type
-    import json
+    from mixer.broadcaster.common import bytes_to_int, frame_command
 
     # todo factorize file reading with network reading
     room_medata = None
     commands = []
     with open(file_path, "rb") as f:
-        data = f.read(4)
-        string_length = bytes_to_int(data)
-        attributes_string = f.read(string_length).decode()
-        room_medata = json.loads(attributes_string)
+        room_medata = read_room_attributes(f)
         while True:
             prefix_size = 14
             msg = f.read(prefix_size)
@@ -119,7 +142,7 @@ def load_room(file_path: str) -> Tuple[dict, List[Command]]:
 
             msg = f.read(frame_size)
 
-            commands.append(Command(int_to_message_type(message_type), msg, command_id))
+            commands.append(frame_command(message_type, msg, command_id))
 
     assert room_medata is not None
 
@@ -0,0 +1,476 @@
+"""
+Command history of a room, with last-writer-wins compaction.
+
+Commands that set a state (TRANSFORM, MESH, BLENDER_DATA_UPDATE, ...) supersede the previous command that set the same
+state, which is then useless for clients that join the room later. The history indexes these commands and tombstones
+superseded entries, that are periodically swept.
+
+The frames of the commands are stored in a FrameArena, with the room sequence number of each command as its id, so
+that an entry costs a few bytes of index on top of its frame instead of a Command object and its payload.
+
+To bound the server memory, the frames can be spilled to a memory mapped file, and the history of a room without
+clients can be unloaded down to a snapshot in a file, then loaded again when a client joins. A history read from a room
+file starts unloaded, the same way, and the file itself can be left unread until the history is first loaded.
+
+Removing a superseded entry amounts to moving the state update to the position of the superseding entry. This is
+not valid if commands in between depend on the removed entry:
+- the first entry about a subject (object path or datablock uuid) usually creates it and is never removed,
+- commands that change the identity of subjects (rename, delete, ...) are compaction barriers: entries before the
+  barrier are never removed by entries after it.
+"""
+
+from array import array
+import bisect
+import itertools
+import json
+import logging
+import mmap
+import shutil
+import tempfile
+import time
+from typing import Dict, Hashable, Iterator, List, Optional, Set, Tuple
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import MessageType
+from mixer.broadcaster.frame_arena import FrameArena, iter_commands, renumber_frames
+
+logger = logging.getLogger(__name__)
+
+# Commands that change the identity of the subjects they apply to
+COMPACTION_BARRIERS = {
+    MessageType.DELETE,
+    MessageType.RENAME,
+    MessageType.DUPLICATE,
+    MessageType.SEND_TO_TRASH,
+    MessageType.RESTORE_FROM_TRASH,
+    MessageType.COLLECTION_REMOVED,
+    MessageType.SCENE_REMOVED,
+    MessageType.SCENE_RENAMED,
+    MessageType.BLENDER_DATA_REMOVE,
+    MessageType.BLENDER_DATA_RENAME,
+}
+
+# Sweep tombstones when there are more than this number and more than live entries
+MIN_SWEEP_TOMBSTONE_COUNT = 1024
+
+# A new snapshot is made for a joining client when the tail of commands after the snapshot is larger than both
+SNAPSHOT_MIN_TAIL_BYTE_SIZE = 1024 * 1024
+SNAPSHOT_TAIL_RATIO = 0.25
+
+# Snapshots larger than this size are stored in a memory mapped file, that joining clients receive with sendfile
+SNAPSHOT_FILE_MIN_BYTE_SIZE = 16 * 1024 * 1024
+
+# Size of the reads that copy room files
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+def compaction_key(command: common.Command) -> Optional[Tuple[MessageType, Hashable]]:
+    """
+    Return the (message type, subject) key of a command that supersedes previous commands with the same key, or None
+    if the command cannot be compacted.
+    """
+    command_type = command.type
+    if command_type > MessageType.OPTIMIZED_COMMANDS:
+        # The subject is the encoded path, or empty for commands without a path like FRAME. Only the path is inflated
+        # from a compressed payload
+        try:
+            path_length = common.bytes_to_int(common.payload_prefix(command, 4))
+            data = common.payload_prefix(command, 4 + path_length)
+        except ValueError:
+            return None
+        path = bytes(data[4 : 4 + path_length]) if 4 + path_length <= len(data) else b""
+        return command_type, path
+
+    if command_type == MessageType.BLENDER_DATA_UPDATE:
+        try:
+            # A compressed proxy is inflated to read its uuid, the command itself remains compressed
+            encoded_proxy, _ = common.decode_string(common.decompress_command(command).data, 0)
+            uuid = json.loads(encoded_proxy)["_data"]["mixer_uuid"]
+        except (ValueError, KeyError, TypeError):
+            return None
+        if not uuid:
+            return None
+        return command_type, uuid
+
+    return None
+
+
+class RoomSnapshot:
+    """
+    Checkpoint of the room state: the compacted history up to a sequence number, framed in one contiguous buffer.
+
+    A joining client receives the snapshot, then the commands with a sequence number greater than the snapshot one.
+    """
+
+    def __init__(self, sequence: int, buffer, command_count: int, file=None, compressed: bool = True):
+        self.sequence = sequence
+        self.buffer = buffer  # bytes, or memory map of file
+        self.command_count = command_count
+        self.file = file
+        self.compressed = compressed  # False if no frame has a compressed payload
+        self.creation_time = time.monotonic()
+
+    def file_frames(self, label: str) -> Optional[common.FileFrames]:
+        """
+        Return the snapshot as a single command sent with sendfile, if it is stored in a file.
+        """
+        if self.file is None:
+            return None
+        return common.FileFrames(self.file, self.buffer, self.command_count, label)
+
+    @property
+    def byte_size(self) -> int:
+        return len(self.buffer)
+
+    def commands(self) -> Iterator[common.FramedCommand]:
+        return iter_commands(self.buffer)
+
+    def age(self) -> float:
+        return time.monotonic() - self.creation_time
+
+
+class RoomHistory:
+    """
+    Commands of a room, each with a sequence number that increases with each append.
+
+    Not thread safe, the room serializes accesses.
+    """
+
+    def __init__(self):
+        self._arena = FrameArena()
+        self._sequences = array("Q")
+        self._live = bytearray()  # 0 for tombstones
+        self._origins = array("I")  # index in _origin_names of the session of the client that sent each command
+        self._origin_names: List[Optional[str]] = [None]
+        self._origin_indices: Dict[Optional[str], int] = {None: 0}
+        self._last_sequence = 0
+
+        self._index: Dict[Tuple[MessageType, Hashable], int] = {}  # sequence of the last entry for a key
+        self._subjects: Set[Hashable] = set()  # subjects with a first entry since the last barrier
+
+        self.byte_size = 0
+        self.command_count = 0
+        self._tombstone_count = 0
+        self.sweep_count = 0  # incremented each time superseded commands are removed
+
+        self.snapshot: Optional[RoomSnapshot] = None
+        self.tail_byte_size = 0  # byte size of live commands after the snapshot
+
+        self.spill_directory: Optional[str] = None  # directory of the snapshot and spill files, None for the default
+        self.loaded = True
+        self.room_file: Optional[Tuple[str, int]] = None  # path and frames offset of a room file not read yet
+
+    @property
+    def memory_byte_size(self) -> int:
+        """
+        Byte size of the frames held in memory, the frames in memory mapped files excepted.
+        """
+        return self._arena.memory_byte_size
+
+    @property
+    def index_byte_size(self) -> int:
+        """
+        Byte size of the indexes of the commands, that are only released by unload().
+        """
+        entry_size = self._sequences.itemsize + 1  # sequence and live flag
+        return self._arena.index_byte_size + len(self._live) * entry_size + len(self._origins) * self._origins.itemsize
+
+    @property
+    def last_sequence(self) -> int:
+        return self._last_sequence
+
+    def append(self, command: common.Command, origin: Optional[str] = None) -> int:
+        """
+        Append command sent by the client with session origin, tombstone the entry it supersedes if any, and return
+        its sequence number.
+
+        The frame of command is copied to the history, or adopted if it is a large FramedCommand, with the sequence
+        number as command id. The stored command is returned by last_command().
+        """
+        assert self.loaded
+        self._last_sequence += 1
+        sequence = self._last_sequence
+        self._update_index(command, sequence)
+
+        origin_index = self._origin_indices.get(origin)
+        if origin_index is None:
+            origin_index = self._origin_indices[origin] = len(self._origin_names)
+            self._origin_names.append(origin)
+
+        byte_size = command.byte_size()
+        self._arena.append(command, sequence)
+        self._sequences.append(sequence)
+        self._live.append(1)
+        self._origins.append(origin_index)
+        self.byte_size += byte_size
+        self.tail_byte_size += byte_size
+        self.command_count += 1
+
+        if self._tombstone_count > MIN_SWEEP_TOMBSTONE_COUNT and self._tombstone_count > self.command_count:
+            self.sweep()
+
+        return sequence
+
+    def _update_index(self, command: common.Command, sequence: int):
+        if command.type in COMPACTION_BARRIERS:
+            self._index.clear()
+            self._subjects.clear()
+            return
+
+        key = compaction_key(command)
+        if key is not None:
+            subject = key[1]
+            previous_sequence = self._index.get(key)
+            if previous_sequence is not None:
+                self._tombstone(previous_sequence)
+            if subject in self._subjects:
+                self._index[key] = sequence
+            else:
+                # Keep the first entry of a subject, it creates it
+                self._subjects.add(subject)
+
+    def last_command(self) -> common.FramedCommand:
+        """
+        Return the last appended command, a view on the history storage to share with all receivers.
+        """
+        return self._arena.command(len(self._arena) - 1)
+
+    def _position(self, sequence: int) -> int:
+        return bisect.bisect_left(self._sequences, sequence)
+
+    def _tombstone(self, sequence: int):
+        position = self._position(sequence)
+        assert self._live[position] and self._sequences[position] == sequence
+        self._live[position] = 0
+        byte_size = self._arena.frame_size(position)
+        self.byte_size -= byte_size
+        if self.snapshot is None or sequence > self.snapshot.sequence:
+            self.tail_byte_size -= byte_size
+        self.command_count -= 1
+        self._tombstone_count += 1
+
+    def _live_positions(self) -> Iterator[int]:
+        return itertools.compress(range(len(self._live)), self._live)
+
+    def sweep(self):
+        """
+        Remove tombstones and compact the storage of the frames. Sequence numbers are preserved.
+        """
+        if self._tombstone_count == 0:
+            return
+        self._arena.compact(self._live_positions())
+        self._sequences = array("Q", itertools.compress(self._sequences, self._live))
+        self._origins = array("I", itertools.compress(self._origins, self._live))
+        self._live = bytearray(b"\x01") * len(self._sequences)
+        logger.debug("Swept %d tombstones", self._tombstone_count)
+        self._tombstone_count = 0
+        self.sweep_count += 1
+
+    def commands_after(
+        self, sequence: int, max_count: Optional[int] = None, excluded_origin: Optional[str] = None
+    ) -> List[Tuple[int, common.Command]]:
+        """
+        Return at most max_count live commands with a sequence number greater than sequence, with their sequence.
+        Commands sent by the client with session excluded_origin are skipped.
+        """
+        excluded_index = self._origin_indices.get(excluded_origin) if excluded_origin is not None else None
+        result: List[Tuple[int, common.Command]] = []
+        for position in range(self._position(sequence + 1), len(self._live)):
+            if not self._live[position]:
+                continue
+            if excluded_index is not None and self._origins[position] == excluded_index:
+                continue
+            result.append((self._sequences[position], self._arena.command(position)))
+            if max_count is not None and len(result) >= max_count:
+                break
+        return result
+
+    def can_resume(self, sequence: int) -> bool:
+        """
+        Return True if the commands after sequence bring a client that received the commands up to sequence to the
+        current room state.
+
+        Compaction never prevents it: an entry is only removed when a later entry supersedes it, so the superseding
+        entry is in the tail of any client that misses the removed one.
+        """
+        return 0 <= sequence <= self._last_sequence
+
+    def commands(self) -> List[common.Command]:
+        return [self._arena.command(position) for position in self._live_positions()]
+
+    def frames(self) -> List[memoryview]:
+        """
+        Return the frames of the live commands, that remain valid while they are referenced.
+        """
+        return [self._arena.frame(position) for position in self._live_positions()]
+
+    def make_snapshot(self, in_file: bool = False) -> RoomSnapshot:
+        """
+        Freeze the compacted history in a snapshot, stored in a file if in_file is set or if it is large.
+
+        The history storage is replaced by the snapshot buffer, so that the snapshot does not duplicate the room data.
+        """
+        assert self.loaded
+        self.sweep()
+        byte_size = self._arena.byte_size
+        file = None
+        if byte_size > 0 and (in_file or byte_size >= SNAPSHOT_FILE_MIN_BYTE_SIZE):
+            # The room data moves from the heap to the page cache, and is sent without being copied to user space
+            file = tempfile.TemporaryFile(prefix="mixer_snapshot_", dir=self.spill_directory)
+            for frame in self._arena.frames():
+                file.write(frame)
+            file.flush()
+            buffer = mmap.mmap(file.fileno(), byte_size, access=mmap.ACCESS_READ)
+        else:
+            buffer = b"".join(self._arena.frames())
+        self._arena = FrameArena(buffer)
+
+        self.snapshot = RoomSnapshot(
+            self._last_sequence, buffer, len(self._arena), file, self._arena.has_compressed_frames()
+        )
+        self.tail_byte_size = 0
+        logger.info("Snapshot made with %d commands, %d bytes", self.snapshot.command_count, self.snapshot.byte_size)
+        return self.snapshot
+
+    def spill(self):
+        """
+        Move the frames held in memory to a memory mapped file.
+        """
+        assert self.loaded
+        self.sweep()
+        if self.snapshot is not None and self.snapshot.file is None:
+            # The snapshot buffer is spilled too, a joining client gets a new snapshot
+            self.snapshot = None
+            self.tail_byte_size = self.byte_size
+        with tempfile.TemporaryFile(prefix="mixer_spill_", dir=self.spill_directory) as file:
+            # The memory map remains valid after the file is closed
+            self._arena.spill(file)
+
+    def unload(self):
+        """
+        Release the history down to a snapshot stored in a file, and the origins of its commands. The attributes of
+        the history remain valid, but commands cannot be appended nor read until load() is called.
+        """
+        if not self.loaded:
+            return
+        snapshot = self.snapshot
+        if (
+            snapshot is None
+            or snapshot.file is None
+            or snapshot.sequence != self._last_sequence
+            or self._tombstone_count > 0
+        ):
+            self.make_snapshot(in_file=True)
+        self._arena = FrameArena()
+        self._sequences = array("Q")
+        self._live = bytearray()
+        self._index.clear()
+        self._subjects.clear()
+        self.loaded = False
+
+    def load(self):
+        """
+        Rebuild the history from the snapshot it was unloaded to, or from its deferred room file.
+        """
+        if self.room_file is not None:
+            self._read_room_file()
+        if self.loaded:
+            return
+        self.loaded = True
+        assert self.snapshot is not None
+        self._arena = FrameArena(self.snapshot.buffer)
+        for command in self._arena.commands():
+            # The command id is its sequence number
+            self._sequences.append(command.id)
+            self._live.append(1)
+            self._update_index(command, command.id)
+
+    def load_frames(self, file):
+        """
+        Replace the empty history by the frames read from file, from its current position to its end.
+
+        The frames are copied to a memory mapped file in bulk, and numbered with sequence numbers. The history is left
+        unloaded, the frames being only indexed when load() is called. Raise ValueError if the frames are truncated.
+        """
+        assert self.loaded and self._last_sequence == 0
+        snapshot_file = tempfile.TemporaryFile(prefix="mixer_snapshot_", dir=self.spill_directory)
+        shutil.copyfileobj(file, snapshot_file, COPY_BUFFER_SIZE)
+        snapshot_file.flush()
+        byte_size = snapshot_file.tell()
+        if byte_size == 0:
+            snapshot_file.close()
+            return
+
+        try:
+            buffer = mmap.mmap(snapshot_file.fileno(), byte_size)
+            count = renumber_frames(buffer)
+        except ValueError:
+            snapshot_file.close()
+            raise
+        self.snapshot = RoomSnapshot(count, buffer, count, snapshot_file)
+        self._last_sequence = count
+        self._origins = array("I", [0]) * count
+        self.byte_size = byte_size
+        self.command_count = count
+        self.loaded = False
+
+    def defer_room_file(self, file_path: str, offset: int, byte_size: int, command_count: int):
+        """
+        Make the empty history read the frames of a room file, from offset to its end, when it is first loaded or
+        snapshot. Until then the history is unloaded, with byte_size and command_count as attributes.
+        """
+        assert self.loaded and self._last_sequence == 0
+        self.room_file = (file_path, offset)
+        self.byte_size = byte_size
+        self.command_count = command_count
+        self.loaded = False
+
+    def _read_room_file(self):
+        """
+        Read the deferred room file with load_frames(). Raise ValueError or OSError if it cannot be read, the room file
+        being kept for a later attempt.
+        """
+        assert self.room_file is not None
+        file_path, offset = self.room_file
+        byte_size, command_count = self.byte_size, self.command_count
+        self.room_file = None
+        self.loaded, self.byte_size, self.command_count = True, 0, 0
+        try:
+            with open(file_path, "rb") as file:
+                file.seek(offset)
+                self.load_frames(file)
+        except (ValueError, OSError):
+            self.defer_room_file(file_path, offset, byte_size, command_count)
+            raise
+
+    def full_snapshot(self) -> RoomSnapshot:
+        """
+        Return a snapshot of the whole history, made again if commands were appended since the current one.
+        """
+        if self.room_file is not None:
+            self._read_room_file()
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.sequence != self._last_sequence:
+            snapshot = self.make_snapshot()
+        return snapshot
+
+    def snapshot_for_join(self) -> RoomSnapshot:
+        """
+        Return the snapshot to send to a joining client, made again if the tail after the current one is too large.
+        """
+        snapshot = self.snapshot
+        if (
+            snapshot is None
+            or self.tail_byte_size > SNAPSHOT_MIN_TAIL_BYTE_SIZE
+            and self.tail_byte_size > snapshot.byte_size * SNAPSHOT_TAIL_RATIO
+        ):
+            snapshot = self.make_snapshot()
+        return snapshot
+
+    def join_byte_size(self) -> int:
+        """
+        Byte size of the commands sent to a joining client.
+        """
+        if self.snapshot is None:
+            return self.byte_size
+        return self.snapshot.byte_size + self.tail_byte_size
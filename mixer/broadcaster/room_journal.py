@@ -0,0 +1,260 @@
+"""
+Append-only journal of the rooms, to recover them after a server restart or crash.
+
+Each room has a journal file with the frames of its commands, in the order they were added, and an attributes file
+with its custom attributes and keep_open flag. Frames are written by a dedicated thread, so that journaling does not
+slow down the broadcast of commands. The journal files are synced to disk when the oldest unsynced frame is older than
+fsync_interval, or when the unsynced frames are larger than fsync_byte_size.
+
+The journal of a room is rewritten from its compacted history when the history sweeps its superseded commands, so that
+it does not keep them for the life of the room. The new journal replaces the previous one atomically.
+
+Journals are read in chunks when rooms are recovered, and a frame that was partially written when the server crashed
+is discarded.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+import mixer.broadcaster.common as common
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_EXTENSION = ".journal"
+ATTRIBUTES_EXTENSION = ".json"
+
+FSYNC_INTERVAL = 1.0
+FSYNC_BYTE_SIZE = 16 * 1024 * 1024
+
+# Size of the reads of a journal file when it is recovered
+READ_SIZE = 4 * 1024 * 1024
+
+
+def _journal_path(directory: str, room_name: str) -> str:
+    return os.path.join(directory, quote(room_name, safe="") + JOURNAL_EXTENSION)
+
+
+def _attributes_path(directory: str, room_name: str) -> str:
+    return os.path.join(directory, quote(room_name, safe="") + ATTRIBUTES_EXTENSION)
+
+
+def read_frames(buffer: bytearray) -> Tuple[List[common.FramedCommand], int]:
+    """
+    Return the commands framed in buffer, that reference it, and the byte size of the complete frames.
+    """
+    commands: List[common.FramedCommand] = []
+    view = memoryview(buffer)
+    offset = 0
+    while offset + common.FRAME_HEADER_SIZE <= len(buffer):
+        size, command_id, message_type = common.decode_frame_header(buffer, offset)
+        end = offset + common.FRAME_HEADER_SIZE + size
+        if end > len(buffer):
+            break
+        commands.append(common.FramedCommand(common.frame_command(message_type, b"", command_id), view[offset:end]))
+        offset = end
+    return commands, offset
+
+
+def read_journal(path: str, room_name: str) -> Iterator[common.FramedCommand]:
+    """
+    Yield the commands of a journal file, read READ_SIZE bytes at a time, each chunk referenced by the commands it
+    frames. A partial frame at the end of the file is discarded and truncated once all the commands are read.
+    """
+    with open(path, "r+b") as f:
+        pending = bytearray()  # beginning of a frame, read with the previous chunk
+        offset = 0  # file offset of pending
+        while True:
+            read_size = READ_SIZE
+            if len(pending) >= common.FRAME_HEADER_SIZE:
+                # Read a large frame at once instead of growing pending chunk by chunk
+                frame_size = common.FRAME_HEADER_SIZE + common.decode_frame_header(pending)[0]
+                read_size = max(read_size, frame_size - len(pending))
+            chunk = f.read(read_size)
+            if not chunk:
+                break
+            pending += chunk
+            commands, size = read_frames(pending)
+            yield from commands
+            offset += size
+            pending = pending[size:]
+
+        if pending:
+            logger.warning("Room %s journal: discarding %d bytes of a partial frame", room_name, len(pending))
+            f.truncate(offset)
+
+
+def load_journals(
+    directory: str, selected: Optional[Callable[[str], bool]] = None
+) -> Iterator[Tuple[str, Dict[str, Any], Iterator[common.FramedCommand]]]:
+    """
+    Yield the name, attributes and commands of the rooms journaled in directory, or of those for which selected
+    returns True. The files of the other rooms are not opened. The commands of a room must be iterated before the next
+    room is yielded.
+    """
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(JOURNAL_EXTENSION):
+            continue
+        room_name = unquote(file_name[: -len(JOURNAL_EXTENSION)])
+        if selected is not None and not selected(room_name):
+            continue
+        path = os.path.join(directory, file_name)
+        commands = read_journal(path, room_name)
+
+        attributes: Dict[str, Any] = {}
+        attributes_path = _attributes_path(directory, room_name)
+        if os.path.exists(attributes_path):
+            with open(attributes_path, "r") as f:
+                attributes = json.load(f)
+
+        yield room_name, attributes, commands
+
+
+class _JournalFile:
+    def __init__(self, directory: str, room_name: str):
+        self.file: BinaryIO = open(_journal_path(directory, room_name), "ab")
+        self.unsynced_byte_size = 0
+        self.unsynced_time = 0.0  # time of the oldest unsynced frame
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced_byte_size = 0
+
+
+class RoomJournal:
+    """
+    Journal of the rooms of a server, stored in a directory. Methods can be called by any thread.
+    """
+
+    def __init__(self, directory: str, fsync_interval: float = FSYNC_INTERVAL, fsync_byte_size: int = FSYNC_BYTE_SIZE):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.fsync_byte_size = fsync_byte_size  # 0 to only sync after fsync_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self._queue: "queue.Queue[Optional[Tuple[str, str, Any]]]" = queue.Queue()
+        self._files: Dict[str, _JournalFile] = {}
+        self._thread = threading.Thread(None, self._run, name="RoomJournal", daemon=True)
+        self._thread.start()
+
+    def append(self, room_name: str, command: common.FramedCommand):
+        """
+        Journal a command. Its frame must not be modified afterwards.
+        """
+        self._queue.put(("append", room_name, command.frame))
+
+    def append_frames(self, room_name: str, buffer):
+        """
+        Journal the commands framed contiguously in buffer, that must not be modified afterwards.
+        """
+        self._queue.put(("append", room_name, buffer))
+
+    def rewrite(self, room_name: str, frames: List[Any]):
+        """
+        Replace the journal of a room by frames, that must not be modified afterwards. Commands appended later are
+        journaled after them.
+        """
+        self._queue.put(("rewrite", room_name, frames))
+
+    def set_attributes(self, room_name: str, attributes: Dict[str, Any]):
+        self._queue.put(("attributes", room_name, dict(attributes)))
+
+    def delete(self, room_name: str):
+        self._queue.put(("delete", room_name, None))
+
+    def close(self):
+        """
+        Write and sync the queued frames, and stop the journal thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self._timeout())
+            except queue.Empty:
+                item = ("sync", "", None)
+            if item is None:
+                break
+
+            action, room_name, value = item
+            try:
+                if action == "append":
+                    self._append(room_name, value)
+                elif action == "rewrite":
+                    self._rewrite(room_name, value)
+                elif action == "attributes":
+                    self._set_attributes(room_name, value)
+                elif action == "delete":
+                    self._delete(room_name)
+                self._sync_due()
+            except OSError as e:
+                logger.error("Room %s journal: %s", room_name, e)
+
+        for journal_file in self._files.values():
+            journal_file.sync()
+            journal_file.file.close()
+        self._files.clear()
+
+    def _timeout(self) -> Optional[float]:
+        unsynced = [f.unsynced_time for f in self._files.values() if f.unsynced_byte_size > 0]
+        if not unsynced:
+            return None
+        return max(0.0, min(unsynced) + self.fsync_interval - time.monotonic())
+
+    def _append(self, room_name: str, frame):
+        journal_file = self._files.get(room_name)
+        if journal_file is None:
+            journal_file = self._files[room_name] = _JournalFile(self.directory, room_name)
+        if journal_file.unsynced_byte_size == 0:
+            journal_file.unsynced_time = time.monotonic()
+        journal_file.file.write(frame)
+        journal_file.unsynced_byte_size += len(frame)
+
+    def _rewrite(self, room_name: str, frames: List[Any]):
+        journal_file = self._files.pop(room_name, None)
+        if journal_file is not None:
+            journal_file.file.close()
+        # Replaced atomically, so that a crash leaves either journal
+        path = _journal_path(self.directory, room_name)
+        with open(path + ".tmp", "wb") as f:
+            for frame in frames:
+                f.write(frame)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _sync_due(self):
+        now = time.monotonic()
+        for journal_file in self._files.values():
+            if journal_file.unsynced_byte_size == 0:
+                continue
+            if (
+                now - journal_file.unsynced_time >= self.fsync_interval
+                or 0 < self.fsync_byte_size <= journal_file.unsynced_byte_size
+            ):
+                journal_file.sync()
+
+    def _set_attributes(self, room_name: str, attributes: Dict[str, Any]):
+        # Replaced atomically, so that a crash does not leave a partial file
+        path = _attributes_path(self.directory, room_name)
+        with open(path + ".tmp", "w") as f:
+            json.dump(attributes, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def _delete(self, room_name: str):
+        journal_file = self._files.pop(room_name, None)
+        if journal_file is not None:
+            journal_file.file.close()
+        for path in (_journal_path(self.directory, room_name), _attributes_path(self.directory, room_name)):
+            if os.path.exists(path):
+                os.remove(path)
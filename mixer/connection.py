@@ -8,7 +8,9 @@ import logging
 import bpy
 from mixer.bl_utils import get_mixer_prefs
 from mixer.share_data import share_data
-from mixer.broadcaster.common import ClientAttributes, ClientDisconnectedException
+from mixer.broadcaster.common import ClientAttributes, ClientDisconnectedException, MessageType, is_local_host
+import select
+import socket
 import subprocess
 import time
 from pathlib import Path
@@ -19,9 +21,18 @@ from mixer.draw_handlers import remove_draw_handlers
 from mixer.blender_client import SendSceneContentFailed, BlenderClient
 from mixer.handlers import HandlerManager
 
-
 logger = logging.getLogger(__name__)
 
+# Delay in seconds for a local server to accept connections once started
+SERVER_START_TIMEOUT = 10.0
+
+# Room messages handled without experimental sync, the BLENDER_DATA_* messages are dropped by data.build_data_*
+_NON_EXPERIMENTAL_MESSAGE_TYPES = [
+    (MessageType.COMMAND, MessageType.QUERY_OBJECT_DATA),
+    MessageType.CAMERA_ATTRIBUTES,
+    (MessageType.CLEAR_ANIMATIONS, max(MessageType)),
+]
+
 
 def set_client_attributes():
     prefs = get_mixer_prefs()
@@ -43,6 +54,10 @@ def join_room(room_name: str):
     share_data.client.current_room = room_name
     share_data.client._joining_room_name = room_name
     set_client_attributes()
+    if get_mixer_prefs().experimental_sync:
+        share_data.client.subscribe(None)
+    else:
+        share_data.client.subscribe(_NON_EXPERIMENTAL_MESSAGE_TYPES)
     share_data.client.join_room(room_name)
     share_data.client.send_set_current_scene(bpy.context.scene.name_full)
 
@@ -85,16 +100,29 @@ def is_joined():
     return connected and share_data.client.current_room
 
 
-def wait_for_server(host, port):
-    attempts = 0
-    max_attempts = 10
-    while not create_main_client(host, port) and attempts < max_attempts:
-        attempts += 1
-        time.sleep(0.2)
-    return attempts < max_attempts
-
-
-def start_local_server():
+def wait_for_server(host, port, ready_listener: socket.socket):
+    """
+    Wait for the local server started by start_local_server() to notify that it accepts connections, then connect.
+    """
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    with ready_listener:
+        while time.monotonic() < deadline:
+            exit_code = share_data.local_server_process.poll()
+            if exit_code is not None:
+                logger.error("Local server exited with code %s", exit_code)
+                return False
+            readable, _, _ = select.select([ready_listener], [], [], 0.1)
+            if readable:
+                ready_listener.accept()[0].close()
+                return create_main_client(host, port)
+    return False
+
+
+def start_local_server() -> socket.socket:
+    """
+    Start a server on this host, that also listens on a Unix domain socket where supported.
+    Return the socket the server connects to when it accepts connections.
+    """
     import mixer
 
     dir_path = Path(mixer.__file__).parent.parent  # broadcaster is submodule of mixer
@@ -104,17 +132,25 @@ def start_local_server():
     else:
         args = {}
 
+    ready_listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    ready_listener.bind(("127.0.0.1", 0))
+    ready_listener.listen(1)
     share_data.local_server_process = subprocess.Popen(
-        [bpy.app.binary_path_python, "-m", "mixer.broadcaster.apps.server", "--port", str(get_mixer_prefs().port)],
+        [
+            bpy.app.binary_path_python,
+            "-m",
+            "mixer.broadcaster.apps.server",
+            "--port",
+            str(get_mixer_prefs().port),
+            "--local-socket",
+            "--ready-port",
+            str(ready_listener.getsockname()[1]),
+        ],
         cwd=dir_path,
         shell=False,
         **args,
     )
-
-
-def is_localhost(host):
-    # does not catch local address
-    return host == "localhost" or host == "127.0.0.1"
+    return ready_listener
 
 
 def connect():
@@ -127,9 +163,9 @@ def connect():
 
     prefs = get_mixer_prefs()
     if not create_main_client(prefs.host, prefs.port):
-        if is_localhost(prefs.host):
-            start_local_server()
-            if not wait_for_server(prefs.host, prefs.port):
+        if is_local_host(prefs.host):
+            ready_listener = start_local_server()
+            if not wait_for_server(prefs.host, prefs.port, ready_listener):
                 logger.error("Unable to start local server")
                 return False
         else:
@@ -173,16 +173,15 @@ def get_state():
 
 def send_scene():
     get_state()
-    buffer = common.encode_int(len(share_data.shot_manager.shots))
+    writer = common.BufferWriter()
+    writer.write_int(len(share_data.shot_manager.shots))
     for s in share_data.shot_manager.shots:
-        buffer += (
-            common.encode_string(s.name)
-            + common.encode_string(s.camera_name)
-            + common.encode_int(s.start)
-            + common.encode_int(s.end)
-            + common.encode_bool(s.enabled)
-        )
-    share_data.client.add_command(common.Command(common.MessageType.SHOT_MANAGER_CONTENT, buffer, 0))
+        writer.write_string(s.name)
+        writer.write_string(s.camera_name)
+        writer.write_int(s.start)
+        writer.write_int(s.end)
+        writer.write_bool(s.enabled)
+    share_data.client.add_command(common.Command(common.MessageType.SHOT_MANAGER_CONTENT, writer.getbuffer(), 0))
 
 
 def update_scene():
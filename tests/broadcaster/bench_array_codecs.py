@@ -0,0 +1,75 @@
+"""
+Benchmark of the array codecs, on the arrays of a baked mesh.
+
+Compares the per element helpers, decode_vector3_array() and the like, and struct.pack() on unpacked lists, with the
+bulk codecs, encode_floats() and decode_floats(), that decode to memoryview objects on the message data.
+
+python -m tests.broadcaster.bench_array_codecs
+"""
+
+import array
+import struct
+import time
+import tracemalloc
+
+import mixer.broadcaster.common as common
+
+VERTEX_COUNT = 1000 * 1000
+
+# name, per element decoder, bulk typecode, values per item
+ARRAYS = (
+    ("positions", common.decode_vector3_array, "f", 3),
+    ("uvs", common.decode_vector2_array, "f", 2),
+    ("triangles", common.decode_int3_array, "I", 3),
+)
+
+
+def measure(function):
+    # Memory tracing slows allocations down, so time and memory are measured in separate runs
+    start = time.perf_counter()
+    function()
+    duration = time.perf_counter() - start
+
+    tracemalloc.start()
+    result = function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return duration, peak
+
+
+def report(label: str, duration: float, peak: int, reference: float):
+    print(f"  {label:<32} {duration * 1000:9.1f} ms  {peak / 1024 / 1024:8.1f} MB  x{reference / duration:.1f}")
+
+
+def main():
+    print(f"{VERTEX_COUNT} items per array, time / peak memory / speedup")
+    for name, decode_legacy, typecode, item_length in ARRAYS:
+        values = [i % 1000 for i in range(VERTEX_COUNT * item_length)]
+        if typecode == "f":
+            values = [float(v) for v in values]
+        values_array = array.array(typecode, values)
+
+        print(f"{name} ({item_length}{typecode})")
+        reference, peak = measure(
+            lambda: common.int_to_bytes(VERTEX_COUNT, 4) + struct.pack(f"{len(values)}{typecode}", *values)
+        )
+        report("encode struct.pack()", reference, peak, reference)
+        duration, peak = measure(lambda: common.encode_typed_array(values, typecode, item_length))
+        report("encode list, bulk", duration, peak, reference)
+        duration, peak = measure(lambda: common.encode_typed_array(values_array, typecode, item_length))
+        report("encode array.array, bulk", duration, peak, reference)
+
+        data = common.encode_typed_array(values_array, typecode, item_length)
+        reference, peak = measure(lambda: decode_legacy(data, 0))
+        report("decode per element", reference, peak, reference)
+        duration, peak = measure(lambda: common.decode_typed_array(data, 0, typecode, item_length))
+        report("decode bulk, memoryview", duration, peak, reference)
+        duration, peak = measure(
+            lambda: common.group_items(common.decode_typed_array(data, 0, typecode, item_length)[0], item_length)
+        )
+        report("decode bulk, grouped in tuples", duration, peak, reference)
+
+
+if __name__ == "__main__":
+    main()
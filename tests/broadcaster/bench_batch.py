@@ -0,0 +1,74 @@
+"""
+Benchmark of the BATCH messages, on the transforms of an interactive drag broadcast through a server.
+
+Each round, a client sends the transforms of several objects, as the Blender client does at each update, and the other
+clients of the room receive them. Compares clients with and without the batch capability.
+
+python -m tests.broadcaster.bench_batch
+"""
+
+import time
+
+from mixer.broadcaster.apps.server import ENGINES
+import mixer.broadcaster.common as common
+from tests.broadcaster.utils import find_free_port, start_server, connect_client, receive_type
+
+RECEIVER_COUNT = 4
+OBJECT_COUNT = 50
+ROUND_COUNT = 200
+
+
+def measure(engine: str, batch: bool):
+    supported = common.SUPPORTED_CAPABILITIES
+    if not batch:
+        common.SUPPORTED_CAPABILITIES = supported - {common.Capabilities.BATCH}
+    port = find_free_port()
+    server = ENGINES[engine]()
+    server_thread = start_server(server, port)
+    clients = []
+    try:
+        sender = connect_client(port)
+        clients.append(sender)
+        sender.join_room("bench")
+        receive_type(sender, common.MessageType.CONTENT)
+        sender.add_command(common.Command(common.MessageType.CONTENT))
+        sender.fetch_outgoing_commands()
+        receivers = [connect_client(port) for _ in range(RECEIVER_COUNT)]
+        clients.extend(receivers)
+        for receiver in receivers:
+            receiver.join_room("bench")
+            receive_type(receiver, common.MessageType.JOIN_ROOM)
+
+        start = time.perf_counter()
+        for round_index in range(ROUND_COUNT):
+            for i in range(OBJECT_COUNT):
+                data = common.encode_string(f"/Object{i}") + bytes([round_index % 256]) * 192
+                sender.add_command(common.Command(common.MessageType.TRANSFORM, data))
+            sender.fetch_outgoing_commands()
+            for receiver in receivers:
+                count = 0
+                while count < OBJECT_COUNT:
+                    commands = receive_type(receiver, common.MessageType.TRANSFORM)
+                    count += sum(command.type == common.MessageType.TRANSFORM for command in commands)
+        duration = time.perf_counter() - start
+        return duration / ROUND_COUNT, sender.write_statistics
+    finally:
+        for client in clients:
+            client.disconnect()
+        server.shutdown()
+        server_thread.join(5)
+        common.SUPPORTED_CAPABILITIES = supported
+
+
+def main():
+    print(f"{OBJECT_COUNT} transforms per round broadcast to {RECEIVER_COUNT} clients, time per round")
+    for engine in ENGINES:
+        legacy_time, legacy_statistics = measure(engine, batch=False)
+        batch_time, batch_statistics = measure(engine, batch=True)
+        print(f"{engine}")
+        print(f"  one by one {legacy_time * 1000:8.2f} ms  sender: {legacy_statistics}")
+        print(f"  batch      {batch_time * 1000:8.2f} ms  sender: {batch_statistics}  x{legacy_time / batch_time:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark of the memory and CPU cost of one room broadcast, against the number of room members.
+
+Compares the legacy path, where each receiver frames the command with to_byte_buffer(), with the encode-once path,
+where the room frames the command once and all receivers reference the same buffer.
+
+python -m tests.broadcaster.bench_broadcast
+"""
+
+import collections
+import time
+import tracemalloc
+
+from mixer.broadcaster.apps.server import Room, Server
+import mixer.broadcaster.common as common
+
+ROOM_SIZES = (1, 4, 16, 64, 256)
+PAYLOAD_SIZE = 1024 * 1024
+REPEAT = 10
+
+
+class NullConnection:
+    """
+    Room member that frames the commands it receives as a server connection would, without a socket.
+    """
+
+    def __init__(self, server: Server, legacy: bool):
+        self._server = server
+        self.room = None
+        self.unique_id = f"{id(self)}"
+        self.legacy = legacy
+        self.buffers = collections.deque()
+
+    def send_command(self, command: common.Command):
+        pass
+
+    def add_command(self, command: common.Command):
+        if self.legacy:
+            self.buffers.append(memoryview(command.to_byte_buffer()))
+        else:
+            common.frame_commands((command,), self.buffers)
+
+
+class LegacyRoom(Room):
+    def add_command(self, command, sender):
+        # Reproduce the former behavior: the room references the received command as is
+        with self._commands_mutex:
+            self._history.append(command)
+            for connection in self._connections:
+                if connection != sender:
+                    connection.add_command(command)
+
+
+def measure(room_size: int, legacy: bool):
+    server = Server()
+    room_class = LegacyRoom if legacy else Room
+    connections = [NullConnection(server, legacy) for _ in range(room_size + 1)]
+    room = room_class(server, "bench", connections[0])
+    room._connections = connections
+    sender = connections[0]
+
+    payload = common.encode_string("/Mesh") + bytes(PAYLOAD_SIZE)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        room.add_command(common.Command(common.MessageType.MESH, memoryview(payload)), sender)
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return duration / REPEAT, peak / REPEAT
+
+
+def main():
+    print(f"Broadcast of a {PAYLOAD_SIZE // 1024} KB command, per broadcast")
+    print(f"{'receivers':>10} | {'legacy ms':>10} {'legacy MB':>10} | {'once ms':>10} {'once MB':>10}")
+    for room_size in ROOM_SIZES:
+        legacy_time, legacy_memory = measure(room_size, legacy=True)
+        once_time, once_memory = measure(room_size, legacy=False)
+        print(
+            f"{room_size:>10} | {legacy_time * 1000:>10.3f} {legacy_memory / 2 ** 20:>10.2f} | "
+            f"{once_time * 1000:>10.3f} {once_memory / 2 ** 20:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark of the BufferWriter payload builder.
+
+Compares payloads built by concatenating bytes objects, as the encoders did, with payloads built by a BufferWriter,
+for a string array like the materials of a mesh, and for vertex group weights like in encode_base_mesh().
+
+python -m tests.broadcaster.bench_buffer_writer
+"""
+
+import time
+
+import mixer.broadcaster.common as common
+
+SIZES = (1000, 10 * 1000, 100 * 1000)
+
+
+def strings_concatenation(values):
+    buffer = common.encode_int(len(values))
+    for value in values:
+        buffer += common.encode_string(value)
+    return buffer
+
+
+def strings_writer(values):
+    writer = common.BufferWriter()
+    writer.write_string_array(values)
+    return writer.getbuffer()
+
+
+def weights_concatenation(weights):
+    buffer = common.encode_int(len(weights))
+    for index, weight in weights:
+        buffer += common.encode_int(index) + common.encode_float(weight)
+    return buffer
+
+
+def weights_writer(weights):
+    writer = common.BufferWriter()
+    writer.write_int(len(weights))
+    for index, weight in weights:
+        writer.write_int(index)
+        writer.write_float(weight)
+    return writer.getbuffer()
+
+
+# name, values factory, concatenation encoder, writer encoder
+PAYLOADS = (
+    ("strings", lambda size: [f"Material.{i:06}" for i in range(size)], strings_concatenation, strings_writer),
+    ("weights", lambda size: [(i, 0.5) for i in range(size)], weights_concatenation, weights_writer),
+)
+
+
+def measure(function, values) -> float:
+    start = time.perf_counter()
+    function(values)
+    return time.perf_counter() - start
+
+
+def main():
+    print("time with bytes concatenation / with BufferWriter / speedup")
+    for name, make_values, concatenation, writer in PAYLOADS:
+        print(name)
+        for size in SIZES:
+            values = make_values(size)
+            assert concatenation(values) == bytes(writer(values))
+            reference = measure(concatenation, values)
+            duration = measure(writer, values)
+            print(f"  {size:>8} {reference * 1000:9.1f} ms  {duration * 1000:9.1f} ms  x{reference / duration:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Benchmark of the payload compression, per message type.
+
+Reports the compression ratio and the CPU cost of compressing and inflating synthetic payloads shaped like those of
+the Blender client, for the compressions and levels that a compression policy can use, then the byte size of a room
+history made of these messages, without compression and with the policies of COMPRESSION_POLICIES.
+
+python -m tests.broadcaster.bench_compression
+"""
+
+import json
+import math
+import time
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import Compression, MessageType
+
+# Minimum duration of the timed loops, in seconds
+MIN_DURATION = 0.2
+
+SETTINGS = (
+    (Compression.ZLIB, 1),
+    (Compression.ZLIB, 6),
+    (Compression.LZMA, 0),
+    (Compression.LZMA, 6),
+)
+
+
+def baked_mesh(resolution: int = 200) -> bytes:
+    """
+    MESH of a wavy grid, with a single baked mesh like encode_mesh() writes.
+    """
+    positions, normals, uvs, indices = [], [], [], []
+    for i in range(resolution):
+        for j in range(resolution):
+            x, y = i / resolution, j / resolution
+            positions.extend((x, y, 0.1 * math.sin(10 * x) * math.cos(10 * y)))
+            normals.extend((0.0, 0.0, 1.0))
+            uvs.extend((x, y))
+    for i in range(resolution - 1):
+        for j in range(resolution - 1):
+            v = i * resolution + j
+            indices.extend((v, v + 1, v + resolution, v + 1, v + resolution + 1, v + resolution))
+
+    writer = common.BufferWriter()
+    writer.write_string("/Grid")
+    writer.write_string("Grid")
+    writer.write_int(0)
+    offset = writer.reserve_int()
+    writer.write_floats(positions, 3)
+    writer.write_floats(normals, 3)
+    writer.write_floats(uvs, 2)
+    writer.write_uints([0, len(indices) // 3], 2)
+    writer.write_uints(indices, 3)
+    writer.patch_size(offset)
+    writer.write_string_array(["Material"])
+    writer.write_array([1], "I")
+    writer.write_string("")
+    return bytes(writer.getbuffer())
+
+
+def grease_pencil_mesh(stroke_count: int = 200, point_count: int = 100) -> bytes:
+    writer = common.BufferWriter()
+    writer.write_string("Stroke")
+    writer.write_int(1)
+    writer.write_string("Black")
+    writer.write_int(1)
+    writer.write_string("Lines")
+    writer.write_bool(False)
+    writer.write_int(1)
+    writer.write_int(1)
+    writer.write_int(stroke_count)
+    for stroke in range(stroke_count):
+        writer.write_int(0)
+        writer.write_int(10)
+        points = []
+        for point in range(point_count):
+            t = point / point_count
+            points.extend((math.cos(t + stroke), 0.0, math.sin(t * stroke), 1.0 - t, 1.0))
+        writer.write_floats(points, 5)
+    return bytes(writer.getbuffer())
+
+
+def camera_animation(key_count: int = 2000) -> bytes:
+    writer = common.BufferWriter()
+    writer.write_string("/Camera")
+    writer.write_string("lens")
+    writer.write_int(-1)
+    writer.write_int(key_count)
+    writer.write_array(range(1, key_count + 1), "i")
+    writer.write_array([50.0 + 10 * math.sin(i / 50) for i in range(key_count)], "f")
+    return bytes(writer.getbuffer())
+
+
+def blender_data_update(attribute_count: int = 300) -> bytes:
+    """
+    BLENDER_DATA_UPDATE of a proxy, like json_codec.Codec encodes it.
+    """
+    data = {"mixer_uuid": "7d9a6c1e-0b5e-4c6f-9a0e-2f1b3c4d5e6f", "name": "Material.001"}
+    for i in range(attribute_count):
+        data[f"attribute_{i}"] = {
+            "__bpy_proxy_class__": "BpyStructProxy",
+            "_data": {"default_value": [0.8, 0.8, 0.8, 1.0], "enabled": True, "name": f"Input {i}", "type": "RGBA"},
+        }
+    proxy = {"__bpy_proxy_class__": "BpyIDProxy", "_data": data, "_blenddata_path": ["materials", "Material.001"]}
+    return common.encode_string(json.dumps(proxy))
+
+
+def shot_manager_content(shot_count: int = 100) -> bytes:
+    writer = common.BufferWriter()
+    writer.write_int(shot_count)
+    for i in range(shot_count):
+        writer.write_string(f"Shot_{i:03}")
+        writer.write_string(f"Camera_{i % 5}")
+        writer.write_int(1 + 50 * i)
+        writer.write_int(50 + 50 * i)
+        writer.write_bool(True)
+    return bytes(writer.getbuffer())
+
+
+PAYLOADS = (
+    (MessageType.MESH, baked_mesh),
+    (MessageType.GREASE_PENCIL_MESH, grease_pencil_mesh),
+    (MessageType.CAMERA_ANIMATION, camera_animation),
+    (MessageType.BLENDER_DATA_UPDATE, blender_data_update),
+    (MessageType.SHOT_MANAGER_CONTENT, shot_manager_content),
+)
+
+
+def timed(function) -> float:
+    """
+    Return the duration of a call to function, averaged over calls during MIN_DURATION.
+    """
+    count = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        count += 1
+        duration = time.perf_counter() - start
+        if duration >= MIN_DURATION:
+            return duration / count
+
+
+def main():
+    print("ratio (uncompressed / compressed size), compression and inflation throughput of the uncompressed data")
+    payloads = []
+    for message_type, make_payload in PAYLOADS:
+        data = make_payload()
+        payloads.append((message_type, data))
+        print(f"{message_type.name} ({len(data)} bytes)")
+        for compression, level in SETTINGS:
+            payload = common.compress_payload(data, compression, level)
+            compress_time = timed(lambda: common.compress_payload(data, compression, level))
+            inflate_time = timed(lambda: common.decompress_payload(payload, compression))
+            megabytes = len(data) / 1024 / 1024
+            print(
+                f"  {compression.name:<4} {level}  x{len(data) / len(payload):5.1f}  "
+                f"{megabytes / compress_time:7.1f} MiB/s  {megabytes / inflate_time:7.1f} MiB/s"
+            )
+
+    commands = [common.Command(message_type, data) for message_type, data in payloads]
+    raw_size = sum(command.byte_size() for command in commands)
+    start = time.perf_counter()
+    compressed = [common.compress_command(command) for command in commands]
+    duration = time.perf_counter() - start
+    compressed_size = sum(command.byte_size() for command in compressed)
+    print(
+        f"Room history with the compression policies: {raw_size} bytes, {compressed_size} bytes compressed "
+        f"(x{raw_size / compressed_size:.1f}) in {duration * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
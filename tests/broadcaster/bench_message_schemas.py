@@ -0,0 +1,136 @@
+"""
+Benchmark of the message schemas.
+
+Compares the encoding and decoding of messages with chains of encode_* and decode_* helpers, as the Blender client did,
+with the precomputed struct codecs of the message schemas.
+
+python -m tests.broadcaster.bench_message_schemas
+"""
+
+import timeit
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import MessageType
+
+MESSAGE_COUNT = 100 * 1000
+
+
+class Matrix:
+    def __init__(self):
+        self.col = [[float(4 * i + j) for j in range(4)] for i in range(4)]
+
+
+class Vector:
+    def __init__(self, x: float, y: float, z: float):
+        self.x, self.y, self.z = x, y, z
+
+    def __iter__(self):
+        return iter((self.x, self.y, self.z))
+
+
+MATRIX = Matrix()
+OFFSET = Vector(1.0, 2.0, 3.0)
+
+
+def encode_transform():
+    return (
+        common.encode_string("/Parent/Cube")
+        + common.encode_matrix(MATRIX)
+        + common.encode_matrix(MATRIX)
+        + common.encode_matrix(MATRIX)
+    )
+
+
+def decode_transform(data):
+    path, index = common.decode_string(data, 0)
+    parent_inverse_matrix, index = common.decode_matrix(data, index)
+    basis_matrix, index = common.decode_matrix(data, index)
+    local_matrix, index = common.decode_matrix(data, index)
+    return path, parent_inverse_matrix, basis_matrix, local_matrix
+
+
+def encode_camera():
+    return (
+        common.encode_string("/Camera")
+        + common.encode_string("Camera")
+        + common.encode_float(50.0)
+        + common.encode_float(0.1)
+        + common.encode_float(100.0)
+        + common.encode_float(2.8)
+        + common.encode_int(0)
+        + common.encode_float(36.0)
+        + common.encode_float(24.0)
+    )
+
+
+def decode_camera(data):
+    values = []
+    value, index = common.decode_string(data, 0)
+    values.append(value)
+    value, index = common.decode_string(data, index)
+    values.append(value)
+    for decode in (common.decode_float,) * 4 + (common.decode_int,) + (common.decode_float,) * 2:
+        value, index = decode(data, index)
+        values.append(value)
+    return values
+
+
+def encode_collection():
+    return (
+        common.encode_string("Collection")
+        + common.encode_bool(True)
+        + common.encode_vector3(OFFSET)
+        + common.encode_bool(True)
+    )
+
+
+def decode_collection(data):
+    name, index = common.decode_string(data, 0)
+    visible, index = common.decode_bool(data, index)
+    offset, index = common.decode_vector3(data, index)
+    temporary_visibility, index = common.decode_bool(data, index)
+    return name, visible, offset, temporary_visibility
+
+
+def encode_link():
+    return common.encode_string("Scene") + common.encode_string("Cube")
+
+
+def decode_link(data):
+    scene_name, index = common.decode_string(data, 0)
+    object_name, _ = common.decode_string(data, index)
+    return scene_name, object_name
+
+
+# message type, helper encoder and decoder, schema values
+MESSAGES = (
+    (MessageType.TRANSFORM, encode_transform, decode_transform, ("/Parent/Cube", MATRIX, MATRIX, MATRIX)),
+    (MessageType.CAMERA, encode_camera, decode_camera, ("/Camera", "Camera", 50.0, 0.1, 100.0, 2.8, 0, 36.0, 24.0)),
+    (MessageType.COLLECTION, encode_collection, decode_collection, ("Collection", True, OFFSET, True)),
+    (MessageType.ADD_OBJECT_TO_SCENE, encode_link, decode_link, ("Scene", "Cube")),
+)
+
+
+def report(label: str, helpers: float, schema: float):
+    per_message = 1000 * 1000 * 1000 / MESSAGE_COUNT
+    print(f"  {label:<8} {helpers * per_message:8.0f} ns  {schema * per_message:8.0f} ns  x{helpers / schema:.1f}")
+
+
+def main():
+    print(f"{MESSAGE_COUNT} messages, time per message with the helpers / with the schema / speedup")
+    for message_type, encode, decode, values in MESSAGES:
+        schema = common.MESSAGE_SCHEMAS[message_type]
+        data = encode()
+        assert schema.encode(*values) == data
+
+        print(message_type.name)
+        helpers = timeit.timeit(encode, number=MESSAGE_COUNT)
+        schema_time = timeit.timeit(lambda: schema.encode(*values), number=MESSAGE_COUNT)
+        report("encode", helpers, schema_time)
+        helpers = timeit.timeit(lambda: decode(data), number=MESSAGE_COUNT)
+        schema_time = timeit.timeit(lambda: schema.decode(data), number=MESSAGE_COUNT)
+        report("decode", helpers, schema_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark of the server side save and load of a room file, against the client side download and upload.
+
+The room holds ROOM_BYTE_SIZE bytes of MESH commands about different objects, that are never compacted.
+
+python -m tests.broadcaster.bench_room_file
+"""
+
+import os
+import tempfile
+import time
+
+from mixer.broadcaster.apps.server import SelectorServer
+import mixer.broadcaster.common as common
+import mixer.broadcaster.room_bake as room_bake
+from tests.broadcaster.utils import find_free_port, start_server, connect_client, receive_type
+
+ROOM_BYTE_SIZE = 1024 * 1024 * 1024
+PAYLOAD_SIZE = 64 * 1024
+
+
+def request(client, message_type: common.MessageType, room_name: str, file_name: str) -> float:
+    start = time.perf_counter()
+    client.send_command(common.Command(message_type, common.encode_string(room_name) + common.encode_string(file_name)))
+    received = receive_type(client, message_type, timeout=600)
+    assert common.MessageType.SEND_ERROR not in [c.type for c in received]
+    return time.perf_counter() - start
+
+
+def main():
+    command_count = ROOM_BYTE_SIZE // PAYLOAD_SIZE
+    port = find_free_port()
+    server = SelectorServer()
+    server_thread = start_server(server, port)
+    client = connect_client(port)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "room.mixer")
+            commands = [
+                common.Command(common.MessageType.MESH, common.encode_string(f"/Mesh{i}") + bytes(PAYLOAD_SIZE))
+                for i in range(command_count)
+            ]
+            room_bake.save_room({}, commands, file_path)
+            del commands
+            print(f"Room of {command_count} commands, {os.path.getsize(file_path) / 2 ** 20:.0f} MB")
+            # Room files are only opened in the rooms directory
+            server.rooms_directory = directory
+
+            load_time = request(client, common.MessageType.LOAD_ROOM, "room", "room.mixer")
+            print(f"{'load':>10} | {load_time:>8.2f} s")
+            os.remove(file_path)
+            save_time = request(client, common.MessageType.SAVE_ROOM, "room", "room.mixer")
+            print(f"{'save':>10} | {save_time:>8.2f} s")
+
+            # The room is loaded from its snapshot by the first joining client
+            start = time.perf_counter()
+            client.join_room("room")
+            receive_type(client, common.MessageType.JOIN_ROOM, timeout=600)
+            print(f"{'join':>10} | {time.perf_counter() - start:>8.2f} s")
+    finally:
+        client.disconnect()
+        server.shutdown()
+        server_thread.join()
+
+
+if __name__ == "__main__":
+    main()
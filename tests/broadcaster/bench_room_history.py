@@ -0,0 +1,69 @@
+"""
+Benchmark of the server memory used by the room history, per million commands.
+
+Compares the legacy storage, a list with one FramedCommand and its frame buffer per command, with the frame arena.
+The commands are keyframe additions, that are never compacted, so that the history of both storages holds all of them.
+
+python -m tests.broadcaster.bench_room_history
+"""
+
+import time
+import tracemalloc
+from typing import List, Optional
+
+from mixer.broadcaster.room_history import RoomHistory
+import mixer.broadcaster.common as common
+
+COMMAND_COUNT = 1000 * 1000
+PAYLOAD_SIZES = (16, 192)
+
+
+class LegacyHistory:
+    """
+    Reproduce the former storage of the room history.
+    """
+
+    def __init__(self):
+        self._commands: List[Optional[common.Command]] = []
+        self._sequences: List[int] = []
+        self._origins: List[Optional[str]] = []
+
+    def append(self, command: common.Command, origin: Optional[str] = None) -> int:
+        command = common.FramedCommand(command)
+        command.set_id(len(self._commands) + 1)
+        self._commands.append(command)
+        self._sequences.append(command.id)
+        self._origins.append(origin)
+        return command.id
+
+
+def measure(payload_size: int, legacy: bool):
+    payload = bytes(payload_size)
+    origin = "0" * 32
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    history = LegacyHistory() if legacy else RoomHistory()
+    for i in range(COMMAND_COUNT):
+        command = common.Command(common.MessageType.ADD_KEYFRAME, common.encode_string(f"/Object{i % 1000}") + payload)
+        history.append(command, origin)
+    duration = time.perf_counter() - start
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, memory * 1000 * 1000 / COMMAND_COUNT
+
+
+def main():
+    print(f"Room history of {COMMAND_COUNT} commands, per million commands")
+    print(f"{'payload':>10} | {'legacy s':>10} {'legacy MB':>10} | {'arena s':>10} {'arena MB':>10}")
+    for payload_size in PAYLOAD_SIZES:
+        legacy_time, legacy_memory = measure(payload_size, legacy=True)
+        arena_time, arena_memory = measure(payload_size, legacy=False)
+        print(
+            f"{payload_size:>10} | {legacy_time:>10.2f} {legacy_memory / 2 ** 20:>10.1f} | "
+            f"{arena_time:>10.2f} {arena_memory / 2 ** 20:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark of the broadcast throughput of busy rooms, against the number of worker processes.
+
+Each room has a sender that sends TRANSFORM commands as fast as the server reads them, and a receiver that reads them.
+The throughput is the number of commands received by all receivers per second. Scaling with the number of workers
+requires at least as many cores as workers, plus the cores used by the bench clients.
+
+python -m tests.broadcaster.bench_supervisor
+"""
+
+import multiprocessing
+import os
+import time
+
+from mixer.broadcaster.apps.server import SelectorServer
+from mixer.broadcaster.apps.supervisor import Supervisor, room_worker
+import mixer.broadcaster.common as common
+from tests.broadcaster.utils import find_free_port, start_server, connect_client, receive_type, receive_until
+
+ROOM_COUNT = 8
+WORKER_COUNTS = (0, 1, 2, 4, 8)  # 0 for a single process
+DURATION = 5.0
+BATCH_SIZE = 100
+
+
+def room_names(worker_count: int):
+    """
+    Return ROOM_COUNT room names spread evenly on the workers.
+    """
+    names = []
+    i = 0
+    while len(names) < ROOM_COUNT:
+        name = f"room{i}"
+        if worker_count == 0 or room_worker(name, worker_count) == len(names) % worker_count:
+            names.append(name)
+        i += 1
+    return names
+
+
+def run_room(port: int, room_name: str, start_time: float, results):
+    sender = connect_client(port)
+    sender.join_room(room_name)
+    receive_type(sender, common.MessageType.CONTENT, timeout=30)
+    sender.send_command(common.Command(common.MessageType.CONTENT))
+
+    def _joinable(command):
+        if command.type != common.MessageType.ROOM_UPDATE:
+            return False
+        attributes = common.decode_json(command.data, 0)[0].get(room_name, {})
+        return attributes.get(common.RoomAttributes.JOINABLE, False)
+
+    receive_until(sender, _joinable, timeout=30)
+    receiver = connect_client(port)
+    receiver.join_room(room_name)
+    receive_type(receiver, common.MessageType.JOIN_ROOM, timeout=30)
+
+    while time.time() < start_time:
+        time.sleep(0.01)
+    command = common.Command(common.MessageType.TRANSFORM, common.encode_string("/Cube") + bytes(64))
+    received = 0
+    deadline = time.time() + DURATION
+    while time.time() < deadline:
+        for _ in range(BATCH_SIZE):
+            sender.add_command(command)
+        sender.fetch_outgoing_commands()
+        sender.fetch_incoming_commands()
+        received += sum(1 for c in receiver.fetch_incoming_commands() if c.type == common.MessageType.TRANSFORM)
+    results.put(received)
+    sender.disconnect()
+    receiver.disconnect()
+
+
+def measure(worker_count: int) -> float:
+    port = find_free_port()
+    server = Supervisor(worker_count) if worker_count > 0 else SelectorServer()
+    server_thread = start_server(server, port)
+    # One process per room, so that the clients are not the bottleneck
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    start_time = time.time() + 5
+    processes = [
+        context.Process(target=run_room, args=(port, name, start_time, results)) for name in room_names(worker_count)
+    ]
+    for process in processes:
+        process.start()
+    received = sum(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    server.shutdown()
+    server_thread.join()
+    return received / DURATION
+
+
+def main():
+    print(f"{ROOM_COUNT} busy rooms, {os.cpu_count()} cores, commands received per second")
+    print(f"{'workers':>10} | {'commands/s':>12} {'speedup':>10}")
+    reference = None
+    for worker_count in WORKER_COUNTS:
+        throughput = measure(worker_count)
+        if reference is None:
+            reference = throughput
+        print(f"{worker_count:>10} | {throughput:>12.0f} {throughput / reference:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+import array
+import collections
+import logging
+import mmap
+import os
+import socket
+import struct
+import tempfile
+import threading
+import unittest
+
+import mixer.broadcaster.common as common
+
+
+class TestFrameReader(unittest.TestCase):
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def read(self, reader, expected_count):
+        commands = []
+        while len(commands) < expected_count:
+            reader.recv(self.receiver)
+            commands.extend(reader.commands())
+        return commands
+
+    def test_many_frames_per_recv(self):
+        sent = [common.Command(common.MessageType.TRANSFORM, common.encode_string(f"/Cube{i}")) for i in range(50)]
+        self.sender.sendall(b"".join(command.to_byte_buffer() for command in sent))
+
+        reader = common.FrameReader()
+        reader.recv(self.receiver)
+        received = reader.commands()
+        self.assertEqual(len(received), len(sent))
+        for s, r in zip(sent, received):
+            self.assertIsInstance(r.data, memoryview)
+            self.assertEqual(r.type, s.type)
+            self.assertEqual(r.id, s.id)
+            self.assertEqual(bytes(r.data), s.data)
+            self.assertEqual(common.decode_string(r.data, 0)[0], common.decode_string(s.data, 0)[0])
+
+    def test_split_frames(self):
+        sent = [common.Command(common.MessageType.MESH, bytes([i]) * (i * 7)) for i in range(1, 30)]
+        buffer = b"".join(command.to_byte_buffer() for command in sent)
+
+        # A small buffer size forces incomplete frames to move to new buffers
+        reader = common.FrameReader(buffer_size=64)
+        received = []
+        for i in range(0, len(buffer), 5):
+            self.sender.sendall(buffer[i : i + 5])
+            reader.recv(self.receiver)
+            received.extend(reader.commands())
+
+        self.assertEqual([bytes(command.data) for command in received], [command.data for command in sent])
+
+    def test_frame_larger_than_buffer(self):
+        data = bytes(range(256)) * 4096
+        sent = [common.Command(common.MessageType.TEXTURE, data), common.Command(common.MessageType.FRAME, b"1234")]
+        buffer = b"".join(command.to_byte_buffer() for command in sent)
+
+        reader = common.FrameReader(buffer_size=1024)
+        sender_thread = threading.Thread(None, self.sender.sendall, args=(buffer,))
+        sender_thread.start()
+        received = self.read(reader, 2)
+        sender_thread.join()
+
+        self.assertEqual(bytes(received[0].data), data)
+        self.assertEqual(bytes(received[1].data), b"1234")
+
+    def test_fragments(self):
+        large = common.Command(common.MessageType.MESH, bytes(range(256)) * 100)
+        framed = common.FramedCommand(common.Command(common.MessageType.TEXTURE, bytes(range(100)) * 50))
+        transform = common.Command(common.MessageType.TRANSFORM, common.encode_string("/Cube"))
+        sent = []
+        for command in (large, framed):
+            for begin in range(0, command.byte_size(), 1000):
+                end = min(begin + 1000, command.byte_size())
+                sent.append(common.Command(common.MessageType.FRAGMENT, common.frame_slice(command, begin, end)))
+                sent.append(transform)
+        self.sender.sendall(b"".join(bytes(command.to_byte_buffer()) for command in sent))
+
+        received = self.read(common.FrameReader(), len(sent) // 2 + 2)
+        self.assertEqual([command.type for command in received[-2:]], [common.MessageType.TEXTURE, transform.type])
+        reassembled = [command for command in received if command.type != common.MessageType.TRANSFORM]
+        self.assertEqual(len(reassembled), 2)
+        for s, r in zip((large, framed), reassembled):
+            self.assertEqual((r.type, r.id, bytes(r.data)), (s.type, s.id, bytes(s.data)))
+
+    def test_disconnect(self):
+        reader = common.FrameReader()
+        self.sender.close()
+        with self.assertRaises(common.ClientDisconnectedException):
+            reader.recv(self.receiver)
+
+
+class TestWriteMessages(unittest.TestCase):
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def test_coalesced_writes(self):
+        sent = [common.Command(common.MessageType.TRANSFORM, common.encode_string(f"/Cube{i}")) for i in range(100)]
+        sent.append(common.Command(common.MessageType.PLAY))
+        statistics = common.WriteStatistics()
+        common.write_messages(self.sender, sent, statistics)
+
+        self.assertEqual(statistics.message_count, len(sent))
+        self.assertEqual(statistics.byte_count, sum(command.byte_size() for command in sent))
+        self.assertLess(statistics.syscall_count, len(sent))
+
+        reader = common.FrameReader()
+        received = []
+        while len(received) < len(sent):
+            reader.recv(self.receiver)
+            received.extend(reader.commands())
+        self.assertEqual([bytes(command.data) for command in received], [command.data for command in sent])
+
+    def test_file_frames(self):
+        framed = [common.Command(common.MessageType.MESH, common.encode_string(f"/M{i}")) for i in range(10)]
+        with tempfile.TemporaryFile() as file:
+            for command in framed:
+                file.write(command.to_byte_buffer())
+            file.flush()
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            sent = [common.Command(common.MessageType.CLEAR_CONTENT), common.FileFrames(file, buffer, len(framed))]
+            sent.append(common.Command(common.MessageType.JOIN_ROOM, common.encode_string("room")))
+            common.write_messages(self.sender, sent)
+
+            reader = common.FrameReader()
+            received = []
+            while len(received) < 12:
+                reader.recv(self.receiver)
+                received.extend(reader.commands())
+            expected = [sent[0]] + framed + [sent[-1]]
+            self.assertEqual([(c.type, bytes(c.data)) for c in received], [(c.type, bytes(c.data)) for c in expected])
+            buffer.close()
+
+    def test_partial_send(self):
+        self.sender.setblocking(False)
+        buffers = collections.deque()
+        payload = b"x" * (8 * 1024 * 1024)
+        common.frame_commands([common.Command(common.MessageType.TEXTURE, payload)], buffers)
+        total_size = sum(len(buffer) for buffer in buffers)
+
+        # The socket buffer cannot hold the payload, so the first write is partial
+        self.assertTrue(common.send_buffers(self.sender, buffers))
+        remaining_size = sum(len(buffer) for buffer in buffers)
+        self.assertGreater(remaining_size, 0)
+        self.assertLess(remaining_size, total_size)
+        self.assertFalse(common.send_buffers(self.sender, buffers))
+
+
+class TestArrayCodecs(unittest.TestCase):
+    def test_wire_format(self):
+        # The bulk codecs encode and decode the same bytes as the per element helpers
+        positions = [float(i) for i in range(12)]
+        encoded = common.encode_floats(positions, 3)
+        self.assertEqual(encoded, common.int_to_bytes(4, 4) + struct.pack("12f", *positions))
+        self.assertEqual(common.encode_floats(array.array("f", positions), 3), encoded)
+        self.assertEqual(common.encode_floats(memoryview(array.array("f", positions)), 3), encoded)
+
+        view, index = common.decode_floats(encoded, 0, 3)
+        self.assertEqual(index, len(encoded))
+        self.assertEqual(view.tolist(), positions)
+        self.assertEqual(common.group_items(view, 3), common.decode_vector3_array(encoded, 0)[0])
+
+        indices = [1, 2, 3, 4, 5, 6]
+        encoded = common.encode_uints(indices, 2)
+        self.assertEqual(common.group_items(common.decode_uints(encoded, 0, 2)[0], 2), [(1, 2), (3, 4), (5, 6)])
+        self.assertEqual(common.decode_int2_array(encoded, 0)[0], [(1, 2), (3, 4), (5, 6)])
+
+    def test_decode_shares_data(self):
+        payload = common.encode_string("/Mesh") + common.encode_floats([1.0, 2.0]) + common.encode_uints([])
+        # An odd offset in a received frame, whose values are not aligned
+        data = memoryview(b"x" + payload)[1:]
+        path, index = common.decode_string(data, 0)
+        values, index = common.decode_floats(data, index)
+        self.assertEqual(values.tolist(), [1.0, 2.0])
+        self.assertIs(values.obj, data.obj)
+        values, index = common.decode_uints(data, index)
+        self.assertEqual((len(values), index), (0, len(payload)))
+
+        values, index = common.unpack_array(data, len(payload) - 12, "f", 2)
+        self.assertEqual((values.tolist(), index), ([1.0, 2.0], len(payload) - 4))
+        self.assertRaises(ValueError, common.unpack_array, data, len(payload) - 4, "f", 2)
+        self.assertRaises(ValueError, common.decode_floats, common.encode_floats([1.0, 2.0])[:-1], 0)
+
+
+class Matrix:
+    """
+    The part of mathutils.Matrix used by the codecs.
+    """
+
+    def __init__(self, first_value: float):
+        self.col = [[first_value + 4 * i + j for j in range(4)] for i in range(4)]
+
+
+class Vector:
+    def __init__(self, x: float, y: float, z: float):
+        self.x, self.y, self.z = x, y, z
+
+    def __iter__(self):
+        return iter((self.x, self.y, self.z))
+
+
+class TestMessageSchemas(unittest.TestCase):
+    def test_same_payload_as_helpers(self):
+        MessageType = common.MessageType
+        matrices = [Matrix(0.0), Matrix(16.0), Matrix(32.0)]
+        transform = common.encode_string("/Parent/Cube") + b"".join(common.encode_matrix(m) for m in matrices)
+        self.assertEqual(common.encode_message(MessageType.TRANSFORM, "/Parent/Cube", *matrices), transform)
+
+        light = (
+            common.encode_string("/Light")
+            + common.encode_string("Lumière")
+            + common.encode_int(common.LightType.SPOT.value)
+            + common.encode_int(True)
+            + common.encode_color((1.0, 0.5, 0.25))
+            + common.encode_float(100.0)
+            + common.encode_float(0.75)
+            + common.encode_float(0.15)
+        )
+        encoded = common.encode_message(
+            MessageType.LIGHT,
+            "/Light",
+            "Lumière",
+            common.LightType.SPOT.value,
+            True,
+            (1.0, 0.5, 0.25),
+            100.0,
+            0.75,
+            0.15,
+        )
+        self.assertEqual(encoded, light)
+
+        collection = (
+            common.encode_string("Collection")
+            + common.encode_bool(True)
+            + common.encode_vector3(Vector(1.0, 2.0, 3.0))
+            + common.encode_bool(False)
+        )
+        encoded = common.encode_message(MessageType.COLLECTION, "Collection", True, Vector(1.0, 2.0, 3.0), False)
+        self.assertEqual(encoded, collection)
+
+        self.assertEqual(common.encode_message(MessageType.FRAME, 42), common.encode_int(42))
+        self.assertEqual(
+            common.encode_message(MessageType.ADD_OBJECT_TO_SCENE, "Scene", "Cube"),
+            common.encode_string("Scene") + common.encode_string("Cube"),
+        )
+
+    def test_round_trip(self):
+        MessageType = common.MessageType
+        matrices = [tuple(tuple(column) for column in Matrix(first_value).col) for first_value in (0.0, 16.0, 32.0)]
+        # Values in their decoded form
+        messages = {
+            MessageType.TRANSFORM: ("/Cube", *matrices),
+            MessageType.CAMERA: ("/Camera", "Camera", 50.0, 0.125, 100.0, 2.5, 1, 36.0, 24.0),
+            MessageType.LIGHT: ("/Light", "Light", 2, 0, (1.0, 1.0, 0.5, 1.0), 10.0, 0.0, 10.0),
+            MessageType.FRAME: (-3,),
+            MessageType.COLLECTION: ("Collection", False, (0.5, 0.0, -1.0), True),
+            MessageType.SCENE_RENAMED: ("Scène", ""),
+        }
+        for message_type, values in messages.items():
+            with self.subTest(message_type=message_type):
+                payload = common.encode_message(message_type, *values)
+                # An odd offset in a received frame
+                data = memoryview(b"x" + payload + b"next")[1:]
+                decoded, index = common.decode_message(message_type, data)
+                self.assertEqual((tuple(decoded), index), (values, len(payload)))
+
+        decoded, _ = common.decode_message(
+            MessageType.CAMERA, common.encode_message(MessageType.CAMERA, *messages[MessageType.CAMERA])
+        )
+        self.assertEqual((decoded.name, decoded.sensor_fit), ("Camera", 1))
+
+    def test_errors_and_struct_cache(self):
+        schema = common.MESSAGE_SCHEMAS[common.MessageType.SCENE_RENAMED]
+        self.assertRaises(TypeError, schema.encode, "only one name")
+        payload = schema.encode(old_name="a", new_name="b")
+        self.assertRaises(struct.error, schema.decode, payload[:3])
+
+        for i in range(schema.MAX_CACHED_STRUCT_COUNT + 10):
+            self.assertEqual(schema.decode(schema.encode("a" * i, "b"))[0], ("a" * i, "b"))
+        self.assertLessEqual(len(schema._structs), schema.MAX_CACHED_STRUCT_COUNT)
+
+
+class TestBufferWriter(unittest.TestCase):
+    def test_same_payload_as_helpers(self):
+        writer = common.BufferWriter()
+        writer.write_string("Lumière")
+        writer.write_bool(True)
+        writer.write_int(-3)
+        writer.write_float(0.5)
+        writer.write_json({"a": [1, 2]})
+        writer.write_string_array(["a", "bé", ""])
+        writer.write_vector3((1.0, 2.0, 3.0))
+        writer.write_vector4((1.0, 2.0, 3.0, 4.0))
+        writer.write_color((1.0, 0.5, 0.25))
+        writer.write_matrix(Matrix(0.0))
+        writer.write_floats([1.0, 2.0, 3.0, 4.0], 2)
+        writer.write_message(common.MessageType.SCENE_RENAMED, "Scène", "Scene")
+        expected = (
+            common.encode_string("Lumière")
+            + common.encode_bool(True)
+            + common.encode_int(-3)
+            + common.encode_float(0.5)
+            + common.encode_json({"a": [1, 2]})
+            + common.encode_string_array(["a", "bé", ""])
+            + common.encode_vector3(Vector(1.0, 2.0, 3.0))
+            + common.encode_vector4((1.0, 2.0, 3.0, 4.0))
+            + common.encode_color((1.0, 0.5, 0.25))
+            + common.encode_matrix(Matrix(0.0))
+            + common.encode_floats([1.0, 2.0, 3.0, 4.0], 2)
+            + common.encode_message(common.MessageType.SCENE_RENAMED, "Scène", "Scene")
+        )
+        self.assertEqual(bytes(writer.getbuffer()), expected)
+        self.assertEqual(len(writer), len(expected))
+
+    def test_write_array(self):
+        values = [1, 2, 3]
+        expected = common.pack_array(values, "I")
+        for data in (values, array.array("I", values), memoryview(array.array("I", values)), array.array("i", values)):
+            with self.subTest(data=data):
+                writer = common.BufferWriter()
+                writer.write_array(data, "I")
+                self.assertEqual(bytes(writer.getbuffer()), expected)
+
+    def test_reserve_and_patch(self):
+        writer = common.BufferWriter()
+        writer.write_string("/Mesh")
+        offset = writer.reserve_int()
+        writer.write_string("nested")
+        writer.write_float(1.0)
+        writer.patch_size(offset)
+        count_offset = writer.reserve_int()
+        writer.patch_int(count_offset, -1)
+
+        data = writer.getbuffer()
+        path, index = common.decode_string(data, 0)
+        size, index = common.decode_int(data, index)
+        self.assertEqual((path, size), ("/Mesh", len(common.encode_string("nested")) + 4))
+        self.assertEqual(common.decode_int(data, index + size), (-1, len(data)))
+
+    def test_getbuffer_does_not_copy(self):
+        writer = common.BufferWriter()
+        writer.write_int(1)
+        data = writer.getbuffer()
+        self.assertIs(data.obj, writer._buffer)
+        # Patches are still allowed, and visible through the memoryview
+        writer.patch_int(0, 2)
+        self.assertEqual(common.decode_int(data, 0)[0], 2)
+        # The framing layer sends it as is
+        command = common.Command(common.MessageType.FRAME, data, 0)
+        self.assertIs(memoryview(command.data).obj, writer._buffer)
+
+
+class TestCompression(unittest.TestCase):
+    def test_payloads(self):
+        data = common.encode_string("/Cube") + bytes(range(256)) * 64
+        for compression in (common.Compression.ZLIB, common.Compression.LZMA):
+            with self.subTest(compression=compression):
+                payload = common.compress_payload(data, compression, 1)
+                self.assertLess(len(payload), len(data))
+                self.assertEqual(common.decompress_payload(memoryview(payload), compression), data)
+                self.assertEqual(common.decompress_payload(payload, compression, 9), data[:9])
+                self.assertRaises(ValueError, common.decompress_payload, payload[:-4], compression)
+                self.assertRaises(ValueError, common.decompress_payload, payload[:4], compression)
+
+    def test_compression_policy(self):
+        min_size, compression, _ = common.COMPRESSION_POLICIES[common.MessageType.MESH]
+        mesh = common.Command(common.MessageType.MESH, common.encode_string("/Cube") + bytes(min_size))
+        compressed = common.compress_command(mesh)
+        self.assertEqual((compressed.type, compressed.id, compressed.compression), (mesh.type, mesh.id, compression))
+        self.assertEqual(bytes(common.decompress_command(compressed).data), mesh.data)
+
+        small = common.Command(common.MessageType.MESH, bytes(min_size - 1))
+        self.assertIs(common.compress_command(small), small)
+        incompressible = common.Command(common.MessageType.MESH, os.urandom(min_size))
+        self.assertIs(common.compress_command(incompressible), incompressible)
+        transform = common.Command(common.MessageType.TRANSFORM, bytes(100000))
+        self.assertIs(common.compress_command(transform), transform)
+        self.assertIs(common.decompress_command(transform), transform)
+
+        self.assertEqual(bytes(common.payload_prefix(compressed, 9)), mesh.data[:9])
+        self.assertEqual(bytes(common.payload_prefix(mesh, 9)), mesh.data[:9])
+
+    def test_frames(self):
+        mesh = common.Command(common.MessageType.MESH, common.encode_string("/Cube") + bytes(100000))
+        compressed = common.compress_command(mesh)
+        self.assertEqual(common.decode_frame_header(compressed.frame_header())[2], compressed.frame_type())
+
+        reader = common.FrameReader()
+        received = reader.feed(compressed.to_byte_buffer() + common.FramedCommand(compressed).frame)
+        for command in received:
+            self.assertEqual((command.type, command.compression), (mesh.type, compressed.compression))
+            self.assertEqual(bytes(common.decompress_command(command).data), mesh.data)
+
+        # A compressed command sent in fragments
+        fragments = [
+            common.Command(common.MessageType.FRAGMENT, common.frame_slice(compressed, begin, begin + 10))
+            for begin in range(0, compressed.byte_size(), 10)
+        ]
+        received = reader.feed(b"".join(fragment.to_byte_buffer() for fragment in fragments))
+        self.assertEqual(
+            [(command.type, command.compression) for command in received], [(mesh.type, compressed.compression)]
+        )
+        self.assertEqual(bytes(received[0].data), compressed.data)
+
+
+class TestBatch(unittest.TestCase):
+    def test_batch_commands(self):
+        def transform(i):
+            return common.Command(common.MessageType.TRANSFORM, common.encode_string(f"/Cube{i}") + bytes(200))
+
+        mesh = common.compress_command(
+            common.Command(common.MessageType.MESH, common.encode_string("/Mesh") + bytes(common.BATCH_SIZE))
+        )
+        large = common.Command(common.MessageType.MESH, os.urandom(common.BATCHED_MESSAGE_SIZE))
+        join = common.Command(common.MessageType.JOIN_ROOM, common.encode_string("room"))
+        commands = [transform(0), transform(1), mesh, transform(2), join, transform(3), large, transform(4)]
+        self.assertEqual(mesh.compression, common.Compression.ZLIB)
+
+        batched = common.batch_commands(commands)
+        # The compressed mesh is small enough to be batched, with its compression flags
+        self.assertEqual(len(common.batch_contents(batched[0])), 4)
+        self.assertEqual(batched[1:], commands[4:])
+
+        # Received through the frame reader
+        reader = common.FrameReader()
+        received = common.unbatch_commands(reader.feed(b"".join(command.to_byte_buffer() for command in batched)))
+        self.assertEqual(
+            [(c.type, c.id, c.compression, bytes(c.data)) for c in received],
+            [(c.type, c.id, c.compression, bytes(c.data)) for c in commands],
+        )
+
+        # Batches are limited in size
+        transforms = [transform(i) for i in range(2 * common.BATCH_SIZE // transform(0).byte_size())]
+        batched = common.batch_commands(transforms)
+        self.assertEqual([command.type for command in batched], [common.MessageType.BATCH] * 3)
+        self.assertTrue(all(command.byte_size() <= common.BATCH_SIZE + common.FRAME_HEADER_SIZE for command in batched))
+        self.assertEqual(len(common.unbatch_commands(batched)), len(transforms))
+
+        framed = [common.FramedCommand(command) for command in transforms[:2]]
+        self.assertEqual(common.make_batch_command(framed).data, common.make_batch_command(transforms[:2]).data)
+
+    def test_corrupted_batch(self):
+        transform = common.Command(common.MessageType.TRANSFORM, common.encode_string("/Cube"))
+        batch = common.make_batch_command([transform, transform])
+        for data in (batch.data[:-1], batch.data[: -common.FRAME_HEADER_SIZE - 1]):
+            corrupted = common.Command(common.MessageType.BATCH, data)
+            self.assertRaises(ValueError, common.batch_contents, corrupted)
+            with self.assertLogs(common.logger, logging.ERROR):
+                self.assertEqual(common.unbatch_commands([corrupted, transform]), [transform])
+
+
+if __name__ == "__main__":
+    unittest.main()
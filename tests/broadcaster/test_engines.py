@@ -0,0 +1,585 @@
+import os
+import socket
+import tempfile
+import time
+import unittest
+
+from mixer.broadcaster.apps.server import ENGINES
+import mixer.broadcaster.apps.server as server_module
+from mixer.broadcaster.client import Client
+import mixer.broadcaster.common as common
+import mixer.broadcaster.room_bake as room_bake
+from mixer.broadcaster.outgoing_queue import SlowConsumerPolicy
+import mixer.broadcaster.room_history as room_history
+from tests.broadcaster.utils import find_free_port, start_server, connect_client
+from tests.broadcaster.utils import receive_type, receive_until, room_commands, room_types
+
+
+class EngineTestMixin:
+    engine = ""
+
+    def setUp(self):
+        self.port = find_free_port()
+        self.server = ENGINES[self.engine]()
+        self.server_thread = start_server(self.server, self.port)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.disconnect()
+        self.server.shutdown()
+        self.server_thread.join(5)
+
+    def connect(self):
+        client = connect_client(self.port)
+        self.clients.append(client)
+        return client
+
+    def create_room(self, client, room_name, commands):
+        client.join_room(room_name)
+        receive_type(client, common.MessageType.CONTENT)
+        for command in commands:
+            client.add_command(command)
+        client.add_command(common.Command(common.MessageType.CONTENT))
+        client.fetch_outgoing_commands()
+
+        def _joinable(command):
+            if command.type != common.MessageType.ROOM_UPDATE:
+                return False
+            attributes = common.decode_json(command.data, 0)[0].get(room_name, {})
+            return attributes.get(common.RoomAttributes.JOINABLE, False)
+
+        receive_until(client, _joinable)
+
+    def test_join_and_broadcast(self):
+        creator = self.connect()
+        transform = common.Command(common.MessageType.TRANSFORM, common.encode_string("/Cube") + b"x" * 200)
+        self.create_room(creator, "room", [transform])
+
+        joiner = self.connect()
+        joiner.join_room("room")
+        received = receive_type(joiner, common.MessageType.JOIN_ROOM)
+        self.assertIn(common.MessageType.CLEAR_CONTENT, [command.type for command in received])
+        self.assertEqual(room_types(received), [common.MessageType.TRANSFORM])
+        self.assertEqual(bytes(room_commands(received)[0].data), bytes(transform.data))
+
+        # Larger than a fragment
+        self.assertIn(common.Capabilities.FRAGMENT, joiner.capabilities)
+        mesh = common.Command(common.MessageType.MESH, common.encode_string("/Cube") + b"y" * 300000)
+        creator.send_command(mesh)
+        received = receive_type(joiner, common.MessageType.MESH)
+        self.assertEqual(bytes(received[-1].data), bytes(mesh.data))
+
+    def test_join_snapshot_and_tail(self):
+        creator = self.connect()
+        mesh = common.Command(common.MessageType.MESH, common.encode_string("/Cube") + b"m")
+        self.create_room(
+            creator, "room", [mesh, common.Command(common.MessageType.TRANSFORM, common.encode_string("/Cube") + b"1")]
+        )
+
+        first = self.connect()
+        first.join_room("room")
+        receive_type(first, common.MessageType.JOIN_ROOM)
+
+        # After the snapshot made for the first joiner
+        transform = common.Command(common.MessageType.TRANSFORM, common.encode_string("/Cube") + b"2")
+        creator.send_command(transform)
+        receive_type(first, common.MessageType.TRANSFORM)
+
+        second = self.connect()
+        second.join_room("room")
+        received = receive_type(second, common.MessageType.JOIN_ROOM)
+        self.assertEqual(bytes(room_commands(received)[0].data), bytes(mesh.data))
+        self.assertEqual(bytes(room_commands(received)[-1].data), bytes(transform.data))
+
+        updates = [
+            common.decode_json(command.data, 0)[0]
+            for command in received
+            if command.type == common.MessageType.ROOM_UPDATE
+        ]
+        self.assertTrue(any(common.RoomAttributes.JOIN_BYTE_SIZE in update.get("room", {}) for update in updates))
+
+    def test_join_snapshot_file(self):
+        creator = self.connect()
+        commands = [
+            common.Command(common.MessageType.MESH, common.encode_string(f"/M{i}") + bytes(1000)) for i in range(100)
+        ]
+        self.create_room(creator, "room", commands)
+
+        minimum = room_history.SNAPSHOT_FILE_MIN_BYTE_SIZE
+        room_history.SNAPSHOT_FILE_MIN_BYTE_SIZE = 1
+        try:
+            joiner = self.connect()
+            joiner.join_room("room")
+            received = receive_type(joiner, common.MessageType.JOIN_ROOM)
+        finally:
+            room_history.SNAPSHOT_FILE_MIN_BYTE_SIZE = minimum
+        self.assertEqual([bytes(c.data) for c in room_commands(received)], [bytes(c.data) for c in commands])
+
+    def test_memory_budget(self):
+        creator = self.connect()
+        commands = [
+            common.Command(common.MessageType.MESH, common.encode_string(f"/M{i}") + bytes(1000)) for i in range(10)
+        ]
+        self.create_room(creator, "room", commands)
+        creator.set_room_keep_open("room", True)
+        creator.leave_room("room")
+
+        interval = server_module.MEMORY_CHECK_INTERVAL
+        server_module.MEMORY_CHECK_INTERVAL = 0.0
+        try:
+            self.server.set_memory_budget(1)
+            # The room without clients is unloaded, and still listed with its attributes
+            room = self.server._rooms["room"]
+            # The thread engine checks the budget at each tick of its accept loop
+            deadline = time.monotonic() + 5.0
+            while room._history.loaded and time.monotonic() < deadline:
+                creator.send_list_rooms()
+                receive_type(creator, common.MessageType.LIST_ROOMS)
+                time.sleep(0.01)
+            self.assertFalse(room._history.loaded)
+            self.assertEqual(room._history.memory_byte_size, 0)
+            creator.send_list_rooms()
+            received = receive_type(creator, common.MessageType.LIST_ROOMS)
+            rooms = common.decode_json(received[-1].data, 0)[0]
+            self.assertEqual(rooms["room"][common.RoomAttributes.COMMAND_COUNT], len(commands))
+
+            # A joining client loads it again
+            joiner = self.connect()
+            joiner.join_room("room")
+            received = receive_type(joiner, common.MessageType.JOIN_ROOM)
+        finally:
+            server_module.MEMORY_CHECK_INTERVAL = interval
+        self.assertEqual([bytes(c.data) for c in room_commands(received)], [bytes(c.data) for c in commands])
+
+    def test_save_and_load_room(self):
+        creator = self.connect()
+        commands = [
+            common.Command(common.MessageType.MESH, common.encode_string("/A") + bytes(100)),
+            common.Command(common.MessageType.TRANSFORM, common.encode_string("/A") + b"1"),
+        ]
+        self.create_room(creator, "room", commands)
+        creator.set_room_attributes("room", {"custom": 1})
+        receive_until(creator, lambda _: creator.rooms_attributes.get("room", {}).get("custom") == 1)
+
+        def request(message_type, room_name, file_name):
+            admin.send_command(
+                common.Command(message_type, common.encode_string(room_name) + common.encode_string(file_name))
+            )
+            expected = (message_type, common.MessageType.SEND_ERROR)
+            received = receive_until(admin, lambda c: c.type in expected)
+            return [c.type for c in received if c.type in expected][-1]
+
+        admin = self.connect()
+        with tempfile.TemporaryDirectory() as directory:
+            # Refused without a rooms directory
+            self.assertEqual(request(common.MessageType.SAVE_ROOM, "room", "room.mixer"), common.MessageType.SEND_ERROR)
+            self.server.preload_rooms(directory)
+            for file_name in (os.path.join(directory, "room.mixer"), "..", "../room.mixer", "sub/room.mixer", ""):
+                self.assertEqual(
+                    request(common.MessageType.SAVE_ROOM, "room", file_name), common.MessageType.SEND_ERROR
+                )
+                self.assertEqual(request(common.MessageType.LOAD_ROOM, "x", file_name), common.MessageType.SEND_ERROR)
+            self.assertEqual(os.listdir(directory), [])
+
+            self.assertEqual(request(common.MessageType.SAVE_ROOM, "room", "room.mixer"), common.MessageType.SAVE_ROOM)
+            attributes, saved = room_bake.load_room(os.path.join(directory, "room.mixer"))
+            self.assertEqual(attributes["custom"], 1)
+            self.assertEqual([bytes(c.data) for c in saved], [bytes(c.data) for c in commands])
+
+            self.assertEqual(
+                request(common.MessageType.LOAD_ROOM, "loaded", "room.mixer"), common.MessageType.LOAD_ROOM
+            )
+            self.assertEqual(
+                request(common.MessageType.LOAD_ROOM, "loaded", "room.mixer"), common.MessageType.SEND_ERROR
+            )
+
+        # The loaded room is kept open, and does not depend on the file
+        admin.send_list_rooms()
+        received = receive_type(admin, common.MessageType.LIST_ROOMS)
+        rooms = common.decode_json(received[-1].data, 0)[0]
+        self.assertEqual(rooms["loaded"]["custom"], 1)
+        self.assertTrue(rooms["loaded"][common.RoomAttributes.KEEP_OPEN])
+        self.assertEqual(rooms["loaded"][common.RoomAttributes.COMMAND_COUNT], len(commands))
+        joiner = self.connect()
+        joiner.join_room("loaded")
+        received = receive_type(joiner, common.MessageType.JOIN_ROOM)
+        self.assertEqual([bytes(c.data) for c in room_commands(received)], [bytes(c.data) for c in commands])
+
+    def test_preload_rooms(self):
+        commands = [
+            common.Command(common.MessageType.MESH, common.encode_string("/A") + bytes(100), 5),
+            common.Command(common.MessageType.TRANSFORM, common.encode_string("/A") + b"1", 5),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            room_bake.save_room(
+                {"custom": 1, common.RoomAttributes.COMMAND_COUNT: 2}, commands, os.path.join(directory, "baked.mixer")
+            )
+            with open(os.path.join(directory, "invalid.mixer"), "wb") as file:
+                file.write(b"xy")
+            self.server.preload_rooms(directory)
+
+            # Rooms are advertised from the file headers
+            client = self.connect()
+            client.send_list_rooms()
+            received = receive_type(client, common.MessageType.LIST_ROOMS)
+            rooms = common.decode_json(received[-1].data, 0)[0]
+            self.assertEqual(set(rooms), {"baked"})
+            self.assertEqual(rooms["baked"]["custom"], 1)
+            self.assertEqual(rooms["baked"][common.RoomAttributes.COMMAND_COUNT], 2)
+            self.assertTrue(rooms["baked"][common.RoomAttributes.JOINABLE])
+            self.assertIsNotNone(self.server._rooms["baked"]._history.room_file)
+
+            client.join_room("baked")
+            received = receive_type(client, common.MessageType.JOIN_ROOM)
+            self.assertEqual([bytes(c.data) for c in room_commands(received)], [bytes(c.data) for c in commands])
+            self.assertEqual([c.id for c in room_commands(received)], [1, 2])
+            self.assertIsNone(self.server._rooms["baked"]._history.room_file)
+
+    def test_resume_room(self):
+        creator = self.connect()
+        self.create_room(creator, "room", [common.Command(common.MessageType.MESH, common.encode_string("/A"))])
+        joiner = self.connect()
+        joiner.join_room("room")
+        receive_type(joiner, common.MessageType.JOIN_ROOM)
+        session_token = joiner.session_token
+        self.assertIsNotNone(session_token)
+
+        joiner.send_command(common.Command(common.MessageType.MESH, common.encode_string("/J")))
+        receive_type(creator, common.MessageType.MESH)
+        joiner.disconnect()
+        receive_type(creator, common.MessageType.CLIENT_DISCONNECTED)
+        missed = common.Command(common.MessageType.MESH, common.encode_string("/B"))
+        creator.send_command(missed)
+
+        # Only the command missed while disconnected is received, not the room content nor the joiner command
+        joiner.connect()
+        receive_type(joiner, common.MessageType.SESSION)
+        joiner.resume_room("room")
+        received = receive_type(joiner, common.MessageType.JOIN_ROOM)
+        self.assertNotIn(common.MessageType.CLEAR_CONTENT, [command.type for command in received])
+        self.assertEqual([bytes(command.data) for command in room_commands(received)], [bytes(missed.data)])
+        self.assertEqual(joiner.session_token, session_token)
+
+        # An unknown session joins the room with its whole content
+        other = self.connect()
+        receive_type(other, common.MessageType.SESSION)
+        other._resume_token = "unknown"
+        other.resume_room("room")
+        received = receive_type(other, common.MessageType.JOIN_ROOM)
+        self.assertIn(common.MessageType.CLEAR_CONTENT, [command.type for command in received])
+        self.assertEqual(len(room_commands(received)), 3)
+
+    def test_sessions_released(self):
+        creator = self.connect()
+        self.create_room(creator, "room", [common.Command(common.MessageType.MESH, common.encode_string("/A"))])
+        observer = self.connect()
+        receive_until(observer, lambda _: "room" in observer.rooms_attributes)
+
+        # The sessions of a deleted room are forgotten
+        creator.disconnect()
+        receive_type(observer, common.MessageType.ROOM_DELETED)
+        self.assertEqual(self.server._sessions, {})
+
+        # Sessions expire
+        self.create_room(observer, "room", [])
+        joiner = self.connect()
+        joiner.join_room("room")
+        receive_type(joiner, common.MessageType.JOIN_ROOM)
+        joiner.disconnect()
+        receive_type(observer, common.MessageType.CLIENT_DISCONNECTED)
+        self.assertEqual(len(self.server._sessions), 1)
+        timeout, interval = server_module.SESSION_TIMEOUT, server_module.SESSION_CHECK_INTERVAL
+        server_module.SESSION_TIMEOUT, server_module.SESSION_CHECK_INTERVAL = 0.0, 0.0
+        try:
+            deadline = time.monotonic() + 5
+            while self.server._sessions and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            server_module.SESSION_TIMEOUT, server_module.SESSION_CHECK_INTERVAL = timeout, interval
+        self.assertEqual(self.server._sessions, {})
+
+    def test_subscribe(self):
+        creator = self.connect()
+        transform = common.Command(common.MessageType.TRANSFORM, common.encode_string("/A"))
+        self.create_room(
+            creator, "room", [common.Command(common.MessageType.MESH, common.encode_string("/A")), transform]
+        )
+
+        joiner = self.connect()
+        receive_type(joiner, common.MessageType.CAPABILITIES)
+        self.assertIn(common.Capabilities.SUBSCRIBE, joiner.capabilities)
+        joiner.subscribe([common.MessageType.TRANSFORM, (common.MessageType.LIGHT, common.MessageType.RENAME)])
+        joiner.join_room("room")
+        received = receive_type(joiner, common.MessageType.JOIN_ROOM)
+        self.assertEqual(room_types(received), [common.MessageType.TRANSFORM])
+
+        creator.send_command(common.Command(common.MessageType.MESH, common.encode_string("/B")))
+        creator.send_command(common.Command(common.MessageType.RENAME, common.encode_string("/B")))
+        received = receive_type(joiner, common.MessageType.RENAME)
+        self.assertEqual(room_types(received), [common.MessageType.RENAME])
+
+    def test_subscribe_before_capabilities(self):
+        creator = self.connect()
+        update = common.Command(common.MessageType.BLENDER_DATA_UPDATE, common.encode_string("{}"))
+        mesh = common.Command(common.MessageType.MESH, common.encode_string("/A"))
+        self.create_room(creator, "room", [update, mesh])
+
+        # Subscribed and joined right after connecting, the content of the room is filtered
+        joiner = self.connect()
+        joiner.subscribe([common.MessageType.MESH])
+        joiner.join_room("room")
+        received = receive_type(joiner, common.MessageType.JOIN_ROOM)
+        self.assertEqual(room_types(received), [common.MessageType.MESH])
+        # Commands received while waiting for the capabilities are not lost
+        self.assertIn(common.MessageType.CAPABILITIES, [command.type for command in received])
+
+    def test_compression(self):
+        creator = self.connect()
+        receive_type(creator, common.MessageType.CAPABILITIES)
+        self.assertIn(common.Capabilities.COMPRESS, creator.capabilities)
+        meshes = [
+            common.Command(common.MessageType.MESH, common.encode_string(f"/M{i}") + bytes([i]) * 100000)
+            for i in range(3)
+        ]
+        self.create_room(creator, "room", meshes)
+        # The room stores the compressed payloads
+        room_byte_size = creator.rooms_attributes["room"][common.RoomAttributes.BYTE_SIZE]
+        self.assertLess(room_byte_size, sum(command.byte_size() for command in meshes) / 10)
+
+        # A client that does not support compression receives inflated payloads, the others compressed ones, that
+        # fetch_incoming_commands() inflates
+        supported = common.SUPPORTED_CAPABILITIES
+        common.SUPPORTED_CAPABILITIES = supported - {common.Capabilities.COMPRESS}
+        try:
+            legacy = self.connect()
+        finally:
+            common.SUPPORTED_CAPABILITIES = supported
+        joiner = self.connect()
+        minimum = room_history.SNAPSHOT_FILE_MIN_BYTE_SIZE
+        room_history.SNAPSHOT_FILE_MIN_BYTE_SIZE = 1
+        expected = [bytes(command.data) for command in meshes]
+        try:
+            for client, compression in ((legacy, common.Compression.NONE), (joiner, common.Compression.ZLIB)):
+                # To check the payloads as received
+                client._decompress_commands = lambda commands: commands
+                client.join_room("room")
+                received = room_commands(receive_type(client, common.MessageType.JOIN_ROOM))
+                self.assertEqual({c.compression for c in received}, {compression})
+                self.assertTrue([bytes(common.decompress_command(c).data) for c in received] == expected)
+
+                creator.add_command(meshes[0])
+                expected.append(expected[0])
+                creator.fetch_outgoing_commands()
+                mesh = room_commands(receive_type(client, common.MessageType.MESH))[-1]
+                self.assertEqual(mesh.compression, compression)
+                self.assertEqual(bytes(common.decompress_command(mesh).data), bytes(meshes[0].data))
+        finally:
+            room_history.SNAPSHOT_FILE_MIN_BYTE_SIZE = minimum
+
+    def test_batch(self):
+        creator = self.connect()
+        self.create_room(creator, "room", [])
+        self.assertIn(common.Capabilities.BATCH, creator.capabilities)
+
+        supported = common.SUPPORTED_CAPABILITIES
+        common.SUPPORTED_CAPABILITIES = supported - {common.Capabilities.BATCH}
+        try:
+            legacy = self.connect()
+        finally:
+            common.SUPPORTED_CAPABILITIES = supported
+        joiner = self.connect()
+        received_types = {legacy: [], joiner: []}
+        for client in (legacy, joiner):
+            client.join_room("room")
+            receive_type(client, common.MessageType.JOIN_ROOM)
+
+            def _read_all(*args, client=client, read_all=client._frame_reader.read_all):
+                commands = read_all(*args)
+                received_types[client].extend(command.type for command in commands)
+                return commands
+
+            client._frame_reader.read_all = _read_all
+
+        # Transforms of two objects, sent in a single BATCH
+        transforms = [
+            common.Command(common.MessageType.TRANSFORM, common.encode_string(f"/Cube{i % 2}") + bytes([i]) * 200)
+            for i in range(10)
+        ]
+        for command in transforms:
+            creator.add_command(command)
+        creator.fetch_outgoing_commands()
+
+        for client in (legacy, joiner):
+            received = []
+            while len(received) < len(transforms):
+                received.extend(room_commands(receive_type(client, common.MessageType.TRANSFORM)))
+            self.assertEqual([bytes(command.data) for command in received], [command.data for command in transforms])
+            # With their sequence number in the room as id
+            self.assertEqual([command.id for command in received], list(range(1, len(transforms) + 1)))
+        self.assertIn(common.MessageType.BATCH, received_types[joiner])
+        self.assertNotIn(common.MessageType.BATCH, received_types[legacy])
+        self.assertEqual(received_types[legacy].count(common.MessageType.TRANSFORM), len(transforms))
+
+        # The room compacts the transforms of the BATCH, keeping the first and the last one of each object
+        kept = transforms[:2] + transforms[-2:]
+        receive_until(
+            creator, lambda _: creator.rooms_attributes["room"][common.RoomAttributes.COMMAND_COUNT] == len(kept)
+        )
+        late = self.connect()
+        late.join_room("room")
+        received = room_commands(receive_type(late, common.MessageType.JOIN_ROOM))
+        self.assertEqual([bytes(command.data) for command in received], [command.data for command in kept])
+
+    def test_presence_scope(self):
+        member = self.connect()
+        self.create_room(member, "room", [])
+        other = self.connect()
+        self.create_room(other, "other", [])
+        joiner = self.connect()
+        joiner.join_room("room")
+        receive_type(joiner, common.MessageType.JOIN_ROOM)
+
+        member.set_client_attributes({common.ClientAttributes.USERSCENES: {"Scene": {}}})
+        member.set_client_attributes({common.ClientAttributes.USERNAME: "member"})
+
+        def _named(client):
+            return lambda _: client.clients_attributes.get(member.client_id, {}).get(common.ClientAttributes.USERNAME)
+
+        receive_until(joiner, _named(joiner))
+        receive_until(other, _named(other))
+        self.assertIn(common.ClientAttributes.USERSCENES, joiner.clients_attributes[member.client_id])
+        self.assertNotIn(common.ClientAttributes.USERSCENES, other.clients_attributes[member.client_id])
+
+    def fill_slow_client(self, policy):
+        self.server.max_queue_byte_size = 1024 * 1024
+        self.server.slow_consumer_policy = policy
+        creator = self.connect()
+        self.create_room(creator, "room", [])
+        slow = self.connect()
+        slow.join_room("room")
+        receive_type(slow, common.MessageType.JOIN_ROOM)
+
+        # Much more than the socket buffers, while the slow client does not read
+        for i in range(200):
+            creator.send_command(
+                common.Command(common.MessageType.MESH, common.encode_string(f"/M{i % 4}") + bytes(100 * 1024))
+            )
+        return creator, slow
+
+    def test_slow_client_disconnect(self):
+        creator, slow = self.fill_slow_client(SlowConsumerPolicy.DISCONNECT)
+        received = receive_type(creator, common.MessageType.CLIENT_DISCONNECTED, timeout=10.0)
+        disconnected = [
+            common.decode_string(command.data, 0)[0]
+            for command in received
+            if command.type == common.MessageType.CLIENT_DISCONNECTED
+        ]
+        self.assertEqual(disconnected, [slow.client_id])
+
+    def test_slow_client_resync(self):
+        creator, slow = self.fill_slow_client(SlowConsumerPolicy.RESYNC)
+        last = common.Command(common.MessageType.MESH, common.encode_string("/last"))
+        creator.send_command(last)
+
+        received = receive_until(slow, lambda command: bytes(command.data) == bytes(last.data), timeout=10.0)
+        types = [command.type for command in received]
+        self.assertIn(common.MessageType.CLEAR_CONTENT, types)
+        self.assertLess(types.count(common.MessageType.MESH), 200)  # some were dropped
+        if common.MessageType.JOIN_ROOM not in types[types.index(common.MessageType.CLEAR_CONTENT) :]:
+            receive_type(slow, common.MessageType.JOIN_ROOM)
+
+    def test_heartbeat_dead_client(self):
+        check_interval = server_module.HEARTBEAT_CHECK_INTERVAL
+        server_module.HEARTBEAT_CHECK_INTERVAL = 0.01
+        try:
+            self.server.set_heartbeat(0.05, 0.5)
+            observer = self.connect()
+            receive_type(observer, common.MessageType.HEARTBEAT)
+            self.assertIn(common.Capabilities.HEARTBEAT, observer.capabilities)
+
+            # A client that stops sending without closing its connection is disconnected, others are kept alive by
+            # their heartbeats
+            dead = self.connect()
+            receive_until(
+                dead, lambda _: dead.client_id is not None and common.Capabilities.HEARTBEAT in dead.capabilities
+            )
+
+            def _dead_disconnected(command):
+                return (
+                    command.type == common.MessageType.CLIENT_DISCONNECTED
+                    and common.decode_string(command.data, 0)[0] == dead.client_id
+                )
+
+            receive_until(observer, _dead_disconnected)
+            with self.server._mutex:
+                self.assertEqual(list(self.server._connections), [observer.client_id])
+        finally:
+            server_module.HEARTBEAT_CHECK_INTERVAL = check_interval
+
+    def test_heartbeat_dead_server(self):
+        self.server.set_heartbeat(1000.0, 0)
+        client = self.connect()
+        client.idle_timeout = 0.3
+        receive_type(client, common.MessageType.HEARTBEAT)
+
+        # The server sends nothing after its first heartbeat
+        deadline = time.monotonic() + 5.0
+        with self.assertRaises(common.ClientDisconnectedException):
+            while time.monotonic() < deadline:
+                client.fetch_commands()
+                time.sleep(0.01)
+        self.assertFalse(client.is_connected())
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "Unix only")
+    def test_local_socket(self):
+        port = find_free_port()
+        with tempfile.TemporaryDirectory() as directory, socket.socket() as ready_listener:
+            path = os.path.join(directory, "mixer.sock")
+            # Left by a server that did not stop cleanly
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+                stale.bind(path)
+
+            ready_listener.bind(("127.0.0.1", 0))
+            ready_listener.listen(1)
+            ready_listener.settimeout(5.0)
+            server = ENGINES[self.engine]()
+            server.local_socket_path = path
+            server.ready_port = ready_listener.getsockname()[1]
+            server_thread = start_server(server, port)
+            try:
+                # Connected at the first attempt once the server is ready
+                ready_listener.accept()[0].close()
+                client = Client(common.DEFAULT_HOST, port)
+                client.local_socket_path = path
+                client.connect()
+                self.clients.append(client)
+                self.assertEqual(client.socket.family, socket.AF_UNIX)
+                self.create_room(client, "room", [common.Command(common.MessageType.MESH, common.encode_string("/A"))])
+                self.assertTrue(client.client_id.startswith("local:"))
+            finally:
+                server.shutdown()
+                server_thread.join(5)
+            self.assertFalse(os.path.exists(path))
+
+    def test_disconnect(self):
+        creator = self.connect()
+        self.create_room(creator, "room", [])
+        observer = self.connect()
+        receive_type(observer, common.MessageType.LIST_ROOMS)
+
+        creator.disconnect()
+        received = receive_type(observer, common.MessageType.CLIENT_DISCONNECTED)
+        self.assertIn(common.MessageType.ROOM_DELETED, [command.type for command in received])
+
+
+class TestThreadEngine(EngineTestMixin, unittest.TestCase):
+    engine = "thread"
+
+
+class TestSelectorEngine(EngineTestMixin, unittest.TestCase):
+    engine = "selector"
+
+
+if __name__ == "__main__":
+    unittest.main()
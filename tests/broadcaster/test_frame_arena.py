@@ -0,0 +1,115 @@
+import tempfile
+import unittest
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import MessageType
+import mixer.broadcaster.frame_arena as frame_arena
+from mixer.broadcaster.frame_arena import FrameArena, iter_commands
+
+
+def command(message_type, path="", payload=b""):
+    return common.Command(message_type, common.encode_string(path) + payload)
+
+
+def types_and_payloads(commands):
+    return [(c.type, bytes(c.data)) for c in commands]
+
+
+class TestFrameArena(unittest.TestCase):
+    def test_append(self):
+        arena = FrameArena()
+        commands = [command(MessageType.TRANSFORM, f"/{i}", bytes(i)) for i in range(1000)]
+        for i, c in enumerate(commands):
+            arena.append(c, i + 1)
+
+        self.assertEqual(len(arena), len(commands))
+        self.assertEqual(arena.byte_size, sum(c.byte_size() for c in commands))
+        # Chunks grow up to CHUNK_SIZE
+        self.assertGreater(len(arena._buffers), 1)
+        self.assertLessEqual(max(len(b) for b in arena._buffers), frame_arena.CHUNK_SIZE)
+
+        stored = arena.command(10)
+        self.assertEqual(stored.type, MessageType.TRANSFORM)
+        self.assertEqual(stored.id, 11)
+        self.assertEqual(bytes(stored.data), bytes(commands[10].data))
+        self.assertEqual(arena.frame_size(10), commands[10].byte_size())
+        frame = common.Command(MessageType.TRANSFORM, commands[10].data, 11).to_byte_buffer()
+        self.assertEqual(bytes(stored.to_byte_buffer()), frame)
+
+        self.assertEqual(types_and_payloads(arena.commands(5, 8)), types_and_payloads(commands[5:8]))
+        self.assertEqual(types_and_payloads(arena.commands()), types_and_payloads(commands))
+
+    def test_adopt(self):
+        arena = FrameArena()
+        large = common.FramedCommand(command(MessageType.MESH, "/A", bytes(frame_arena.ADOPT_BYTE_SIZE)))
+        arena.append(command(MessageType.TRANSFORM, "/A"), 1)
+        arena.append(large, 2)
+        self.assertIs(arena._buffers[-1], large.frame)
+        self.assertEqual(arena.command(1).id, 2)
+        self.assertEqual(bytes(arena.command(1).data), bytes(large.data))
+
+    def test_base(self):
+        commands = [command(MessageType.MESH, "/A"), command(MessageType.TRANSFORM, "/A", b"1")]
+        base = b"".join(c.to_byte_buffer() for c in commands)
+        arena = FrameArena(base)
+        arena.append(command(MessageType.FRAME, payload=b"1"), 3)
+
+        self.assertEqual(len(arena), 3)
+        self.assertEqual(arena.byte_size, len(base) + arena.frame_size(2))
+        self.assertEqual(arena.message_type(1), MessageType.TRANSFORM)
+        self.assertEqual(types_and_payloads(arena.commands(0, 2)), types_and_payloads(commands))
+        self.assertEqual(types_and_payloads(iter_commands(base)), types_and_payloads(commands))
+
+    def test_compact(self):
+        base_commands = [command(MessageType.MESH, "/A"), command(MessageType.MESH, "/B")]
+        base = b"".join(c.to_byte_buffer() for c in base_commands)
+        arena = FrameArena(base)
+        commands = base_commands + [command(MessageType.TRANSFORM, "/A", str(i).encode()) for i in range(100)]
+        for i, c in enumerate(commands[2:]):
+            arena.append(c, i + 3)
+        large = common.FramedCommand(command(MessageType.MESH, "/C", bytes(frame_arena.ADOPT_BYTE_SIZE)))
+        arena.append(large, 103)
+        commands.append(large)
+
+        view = arena.command(50)
+        chunks = [b for b in arena._buffers if isinstance(b, bytearray) and b is not large.frame]
+        kept = [1, 2, 60, 102]
+        arena.compact(kept)
+
+        self.assertEqual(len(arena), len(kept))
+        self.assertEqual(arena.byte_size, sum(commands[i].byte_size() for i in kept))
+        self.assertEqual(types_and_payloads(arena.commands()), types_and_payloads(commands[i] for i in kept))
+        self.assertEqual([c.id for c in arena.commands()], [commands[1].id, 3, 61, 103])
+        # The base and adopted frames are kept in place, the others are copied to new chunks
+        self.assertIs(arena._buffers[0], base)
+        self.assertTrue(any(b is large.frame for b in arena._buffers))
+        self.assertFalse(any(b is c for b in arena._buffers for c in chunks))
+        # Views on the previous chunks remain valid
+        self.assertEqual(bytes(view.data), bytes(commands[50].data))
+
+    def test_spill(self):
+        base_commands = [command(MessageType.MESH, "/A")]
+        arena = FrameArena(b"".join(c.to_byte_buffer() for c in base_commands))
+        commands = base_commands + [command(MessageType.TRANSFORM, f"/{i}") for i in range(10)]
+        for i, c in enumerate(commands[1:]):
+            arena.append(c, i + 2)
+        byte_size = arena.byte_size
+        self.assertGreater(arena.memory_byte_size, byte_size)
+
+        with tempfile.TemporaryFile() as file:
+            arena.spill(file)
+        self.assertEqual(arena.memory_byte_size, 0)
+        self.assertEqual(arena.byte_size, byte_size)
+        self.assertEqual(len(arena._buffers), 1)
+        self.assertEqual(types_and_payloads(arena.commands()), types_and_payloads(commands))
+
+        # Mapped frames stay in place
+        arena.append(command(MessageType.FRAME), 12)
+        with tempfile.TemporaryFile() as file:
+            arena.spill(file)
+        self.assertEqual(len(arena._buffers), 2)
+        self.assertEqual(arena.command(11).type, MessageType.FRAME)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import unittest
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import MessageType
+from mixer.broadcaster.outgoing_queue import OutgoingQueue, SlowConsumerPolicy
+
+
+def command(message_type, path="", payload=b""):
+    return common.Command(message_type, common.encode_string(path) + payload)
+
+
+def types_and_payloads(commands):
+    return [(c.type, bytes(c.data)) for c in commands]
+
+
+class TestOutgoingQueue(unittest.TestCase):
+    def test_unbounded(self):
+        queue = OutgoingQueue(0)
+        for i in range(100):
+            self.assertTrue(queue.put(command(MessageType.TRANSFORM, "/A", bytes(100))))
+        self.assertEqual(len(queue), 100)
+        self.assertEqual(queue.high_water_command_count, 100)
+
+        first = queue.get_batch(1000)
+        self.assertLess(sum(c.byte_size() for c in first[:-1]), 1000)
+        self.assertGreaterEqual(sum(c.byte_size() for c in first), 1000)
+        self.assertEqual(queue.byte_size, sum(c.byte_size() for c in queue.get_batch(1 << 30)))
+        self.assertEqual(queue.high_water_byte_size, 100 * first[0].byte_size())
+
+    def test_collapse(self):
+        mesh = command(MessageType.MESH, "/A")
+        commands = [
+            mesh,
+            command(MessageType.TRANSFORM, "/A", b"1"),
+            command(MessageType.TRANSFORM, "/B", b"1"),
+            command(MessageType.TRANSFORM, "/A", b"2"),
+            command(MessageType.RENAME, "/B", common.encode_string("/C")),
+            command(MessageType.FRAME, payload=b"1"),
+            command(MessageType.TRANSFORM, "/B", b"2"),
+            command(MessageType.FRAME, payload=b"2"),
+        ]
+        queue = OutgoingQueue(sum(c.byte_size() for c in commands) - 1, SlowConsumerPolicy.COLLAPSE)
+        for c in commands[:-1]:
+            self.assertTrue(queue.put(c))
+        self.assertTrue(queue.put(commands[-1]))
+
+        self.assertEqual(queue.overflow_count, 1)
+        self.assertEqual(queue.dropped_count, 2)
+        self.assertEqual(
+            types_and_payloads(queue.get_batch(1 << 30)),
+            types_and_payloads([commands[i] for i in (0, 2, 3, 4, 6, 7)]),
+        )
+
+    def test_collapse_overflow(self):
+        queue = OutgoingQueue(1000, SlowConsumerPolicy.COLLAPSE)
+        self.assertTrue(queue.put(command(MessageType.MESH, "/A", bytes(600))))
+        self.assertFalse(queue.put(command(MessageType.MESH, "/B", bytes(600))))
+
+    def test_bounded(self):
+        queue = OutgoingQueue(1000, SlowConsumerPolicy.DISCONNECT)
+        self.assertTrue(queue.put(command(MessageType.MESH, "/A", bytes(2000)), bounded=False))
+        # Unbounded commands do not count in the bound
+        self.assertTrue(queue.put(command(MessageType.MESH, "/B", bytes(10))))
+        self.assertEqual(
+            queue.unbounded_byte_size, queue.byte_size - command(MessageType.MESH, "/B", bytes(10)).byte_size()
+        )
+        self.assertFalse(queue.put(command(MessageType.MESH, "/C", bytes(1000))))
+
+        queue = OutgoingQueue(1000, SlowConsumerPolicy.DISCONNECT)
+        self.assertTrue(queue.put(command(MessageType.MESH, "/A", bytes(2000)), bounded=False))
+        queue.get_batch(1 << 30)
+        self.assertEqual(queue.unbounded_byte_size, 0)
+        self.assertFalse(queue.put(command(MessageType.MESH, "/B", bytes(2000))))
+
+    def test_resync(self):
+        queue = OutgoingQueue(1000, SlowConsumerPolicy.RESYNC)
+        self.assertTrue(queue.put(command(MessageType.MESH, "/A", bytes(600))))
+        self.assertTrue(queue.put(common.Command(MessageType.ROOM_UPDATE, common.encode_json({}))))
+        self.assertTrue(queue.put(command(MessageType.MESH, "/B", bytes(600))))
+        self.assertTrue(queue.paused)
+        self.assertEqual([c.type for c in queue.get_batch(1 << 30)], [MessageType.ROOM_UPDATE])
+        self.assertTrue(queue.resync_pending())
+
+        # Room commands are dropped until the client is resynchronized
+        self.assertTrue(queue.put(command(MessageType.MESH, "/C")))
+        self.assertEqual(len(queue), 0)
+        queue.resume()
+        self.assertTrue(queue.put(command(MessageType.MESH, "/C")))
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.dropped_count, 3)
+
+    def test_interactive_lane(self):
+        queue = OutgoingQueue(0)
+        queue.fragment_size = common.FRAGMENT_SIZE
+        mesh = command(MessageType.MESH, "/A", bytes(3 * common.FRAGMENT_SIZE))
+        queue.put(mesh)
+        queue.put(command(MessageType.TRANSFORM, "/B"))
+        queue.put(common.Command(MessageType.FRAME, common.encode_int(1)))
+
+        first = queue.get_batch(common.FRAGMENT_SIZE)
+        self.assertEqual([c.type for c in first], [MessageType.TRANSFORM, MessageType.FRAME, MessageType.FRAGMENT])
+
+        # Interactive commands are interleaved with the fragments of the large command
+        queue.put(command(MessageType.TRANSFORM, "/C"))
+        second = queue.get_batch(common.FRAGMENT_SIZE)
+        self.assertEqual([c.type for c in second], [MessageType.TRANSFORM, MessageType.FRAGMENT])
+
+        fragments = [first[-1], second[-1]] + queue.get_batch(1 << 30)
+        self.assertEqual(b"".join(bytes(c.data) for c in fragments), mesh.to_byte_buffer())
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.byte_size, 0)
+
+    def test_interactive_order(self):
+        queue = OutgoingQueue(0)
+        large = command(MessageType.MESH, "/A", bytes(2 * common.FRAGMENT_SIZE))
+        queue.put(large)
+        # Not before the large command about the same object
+        queue.put(command(MessageType.TRANSFORM, "/A"))
+        self.assertEqual([c.type for c in queue.get_batch(1)], [MessageType.MESH])
+        self.assertEqual([c.type for c in queue.get_batch(1)], [MessageType.TRANSFORM])
+
+        # Not before other commands
+        queue.put(large)
+        queue.put(command(MessageType.RENAME, "/B", common.encode_string("/C")))
+        queue.put(command(MessageType.TRANSFORM, "/C"))
+        self.assertEqual(
+            [c.type for c in queue.get_batch(1 << 30)], [MessageType.MESH, MessageType.RENAME, MessageType.TRANSFORM]
+        )
+
+        # Not before a large command about an unknown subject
+        queue.put(common.Command(MessageType.BLENDER_DATA_UPDATE, bytes(2 * common.FRAGMENT_SIZE)))
+        queue.put(command(MessageType.TRANSFORM, "/A"))
+        self.assertEqual(
+            [c.type for c in queue.get_batch(1 << 30)], [MessageType.BLENDER_DATA_UPDATE, MessageType.TRANSFORM]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from mixer.broadcaster.common import ClientAttributes
+from mixer.broadcaster.presence import Presence, split_client_attributes
+
+
+class TestPresence(unittest.TestCase):
+    def test_merge(self):
+        presence = Presence(0)
+        self.assertIsNone(presence.timeout())
+        presence.update_client("a", {ClientAttributes.USERSCENES: 1, ClientAttributes.USERNAME: "a"})
+        presence.update_client("a", {ClientAttributes.USERSCENES: 2})
+        presence.update_room("r", {"byte_size": 1})
+        presence.update_room("r", {"byte_size": 2})
+        presence.update_room("deleted", {"byte_size": 1})
+        presence.discard_room("deleted")
+        self.assertEqual(presence.timeout(), 0.0)
+
+        clients, rooms = presence.pop_due()
+        self.assertEqual(clients, {"a": {ClientAttributes.USERSCENES: 2, ClientAttributes.USERNAME: "a"}})
+        self.assertEqual(rooms, {"r": {"byte_size": 2}})
+        self.assertEqual(presence.pop_due(), ({}, {}))
+        self.assertIsNone(presence.timeout())
+
+    def test_tick(self):
+        presence = Presence(60.0)
+        presence.update_room("r", {"byte_size": 1})
+        self.assertEqual(presence.pop_due(), ({}, {}))
+        self.assertGreater(presence.timeout(), 0.0)
+
+    def test_split(self):
+        global_attributes, room_attributes = split_client_attributes(
+            {ClientAttributes.ROOM: "r", ClientAttributes.USERSCENES: {}, "blender_windows": []}
+        )
+        self.assertEqual(global_attributes, {ClientAttributes.ROOM: "r"})
+        self.assertEqual(room_attributes, {ClientAttributes.USERSCENES: {}, "blender_windows": []})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,276 @@
+import tempfile
+import unittest
+
+import mixer.broadcaster.common as common
+from mixer.broadcaster.common import MessageType
+from mixer.broadcaster.room_history import RoomHistory
+import mixer.broadcaster.room_history as room_history
+
+
+def command(message_type, path="", payload=b""):
+    return common.Command(message_type, common.encode_string(path) + payload)
+
+
+def data_update(uuid, payload=""):
+    proxy = f'{{"__bpy_proxy_class__": "BpyIDProxy", "_data": {{"mixer_uuid": "{uuid}", "x": "{payload}"}}}}'
+    return common.Command(MessageType.BLENDER_DATA_UPDATE, common.encode_string(proxy))
+
+
+def types_and_payloads(history):
+    return [(c.type, bytes(c.data)) for c in history.commands()]
+
+
+class TestRoomHistory(unittest.TestCase):
+    def test_last_writer_wins(self):
+        history = RoomHistory()
+        mesh = command(MessageType.MESH, "/A")
+        history.append(mesh)
+        history.append(command(MessageType.TRANSFORM, "/A", b"1"))
+        history.append(command(MessageType.TRANSFORM, "/B", b"1"))
+        history.append(command(MessageType.TRANSFORM, "/A", b"2"))
+        last_a = command(MessageType.TRANSFORM, "/A", b"3")
+        history.append(last_a)
+
+        commands = history.commands()
+        self.assertEqual(len(commands), 3)
+        self.assertEqual(bytes(commands[0].data), bytes(mesh.data))
+        self.assertEqual(bytes(commands[-1].data), bytes(last_a.data))
+        self.assertEqual([c.id for c in commands], [1, 3, 5])
+        self.assertEqual(history.command_count, 3)
+        self.assertEqual(history.byte_size, sum(c.byte_size() for c in commands))
+
+    def test_first_entry_is_kept(self):
+        # The first entry of a subject creates it and must stay before commands that use it
+        history = RoomHistory()
+        history.append(command(MessageType.MESH, "/A", b"1"))
+        history.append(command(MessageType.ADD_OBJECT_TO_COLLECTION, "Collection", common.encode_string("A")))
+        history.append(command(MessageType.MESH, "/A", b"2"))
+        history.append(command(MessageType.MESH, "/A", b"3"))
+        self.assertEqual(
+            [c.type for c in history.commands()],
+            [MessageType.MESH, MessageType.ADD_OBJECT_TO_COLLECTION, MessageType.MESH],
+        )
+
+    def test_barrier(self):
+        history = RoomHistory()
+        history.append(command(MessageType.MESH, "/A"))
+        history.append(command(MessageType.TRANSFORM, "/A", b"1"))
+        history.append(command(MessageType.TRANSFORM, "/A", b"2"))
+        history.append(command(MessageType.RENAME, "/A", common.encode_string("/B")))
+        history.append(command(MessageType.TRANSFORM, "/A", b"3"))
+        history.append(command(MessageType.TRANSFORM, "/A", b"4"))
+        self.assertEqual(len(history.commands()), 5)
+
+    def test_blender_data_update(self):
+        history = RoomHistory()
+        for i in range(5):
+            history.append(data_update("uuid_a", str(i)))
+            history.append(data_update("uuid_b", str(i)))
+        self.assertEqual(len(history.commands()), 4)
+
+    def test_compressed_commands(self):
+        # Compressed commands are compacted like the others, and stored compressed
+        history = RoomHistory()
+        for i in range(3):
+            for path in ("/A", "/B"):
+                compressed = common.compress_command(command(MessageType.MESH, path, bytes([i]) * 10000))
+                self.assertNotEqual(compressed.compression, common.Compression.NONE)
+                history.append(compressed)
+            history.append(common.compress_command(data_update("uuid_a", str(i) * 2000)))
+        commands = history.commands()
+        self.assertEqual(len(commands), 6)
+        self.assertTrue(all(c.compression == common.Compression.ZLIB for c in commands))
+        self.assertEqual(bytes(common.decompress_command(commands[-3]).data)[-10:], bytes([2]) * 10)
+
+        snapshot = history.make_snapshot()
+        self.assertTrue(snapshot.compressed)
+        self.assertEqual([c.compression for c in snapshot.commands()], [c.compression for c in commands])
+        history = RoomHistory()
+        history.append(command(MessageType.MESH, "/A"))
+        self.assertFalse(history.make_snapshot().compressed)
+
+    def test_sequences_and_sweep(self):
+        history = RoomHistory()
+        history.append(command(MessageType.MESH, "/A"))
+        for i in range(room_history.MIN_SWEEP_TOMBSTONE_COUNT * 3):
+            history.append(command(MessageType.TRANSFORM, "/A", str(i).encode()))
+        history.append(command(MessageType.FRAME))
+
+        self.assertEqual(history.last_sequence, room_history.MIN_SWEEP_TOMBSTONE_COUNT * 3 + 2)
+        self.assertLess(len(history._arena), room_history.MIN_SWEEP_TOMBSTONE_COUNT * 2)
+        after = history.commands_after(2)
+        self.assertEqual([sequence for sequence, _ in after], [history.last_sequence - 1, history.last_sequence])
+        self.assertEqual(history.commands_after(history.last_sequence), [])
+
+    def test_resume(self):
+        history = RoomHistory()
+        history.append(command(MessageType.MESH, "/A"), "a")
+        history.append(command(MessageType.MESH, "/B"), "b")
+        history.append(command(MessageType.MESH, "/A", b"1"), "a")
+        history.append(command(MessageType.MESH, "/C"), "b")
+        self.assertEqual([sequence for sequence, _ in history.commands_after(1, excluded_origin="a")], [2, 4])
+        self.assertEqual([sequence for sequence, _ in history.commands_after(1, 1, excluded_origin="b")], [3])
+
+        # The tail of a client that missed a superseded entry holds the entry that supersedes it
+        self.assertTrue(history.can_resume(0))
+        self.assertTrue(history.can_resume(history.last_sequence))
+        self.assertFalse(history.can_resume(history.last_sequence + 1))
+
+    def test_snapshot(self):
+        history = RoomHistory()
+        history.append(command(MessageType.MESH, "/A"))
+        history.append(command(MessageType.TRANSFORM, "/A", b"1"))
+        history.append(command(MessageType.TRANSFORM, "/B", b"1"))
+        snapshot = history.snapshot_for_join()
+        self.assertEqual(snapshot.sequence, history.last_sequence)
+        self.assertEqual(snapshot.byte_size, history.byte_size)
+        self.assertEqual(bytes(snapshot.buffer), b"".join(bytes(c.to_byte_buffer()) for c in snapshot.commands()))
+
+        # Updating a subject of the snapshot does not change the snapshot
+        history.append(command(MessageType.TRANSFORM, "/A", b"2"))
+        history.append(command(MessageType.TRANSFORM, "/C", b"1"))
+        self.assertIs(history.snapshot_for_join(), snapshot)
+        self.assertEqual(
+            history.tail_byte_size, sum(c.byte_size() for _, c in history.commands_after(snapshot.sequence))
+        )
+        self.assertEqual(history.join_byte_size(), snapshot.byte_size + history.tail_byte_size)
+
+        # The snapshot and its tail replay the updated values
+        replay = list(snapshot.commands()) + [c for _, c in history.commands_after(snapshot.sequence)]
+        self.assertEqual(
+            [bytes(c.data) for c in replay if c.type == MessageType.TRANSFORM][-2:],
+            [common.encode_string("/A") + b"2", common.encode_string("/C") + b"1"],
+        )
+
+    def test_snapshot_file(self):
+        history = RoomHistory()
+        history.append(common.FramedCommand(command(MessageType.MESH, "/A", bytes(100))))
+        history.append(common.FramedCommand(command(MessageType.TRANSFORM, "/A")))
+        frames = b"".join(bytes(c.to_byte_buffer()) for c in history.commands())
+
+        minimum = room_history.SNAPSHOT_FILE_MIN_BYTE_SIZE
+        room_history.SNAPSHOT_FILE_MIN_BYTE_SIZE = 1
+        try:
+            snapshot = history.make_snapshot()
+        finally:
+            room_history.SNAPSHOT_FILE_MIN_BYTE_SIZE = minimum
+
+        file_frames = snapshot.file_frames("test")
+        self.assertIsNotNone(file_frames)
+        self.assertEqual(file_frames.byte_size(), len(frames))
+        snapshot.file.seek(0)
+        self.assertEqual(snapshot.file.read(), frames)
+        # The history is rebased on the memory map of the file
+        self.assertEqual(b"".join(bytes(c.to_byte_buffer()) for c in history.commands()), frames)
+
+    def test_spill(self):
+        history = RoomHistory()
+        history.append(command(MessageType.MESH, "/A", bytes(100)), "a")
+        snapshot = history.make_snapshot()
+        history.append(command(MessageType.TRANSFORM, "/A", b"1"), "b")
+        history.append(command(MessageType.TRANSFORM, "/A", b"2"), "b")
+        expected = types_and_payloads(history)
+        self.assertGreater(history.memory_byte_size, 0)
+
+        history.spill()
+        self.assertEqual(history.memory_byte_size, 0)
+        self.assertEqual(types_and_payloads(history), expected)
+        self.assertEqual([sequence for sequence, _ in history.commands_after(0, excluded_origin="a")], [3])
+        # The snapshot in memory is dropped, and made again from the spilled frames
+        self.assertIsNot(history.snapshot_for_join(), snapshot)
+        self.assertEqual([c.id for c in history.commands()], [1, 3])
+
+    def test_unload(self):
+        history = RoomHistory()
+        history.append(command(MessageType.MESH, "/A"), "a")
+        history.append(command(MessageType.TRANSFORM, "/A", b"1"), "a")
+        history.append(command(MessageType.TRANSFORM, "/A", b"2"), "b")
+        history.append(command(MessageType.MESH, "/B"), "b")
+        expected = types_and_payloads(history)
+        byte_size, command_count = history.byte_size, history.command_count
+
+        history.unload()
+        self.assertFalse(history.loaded)
+        self.assertEqual(history.memory_byte_size, 0)
+        self.assertEqual((history.byte_size, history.command_count), (byte_size, command_count))
+        self.assertIsNotNone(history.snapshot.file)
+
+        history.load()
+        self.assertEqual(types_and_payloads(history), expected)
+        self.assertEqual([sequence for sequence, _ in history.commands_after(0, excluded_origin="b")], [1])
+        # Compaction goes on
+        history.append(command(MessageType.TRANSFORM, "/A", b"3"))
+        self.assertEqual(history.command_count, command_count)
+        self.assertEqual([c.id for c in history.commands()], [1, 4, 5])
+
+    def test_load_frames(self):
+        commands = [
+            command(MessageType.MESH, "/A"),
+            command(MessageType.TRANSFORM, "/A", b"1"),
+            command(MessageType.TRANSFORM, "/A", b"2"),
+        ]
+        frames = b"".join(common.Command(c.type, c.data, 7).to_byte_buffer() for c in commands)
+        history = RoomHistory()
+        with tempfile.TemporaryFile() as file:
+            file.write(b"header" + frames)
+            file.seek(len(b"header"))
+            history.load_frames(file)
+        self.assertFalse(history.loaded)
+        self.assertEqual((history.byte_size, history.command_count), (len(frames), len(commands)))
+        self.assertIs(history.full_snapshot(), history.snapshot)
+
+        # Frames are numbered, and indexed when loaded
+        history.load()
+        self.assertEqual(history.command_count, 2)
+        self.assertEqual(
+            [(c.type, bytes(c.data)) for c in history.commands()],
+            [(c.type, bytes(c.data)) for c in (commands[0], commands[2])],
+        )
+        self.assertEqual([c.id for c in history.commands()], [1, 3])
+        self.assertEqual(history.append(command(MessageType.MESH, "/B")), 4)
+        self.assertEqual(history.full_snapshot().command_count, 3)
+
+        with tempfile.TemporaryFile() as file:
+            file.write(frames[:-1])
+            file.seek(0)
+            self.assertRaises(ValueError, RoomHistory().load_frames, file)
+
+    def test_defer_room_file(self):
+        commands = [command(MessageType.MESH, "/A"), command(MessageType.MESH, "/B")]
+        frames = b"".join(c.to_byte_buffer() for c in commands)
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = f"{directory}/room"
+            with open(file_path, "wb") as file:
+                file.write(b"header" + frames[:-1])
+            history = RoomHistory()
+            history.defer_room_file(file_path, len(b"header"), 1000, 10)
+            self.assertFalse(history.loaded)
+            self.assertEqual((history.byte_size, history.command_count), (1000, 10))
+
+            # A room file that cannot be read is kept for a later attempt
+            self.assertRaises(ValueError, history.load)
+            self.assertEqual(history.room_file, (file_path, len(b"header")))
+            self.assertEqual((history.byte_size, history.command_count), (1000, 10))
+
+            with open(file_path, "wb") as file:
+                file.write(b"header" + frames)
+            history.load()
+            self.assertIsNone(history.room_file)
+            self.assertEqual((history.byte_size, history.command_count), (len(frames), 2))
+            self.assertEqual(types_and_payloads(history), [(c.type, bytes(c.data)) for c in commands])
+
+    def test_snapshot_remade_for_large_tail(self):
+        history = RoomHistory()
+        history.append(command(MessageType.MESH, "/A"))
+        snapshot = history.snapshot_for_join()
+        payload = bytes(room_history.SNAPSHOT_MIN_TAIL_BYTE_SIZE)
+        history.append(command(MessageType.MESH, "/B", payload))
+        new_snapshot = history.snapshot_for_join()
+        self.assertIsNot(new_snapshot, snapshot)
+        self.assertEqual(new_snapshot.command_count, 2)
+        self.assertEqual(history.tail_byte_size, 0)
+        self.assertEqual(history.commands_after(new_snapshot.sequence), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
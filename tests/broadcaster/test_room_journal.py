@@ -0,0 +1,174 @@
+import os
+import tempfile
+import unittest
+
+from mixer.broadcaster.apps.server import ENGINES
+import mixer.broadcaster.common as common
+import mixer.broadcaster.room_history as room_history
+import mixer.broadcaster.room_journal as room_journal
+from mixer.broadcaster.room_journal import RoomJournal, load_journals
+from tests.broadcaster.utils import find_free_port, start_server, connect_client
+from tests.broadcaster.utils import receive_type, receive_until, room_commands
+
+
+def framed(message_type, path, payload=b""):
+    return common.FramedCommand(common.Command(message_type, common.encode_string(path) + payload))
+
+
+class TestRoomJournal(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test_journal(self):
+        journal = RoomJournal(self.directory, fsync_interval=0.0)
+        commands = [framed(common.MessageType.MESH, "/A", bytes(100)), framed(common.MessageType.TRANSFORM, "/A")]
+        for command in commands:
+            journal.append("a/room", command)
+        journal.set_attributes("a/room", {"keep_open": True})
+        journal.append("deleted", commands[0])
+        journal.delete("deleted")
+        journal.close()
+
+        rooms = list(load_journals(self.directory))
+        self.assertEqual(len(rooms), 1)
+        room_name, attributes, loaded = rooms[0]
+        self.assertEqual(room_name, "a/room")
+        self.assertEqual(attributes, {"keep_open": True})
+        self.assertEqual([bytes(c.to_byte_buffer()) for c in loaded], [bytes(c.frame) for c in commands])
+
+    def test_selected_rooms(self):
+        journal = RoomJournal(self.directory)
+        journal.append("mine", framed(common.MessageType.MESH, "/A"))
+        journal.append("other", framed(common.MessageType.MESH, "/B", bytes(10)))
+        journal.close()
+        other_path = os.path.join(self.directory, "other.journal")
+        size = os.path.getsize(other_path)
+        with open(other_path, "ab") as f:
+            f.write(b"partial")
+
+        rooms = [(name, list(commands)) for name, _, commands in load_journals(self.directory, lambda n: n == "mine")]
+        self.assertEqual([name for name, _ in rooms], ["mine"])
+        # The journal of a room that is not selected is left untouched
+        self.assertEqual(os.path.getsize(other_path), size + len(b"partial"))
+
+    def test_rewrite(self):
+        journal = RoomJournal(self.directory, fsync_interval=0.0)
+        commands = [framed(common.MessageType.MESH, f"/{i}", bytes(i * 100)) for i in range(10)]
+        for command in commands:
+            journal.append("room", command)
+        journal.rewrite("room", [command.frame for command in commands[5:8]])
+        journal.append("room", commands[9])
+        journal.close()
+        self.assertEqual(os.listdir(self.directory), ["room.journal"])
+
+        # Read in chunks smaller than the frames
+        read_size = room_journal.READ_SIZE
+        room_journal.READ_SIZE = 50
+        try:
+            _, _, loaded = next(load_journals(self.directory))
+            loaded = [bytes(c.to_byte_buffer()) for c in loaded]
+        finally:
+            room_journal.READ_SIZE = read_size
+        self.assertEqual(loaded, [bytes(c.frame) for c in commands[5:8] + commands[9:]])
+
+    def test_partial_frame(self):
+        journal = RoomJournal(self.directory)
+        journal.append("room", framed(common.MessageType.MESH, "/A"))
+        journal.close()
+        file_name = os.path.join(self.directory, os.listdir(self.directory)[0])
+        size = os.path.getsize(file_name)
+        with open(file_name, "ab") as f:
+            f.write(framed(common.MessageType.MESH, "/B", bytes(10)).frame[:20])
+
+        _, _, loaded = next(load_journals(self.directory))
+        self.assertEqual(len(list(loaded)), 1)
+        self.assertEqual(os.path.getsize(file_name), size)
+
+    def test_recover(self):
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                commands = [
+                    common.Command(common.MessageType.MESH, common.encode_string("/A")),
+                    common.Command(common.MessageType.TRANSFORM, common.encode_string("/A")),
+                ]
+                room_name = f"{engine}_room"
+
+                port = find_free_port()
+                server = ENGINES[engine]()
+                server.open_journal(self.directory)
+                thread = start_server(server, port)
+                creator = connect_client(port)
+                creator.join_room(room_name)
+                receive_type(creator, common.MessageType.CONTENT)
+                for command in commands:
+                    creator.send_command(command)
+                creator.set_room_attributes(room_name, {"custom": 1})
+                creator.send_command(common.Command(common.MessageType.CONTENT))
+
+                def _custom_attributes_set(command):
+                    if command.type != common.MessageType.ROOM_UPDATE:
+                        return False
+                    return "custom" in common.decode_json(command.data, 0)[0].get(room_name, {})
+
+                receive_until(creator, _custom_attributes_set)
+                server.shutdown()
+                thread.join(5)
+                creator.disconnect()
+
+                # The room is recovered joinable by a new server
+                port = find_free_port()
+                server = ENGINES[engine]()
+                server.open_journal(self.directory)
+                thread = start_server(server, port)
+                try:
+                    joiner = connect_client(port)
+                    receive_type(joiner, common.MessageType.LIST_ROOMS)
+                    self.assertEqual(joiner.rooms_attributes[room_name]["custom"], 1)
+                    joiner.join_room(room_name)
+                    received = receive_type(joiner, common.MessageType.JOIN_ROOM)
+                    self.assertEqual(
+                        [bytes(c.data) for c in room_commands(received)], [bytes(c.data) for c in commands]
+                    )
+                    joiner.disconnect()
+                finally:
+                    server.shutdown()
+                    thread.join(5)
+
+    def test_journal_compaction(self):
+        port = find_free_port()
+        server = ENGINES["selector"]()
+        server.open_journal(self.directory, fsync_interval=0.0)
+        thread = start_server(server, port)
+        tombstone_count = room_history.MIN_SWEEP_TOMBSTONE_COUNT
+        room_history.MIN_SWEEP_TOMBSTONE_COUNT = 1
+        try:
+            creator = connect_client(port)
+            creator.join_room("room")
+            receive_type(creator, common.MessageType.CONTENT)
+            for i in range(20):
+                creator.send_command(
+                    common.Command(common.MessageType.TRANSFORM, common.encode_string("/A") + bytes(i))
+                )
+            creator.send_command(common.Command(common.MessageType.CONTENT))
+            creator.set_room_keep_open("room", True)
+            creator.send_list_rooms()
+            receive_type(creator, common.MessageType.LIST_ROOMS)
+            creator.disconnect()
+        finally:
+            room_history.MIN_SWEEP_TOMBSTONE_COUNT = tombstone_count
+            server.shutdown()
+            thread.join(5)
+
+        # Superseded transforms are removed from the journal
+        _, _, loaded = next(load_journals(self.directory))
+        loaded = list(loaded)
+        self.assertLess(len(loaded), 10)
+        self.assertEqual(bytes(loaded[-1].data), common.encode_string("/A") + bytes(19))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import socket
+import time
+import unittest
+
+import mixer.broadcaster.common as common
+from tests.broadcaster.utils import find_free_port, start_server, connect_client
+from tests.broadcaster.utils import receive_type, receive_until, room_commands
+
+try:
+    import mixer.broadcaster.apps.supervisor as supervisor
+    from mixer.broadcaster.apps.supervisor import ShardConnection, ShardServer, Supervisor, room_worker
+except ImportError:
+    Supervisor = None
+
+WORKER_COUNT = 2
+
+
+def room_names():
+    """
+    Return the names of two rooms that live in different workers.
+    """
+    names = {}
+    i = 0
+    while len(names) < WORKER_COUNT:
+        names.setdefault(room_worker(f"room{i}", WORKER_COUNT), f"room{i}")
+        i += 1
+    return names[0], names[1]
+
+
+def transform(value: bytes) -> common.Command:
+    return common.Command(common.MessageType.TRANSFORM, common.encode_string("/Cube") + value)
+
+
+@unittest.skipUnless(Supervisor is not None and hasattr(socket, "AF_UNIX"), "Unix sockets required")
+class TestSupervisor(unittest.TestCase):
+    def setUp(self):
+        self.port = find_free_port()
+        self.server = Supervisor(WORKER_COUNT)
+        self.server_thread = start_server(self.server, self.port)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.disconnect()
+        self.server.shutdown()
+        self.server_thread.join(10)
+        for process in self.server._workers:
+            self.assertFalse(process.is_alive())
+
+    def connect(self):
+        client = connect_client(self.port)
+        self.clients.append(client)
+        return client
+
+    def create_room(self, client, room_name, commands):
+        client.join_room(room_name)
+        receive_type(client, common.MessageType.CONTENT, timeout=30)
+        for command in commands:
+            client.add_command(command)
+        client.add_command(common.Command(common.MessageType.CONTENT))
+        client.fetch_outgoing_commands()
+
+    def wait_listed(self, client, message_type, predicate):
+        """
+        List rooms or clients until predicate is True for the listed attributes, that updates reach all processes.
+        """
+        deadline = time.monotonic() + 5
+        while True:
+            client.send_command(common.Command(message_type))
+            received = receive_type(client, message_type)
+            # Updates may be received after the listing
+            listing = [command for command in received if command.type == message_type][-1]
+            listed = common.decode_json(listing.data, 0)[0]
+            if predicate(listed) or time.monotonic() > deadline:
+                return listed
+            time.sleep(0.05)
+
+    def test_rooms_on_workers(self):
+        first_room, second_room = room_names()
+        first_creator = self.connect()
+        self.create_room(first_creator, first_room, [transform(b"1")])
+        second_creator = self.connect()
+        self.create_room(second_creator, second_room, [transform(b"2")])
+
+        # Rooms and clients of all workers are listed
+        observer = self.connect()
+        rooms = self.wait_listed(
+            observer,
+            common.MessageType.LIST_ROOMS,
+            lambda rooms: all(
+                rooms.get(name, {}).get(common.RoomAttributes.JOINABLE) for name in (first_room, second_room)
+            ),
+        )
+        self.assertEqual(set(rooms), {first_room, second_room})
+        self.assertEqual(rooms[second_room][common.RoomAttributes.COMMAND_COUNT], 1)
+        clients = self.wait_listed(observer, common.MessageType.LIST_CLIENTS, lambda clients: len(clients) == 3)
+        self.assertEqual(clients[first_creator.client_id][common.ClientAttributes.ROOM], first_room)
+
+        # A client moves from a worker to the other
+        joiner = self.connect()
+        joiner.join_room(first_room)
+        received = receive_type(joiner, common.MessageType.JOIN_ROOM)
+        self.assertEqual([bytes(c.data) for c in room_commands(received)], [bytes(transform(b"1").data)])
+        first_creator.send_command(transform(b"3"))
+        received = receive_type(joiner, common.MessageType.TRANSFORM)
+        self.assertEqual(bytes(received[-1].data), bytes(transform(b"3").data))
+
+        joiner.leave_room(first_room)
+        receive_type(joiner, common.MessageType.LEAVE_ROOM)
+        joiner.join_room(second_room)
+        received = receive_type(joiner, common.MessageType.JOIN_ROOM)
+        self.assertEqual([bytes(c.data) for c in room_commands(received)], [bytes(transform(b"2").data)])
+
+        # Room management is forwarded to the worker of the room
+        observer.set_room_keep_open(first_room, True)
+
+        def _kept_open(command):
+            if command.type != common.MessageType.ROOM_UPDATE:
+                return False
+            attributes = common.decode_json(command.data, 0)[0].get(first_room, {})
+            return attributes.get(common.RoomAttributes.KEEP_OPEN, False)
+
+        receive_until(observer, _kept_open)
+        first_creator.leave_room(first_room)
+        receive_type(first_creator, common.MessageType.LEAVE_ROOM)
+        rooms = self.wait_listed(
+            observer, common.MessageType.LIST_ROOMS, lambda rooms: rooms[first_room][common.RoomAttributes.KEEP_OPEN]
+        )
+        self.assertIn(first_room, rooms)
+
+        observer.delete_room(first_room)
+        receive_type(observer, common.MessageType.ROOM_DELETED)
+        rooms = self.wait_listed(observer, common.MessageType.LIST_ROOMS, lambda rooms: first_room not in rooms)
+        self.assertEqual(set(rooms), {second_room})
+
+    def test_hand_off_flush_timeout(self):
+        # A client that does not read its commands does not block the process that passes it
+        server = ShardServer(WORKER_COUNT)
+        client_socket, server_socket = socket.socketpair()
+        connection = ShardConnection(server, server_socket, ("client", 0))
+        connection.start()
+        for _ in range(100):
+            connection.add_command(transform(bytes(100000)))
+        timeout = supervisor.HAND_OFF_FLUSH_TIMEOUT
+        supervisor.HAND_OFF_FLUSH_TIMEOUT = 0.1
+        try:
+            start = time.monotonic()
+            self.assertRaises(common.ClientDisconnectedException, connection.flush)
+            self.assertLess(time.monotonic() - start, 5)
+        finally:
+            supervisor.HAND_OFF_FLUSH_TIMEOUT = timeout
+            client_socket.close()
+            server_socket.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import socket
+import threading
+import time
+from typing import Callable, List
+
+from mixer.broadcaster.client import Client
+import mixer.broadcaster.common as common
+
+
+def find_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(server, port: int) -> threading.Thread:
+    server_thread = threading.Thread(None, server.run, args=(port,))
+    server_thread.start()
+    return server_thread
+
+
+def connect_client(port: int, timeout: float = 5.0) -> Client:
+    """
+    Connect a client, retrying while the server thread is starting.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        client = Client(common.DEFAULT_HOST, port)
+        client.connect()
+        if client.is_connected():
+            return client
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Cannot connect to server on port {port}")
+        time.sleep(0.01)
+
+
+def receive_until(
+    client: Client, predicate: Callable[[common.Command], bool], timeout: float = 5.0
+) -> List[common.Command]:
+    """
+    Fetch commands until one of them satisfies predicate, and return all received commands.
+    """
+    received: List[common.Command] = []
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        commands = client.fetch_commands()
+        received.extend(commands)
+        if any(predicate(command) for command in commands):
+            return received
+    raise TimeoutError(f"Expected command not received, got {[command.type for command in received]}")
+
+
+def receive_type(client: Client, message_type: common.MessageType, timeout: float = 5.0) -> List[common.Command]:
+    return receive_until(client, lambda command: command.type == message_type, timeout)
+
+
+def room_commands(commands: List[common.Command]) -> List[common.Command]:
+    return [command for command in commands if command.type > common.MessageType.COMMAND]
+
+
+def room_types(commands: List[common.Command]) -> List[common.MessageType]:
+    return [command.type for command in room_commands(commands)]
@@ -49,9 +49,8 @@ class Grabber:
                         attempts = 0
                         if command.type <= MessageType.COMMAND:
                             continue
-                        # Ignore command serial Id, that may not match
-                        command.id = 0
-                        self.streams.data[command.type].append(command.data)
+                        # Copy the payload out of the client receive buffer so that streams can be sorted and compared
+                        self.streams.data[command.type].append(bytes(command.data))
             except ClientDisconnectedException:
                 print("Grabber: disconnected before received command stream.", file=sys.stderr)
 